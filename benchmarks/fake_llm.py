@@ -0,0 +1,69 @@
+'''
+本地OpenAI兼容LLM替身：POST /v1/chat/completions，延迟与错误按配置的分布随机产生，支持stream
+'''
+import json
+import random
+import asyncio
+from aiohttp import web
+
+class FakeLLM:
+    '''LLM替身服务'''
+    def __init__(self, latency: float = 0.2, distribution: str = "lognormal", jitter: float = 0.5,
+                 error_rate: float = 0.0, error_status: int = 500, reply_chars: int = 60, seed: int = 0):
+        """
+        :param latency: 延迟的中位数，单位秒
+        :param distribution: fixed / uniform（latency*(1±jitter)）/ exponential / lognormal（sigma=jitter）
+        :param error_rate: 返回错误的概率
+        :param error_status: 错误时的状态码，429时附带Retry-After
+        :param reply_chars: 回复长度
+        """
+        self.latency = latency
+        self.distribution = distribution
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.reply_chars = reply_chars
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._completions)
+        return app
+
+    def sample_latency(self) -> float:
+        if self.distribution == "fixed":
+            return self.latency
+        if self.distribution == "uniform":
+            return max(0.0, self.random.uniform(self.latency * (1 - self.jitter), self.latency * (1 + self.jitter)))
+        if self.distribution == "exponential":
+            return self.random.expovariate(1 / self.latency) if self.latency > 0 else 0.0
+        return self.random.lognormvariate(0, self.jitter) * self.latency # 中位数为latency的长尾分布
+
+    async def _completions(self, request: web.Request):
+        payload = await request.json()
+        self.requests += 1
+        await asyncio.sleep(self.sample_latency())
+
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            headers = {"Retry-After": "1"} if self.error_status == 429 else {}
+            return web.json_response({"error": {"message": "fake error"}}, status=self.error_status, headers=headers)
+
+        content = ("喵" * self.reply_chars)[:self.reply_chars]
+        if not payload.get("stream"):
+            return web.json_response({
+                "id": f"cmpl-{self.requests}",
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i in range(0, len(content), 8):
+            chunk = {"choices": [{"index": 0, "delta": {"content": content[i:i + 8]}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
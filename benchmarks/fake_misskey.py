@@ -0,0 +1,212 @@
+'''
+本地Misskey替身：/streaming（WebSocket）、/api/notes/create、/api/notes/conversation、/api/notes/mentions、/api/drive/files/create、/api/drive/files/find-by-hash
+
+只实现bot用到的字段；收到的回复按replyId记录到达时间，供负载生成器计算端到端延迟
+'''
+import json
+import hashlib
+import time
+import asyncio
+import itertools
+from typing import Callable, Dict, List, Optional
+from aiohttp import web, WSMsgType
+
+class FakeMisskey:
+    '''Misskey替身服务'''
+    def __init__(self, bot_user_id: str = "bench-bot", conversation_depth: int = 2, note_rate: float = 0):
+        self.bot_user_id = bot_user_id
+        self.conversation_depth = conversation_depth # notes/conversation返回的祖先帖子数
+        self.note_rate = note_rate # notes/create每秒允许的请求数（0为不限），超出时与Misskey一样返回429
+        self._window = (0, 0) # (当前秒, 已用次数)
+        self.throttled = 0
+        self.order: List[str] = [] # 成功发帖的顺序（回复为replyId，其余为channelId）
+        self.sockets: List[web.WebSocketResponse] = []
+        self._transports: Dict[int, object] = {} # id(ws) -> 连接的传输，用于模拟半开连接
+        self.stalled: List[object] = []
+        self.subscriptions: Dict[str, str] = {} # 订阅ID -> 频道ID
+        self.replies: Dict[str, float] = {} # 被回复的帖子ID -> 回复到达时间
+        self.on_reply: Optional[Callable[[str, dict], None]] = None
+        self.mentions: List[dict] = [] # 推送过的提及（按时间顺序），notes/mentions从这里分页
+        self.created = 0
+        self.uploads = 0
+        self.upload_bytes = 0
+        self.drive: Dict[str, str] = {} # 网盘中文件的MD5 -> 文件ID
+        self.conversations = 0
+        self.connections = 0
+        self._ids = itertools.count()
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/streaming", self._streaming)
+        app.router.add_post("/api/notes/create", self._create)
+        app.router.add_post("/api/notes/conversation", self._conversation)
+        app.router.add_post("/api/notes/mentions", self._mentions)
+        app.router.add_post("/api/drive/files/create", self._upload)
+        app.router.add_post("/api/drive/files/find-by-hash", self._find_by_hash)
+        return app
+
+    # streaming
+    async def _streaming(self, request: web.Request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.sockets.append(ws)
+        self._transports[id(ws)] = request.transport
+        self.connections += 1
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                data = json.loads(msg.data)
+                body = data.get("body") or {}
+                if data.get("type") == "connect" and body.get("channel") == "channel":
+                    self.subscriptions[body.get("id")] = (body.get("params") or {}).get("channelId")
+                elif data.get("type") == "disconnect":
+                    self.subscriptions.pop(body.get("id"), None)
+        finally:
+            if ws in self.sockets:
+                self.sockets.remove(ws)
+            self._transports.pop(id(ws), None)
+        return ws
+
+    def mention_frame(self, note_id: str, channel_id: str, user: str, text: str = "你好") -> dict:
+        """构造一条经main频道推送的提及帧"""
+        return {
+            "type": "channel",
+            "body": {
+                "id": "main",
+                "type": "mention",
+                "body": {
+                    "id": note_id,
+                    "text": f"@bot {text}",
+                    "userId": f"u-{user}",
+                    "user": {"id": f"u-{user}", "username": user},
+                    "channel": {"id": channel_id},
+                    "channelId": channel_id,
+                    "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+                    "replyId": None,
+                },
+            },
+        }
+
+    async def push(self, frame: Optional[dict], raw: Optional[str] = None) -> int:
+        """向所有已连接的客户端推送一帧（raw不为None时原样发送，如重放录制的帧），返回推送到的连接数（没有连接时提及仍可通过notes/mentions取得）"""
+        body = (frame or {}).get("body") or {}
+        if body.get("type") == "mention":
+            self.mentions.append(body["body"])
+        raw = json.dumps(frame) if raw is None else raw
+        sockets = [ws for ws in self.sockets if not ws.closed]
+        await asyncio.gather(*(ws.send_str(raw) for ws in sockets), return_exceptions=True)
+        return len(sockets)
+
+    async def drop_connections(self):
+        """断开所有streaming连接，模拟网络中断"""
+        await asyncio.gather(*(ws.close() for ws in list(self.sockets)), return_exceptions=True)
+
+    def stall_connections(self):
+        """模拟半开连接：TCP不断开，但服务器不再读取（不回pong）也不再推送，客户端只能靠心跳超时发现"""
+        for ws in list(self.sockets):
+            transport = self._transports.pop(id(ws), None)
+            if transport is not None:
+                transport.pause_reading()
+                self.stalled.append(transport)
+            self.sockets.remove(ws)
+
+    async def release_stalled(self):
+        """中止所有半开连接，否则关闭服务器时会一直等待这些连接的处理函数返回"""
+        while self.stalled:
+            self.stalled.pop().abort()
+
+    # API
+    def _rate_limited(self) -> Optional[web.Response]:
+        """固定窗口限流，带X-RateLimit-*与Retry-After响应头"""
+        if self.note_rate <= 0:
+            return None
+        now = time.time()
+        second, used = self._window
+        if int(now) != second:
+            second, used = int(now), 0
+        reset = f"{second + 1 - now:.3f}"
+        if used >= self.note_rate:
+            self.throttled += 1
+            return web.json_response(
+                {"error": {"code": "RATE_LIMIT_EXCEEDED", "info": {"resetMs": float(reset) * 1000}}},
+                status=429, headers={"Retry-After": reset, "X-RateLimit-Remaining": "0", "X-RateLimit-Reset": reset},
+            )
+        self._window = (second, used + 1)
+        return None
+
+    async def _create(self, request: web.Request):
+        payload = await request.json()
+        limited = self._rate_limited()
+        if limited is not None:
+            return limited
+        missing = [file_id for file_id in payload.get("fileIds") or [] if file_id not in self.drive.values()]
+        if missing: # 与Misskey相同：附件不存在时拒绝发帖
+            return web.json_response(
+                {"error": {"code": "NO_SUCH_FILE", "message": "Some files are not found.", "info": {"fileIds": missing}}},
+                status=400,
+            )
+        self.created += 1
+        self.order.append(payload.get("replyId") or payload.get("channelId") or "")
+        note_id = f"r{next(self._ids)}"
+        reply_id = payload.get("replyId")
+        if reply_id is not None:
+            self.replies.setdefault(reply_id, time.perf_counter())
+            if self.on_reply is not None:
+                self.on_reply(reply_id, payload)
+        return web.json_response({"createdNote": {
+            "id": note_id,
+            "text": payload.get("text"),
+            "userId": self.bot_user_id,
+            "user": {"id": self.bot_user_id, "username": "bot"},
+            "replyId": reply_id,
+            "channelId": payload.get("channelId"),
+        }})
+
+    async def _conversation(self, request: web.Request):
+        payload = await request.json()
+        self.conversations += 1
+        note_id = payload.get("noteId", "")
+        notes = []
+        for i in range(self.conversation_depth): # 从新到旧，用户与bot交替
+            from_bot = i % 2 == 0
+            notes.append({
+                "id": f"{note_id}-a{i}",
+                "text": "上一轮的回复" if from_bot else "@bot 上一轮的提问",
+                "userId": self.bot_user_id if from_bot else "u-history",
+                "user": {"id": self.bot_user_id if from_bot else "u-history", "username": "bot" if from_bot else "history"},
+            })
+        return web.json_response(notes)
+
+    async def _mentions(self, request: web.Request):
+        """与Misskey相同：有sinceId时返回其后最早的limit条（从旧到新），否则返回最新的limit条（从新到旧）"""
+        payload = await request.json()
+        limit = min(int(payload.get("limit", 10)), 100)
+        since_id = payload.get("sinceId")
+        if since_id is not None:
+            ids = [note["id"] for note in self.mentions]
+            start = ids.index(since_id) + 1 if since_id in ids else 0
+            return web.json_response(self.mentions[start:start + limit])
+        return web.json_response(self.mentions[::-1][:limit])
+
+    async def _upload(self, request: web.Request):
+        size = 0
+        digest = hashlib.md5()
+        reader = await request.multipart()
+        async for part in reader:
+            while True:
+                chunk = await part.read_chunk()
+                if not chunk:
+                    break
+                if part.name == "file":
+                    size += len(chunk)
+                    digest.update(chunk)
+        self.uploads += 1
+        self.upload_bytes += size
+        file_id = self.drive.setdefault(digest.hexdigest(), f"f{next(self._ids)}")
+        return web.json_response({"id": file_id, "size": size, "md5": digest.hexdigest()})
+
+    async def _find_by_hash(self, request: web.Request):
+        payload = await request.json()
+        file_id = self.drive.get(payload.get("md5"))
+        return web.json_response([{"id": file_id, "md5": payload.get("md5")}] if file_id else [])
@@ -0,0 +1,382 @@
+'''
+离线基准测试：启动本地Misskey与LLM替身，按目标速率向N个频道注入提及，
+由真实的BotManager（run()所用的GroupManager/共享连接/工作线程池）或serve_async处理，统计吞吐、端到端延迟、内存与丢弃数
+
+用法（需aiohttp：pip install misskey-plugin-huaer-bot[async]）：
+    python benchmarks/load.py --channels 4 --rate 50 --duration 20
+    python benchmarks/load.py --mode async --rate 500 --llm-latency 0.5 --json result.json
+'''
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import toml
+from aiohttp import web
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_misskey import FakeMisskey
+from fake_llm import FakeLLM
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="misskey-plugin-huaer-bot 离线基准测试")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync", help="sync为BotManager（run()），async为serve_async（run_async()）")
+    parser.add_argument("--channels", type=int, default=4, help="频道数")
+    parser.add_argument("--users", type=int, default=100, help="发起提及的用户数")
+    parser.add_argument("--rate", type=float, default=20.0, help="目标提及速率，条/秒")
+    parser.add_argument("--duration", type=float, default=10.0, help="注入时长，单位秒")
+    parser.add_argument("--drain", type=float, default=30.0, help="注入结束后等待回复的最长时间，单位秒")
+    parser.add_argument("--workers", type=int, default=8, help="[misskey] workers")
+    parser.add_argument("--queue-size", type=int, default=1000, help="[misskey] queue_size")
+    parser.add_argument("--coalesce", type=float, default=0.0, help="[misskey] coalesce_window")
+    parser.add_argument("--max-age", type=float, default=None, help="[channels] max_age（默认沿用bot的默认值）")
+    parser.add_argument("--high-water", type=float, default=None, help="[misskey] high_water（默认沿用bot的默认值）")
+    parser.add_argument("--shed-mode", choices=("drop", "reply"), default=None, help="[misskey] shed_mode（默认沿用bot的默认值）")
+    parser.add_argument("--reply-ratio", type=float, default=0.0, help="回复bot的提及（对话的延续）所占比例，其余为新发起的提及")
+    parser.add_argument("--chaos", choices=("drop", "stall"), default=None, help="注入期间每隔--chaos-interval秒断开所有streaming连接（drop）或使其变为半开连接（stall）")
+    parser.add_argument("--chaos-interval", type=float, default=3.0, help="断开或半开的间隔，单位秒")
+    parser.add_argument("--ping-interval", type=float, default=None, help="[misskey] ping_interval（默认沿用bot的默认值）")
+    parser.add_argument("--ping-timeout", type=float, default=None, help="[misskey] ping_timeout（默认沿用bot的默认值）")
+    parser.add_argument("--reconnect-base", type=float, default=None, help="[misskey] reconnect_base（默认沿用bot的默认值）")
+    parser.add_argument("--stream", action="store_true", help="LLM流式接收")
+    parser.add_argument("--durable", action="store_true", help="启用持久化提及队列（SQLite WAL）")
+    parser.add_argument("--long-memory", action="store_true", help="启用长期记忆（索引写在临时目录中，各阶段耗时中的recall_seconds为检索耗时）")
+    parser.add_argument("--note-store", action=argparse.BooleanOptionalAction, default=True, help="是否启用回复链缓存")
+    parser.add_argument("--conversation-depth", type=int, default=2, help="notes/conversation返回的祖先帖子数")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="LLM延迟中位数，单位秒")
+    parser.add_argument("--llm-distribution", choices=("fixed", "uniform", "exponential", "lognormal"), default="lognormal")
+    parser.add_argument("--llm-jitter", type=float, default=0.5, help="uniform的相对抖动或lognormal的sigma")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="LLM返回错误的概率")
+    parser.add_argument("--llm-error-status", type=int, default=500, help="LLM错误状态码（429时附带Retry-After）")
+    parser.add_argument("--record", type=Path, default=None, help="同时把bot收到的streaming消息帧录制到该文件（[record]），可用replay.py重放")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, default=None, help="把结果另存为JSON")
+    parser.add_argument("--log", action="store_true", help="保留bot的INFO日志")
+    return parser.parse_args(argv)
+
+class Servers:
+    '''在后台事件循环中运行Misskey与LLM替身'''
+    def __init__(self, misskey: FakeMisskey, llm: FakeLLM):
+        self.misskey = misskey
+        self.llm = llm
+        self.loop = asyncio.new_event_loop()
+        self.misskey_url = ""
+        self.llm_url = ""
+        self._runners: List[web.AppRunner] = []
+        self._ready = threading.Event()
+        threading.Thread(target=self._run, name="bench-servers", daemon=True).start()
+        self._ready.wait()
+
+    async def _serve(self, app: web.Application) -> str:
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0) # 随机端口
+        await site.start()
+        self._runners.append(runner)
+        host, port = runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.misskey_url = self.loop.run_until_complete(self._serve(self.misskey.app()))
+        self.llm_url = self.loop.run_until_complete(self._serve(self.llm.app()))
+        self._ready.set()
+        self.loop.run_forever()
+
+    def call(self, coro):
+        """在替身的事件循环中执行协程并等待结果"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        async def cleanup():
+            for runner in self._runners:
+                await runner.cleanup()
+        self.call(cleanup())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+def write_config(directory: Path, args: argparse.Namespace, channels: List[str], misskey_url: str, llm_url: str,
+                 user_id: str = "bench-bot") -> Path:
+    """生成基准测试用的config.toml，关闭限流以测量处理能力本身"""
+    cfg = {
+        "api": {
+            "mod": "bench-model",
+            "url": f"{llm_url}/v1/chat/completions",
+            "stream": args.stream,
+            "headers": {"Authorization": "Bearer bench", "Content-Type": "application/json"},
+        },
+        "misskey": {
+            "user_id": user_id,
+            "channel_id": channels,
+            "instance_url": misskey_url,
+            "api_token": "bench-token",
+            "workers": args.workers,
+            "queue_size": args.queue_size,
+            "stats_interval": 0,
+            "user_rate": 0,
+            "global_rate": 0,
+            "coalesce_window": args.coalesce,
+        },
+        "note_store": {"enabled": args.note_store},
+        "durable": {"enabled": args.durable},
+        "long_memory": {"enabled": args.long_memory, "path": str(directory / "long_memory")},
+        "record": {"enabled": args.record is not None, "path": str(args.record.resolve()) if args.record is not None else ""},
+        "channels": {
+            "cooldown": 0,
+            "default_personality": "你是名叫华尔的猫娘。",
+            "max_token": 256,
+            "memory": [],
+            "rd": 6,
+        },
+    }
+    for key, value in (("high_water", args.high_water), ("shed_mode", args.shed_mode), ("ping_interval", args.ping_interval),
+                       ("ping_timeout", args.ping_timeout), ("reconnect_base", args.reconnect_base)):
+        if value is not None:
+            cfg["misskey"][key] = value
+    if args.max_age is not None:
+        cfg["channels"]["max_age"] = args.max_age
+    for cid in channels:
+        cfg[cid] = {"rd": 6}
+    path = directory / "config.toml"
+    with open(path, "w", encoding="utf-8") as f:
+        toml.dump(cfg, f)
+    return path
+
+async def generate(fake: FakeMisskey, channels: List[str], users: int, rate: float, duration: float, sent: Dict[str, float],
+                   reply_ratio: float = 0.0, replies_to_bot: Optional[set] = None, seed: int = 0):
+    """开环注入：按固定间隔推送提及，落后时立即补发，不等待回复；reply_ratio比例的提及是对bot帖子的回复"""
+    rng = random.Random(seed)
+    loop = asyncio.get_running_loop()
+    interval = 1 / rate
+    start = loop.time()
+    i = 0
+    while i * interval < duration:
+        delay = start + i * interval - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        note_id = f"m{i:08d}" # 与Misskey的ID一样按字典序即时间顺序
+        frame = fake.mention_frame(note_id, channels[i % len(channels)], f"user{i % users}")
+        if reply_ratio > 0 and rng.random() < reply_ratio:
+            note = frame["body"]["body"]
+            note["replyId"] = f"bot-{i:08d}"
+            note["reply"] = {"id": note["replyId"], "userId": "bench-bot", "text": "上一条回复"}
+            if replies_to_bot is not None:
+                replies_to_bot.add(note_id)
+        sent[note_id] = time.perf_counter()
+        await fake.push(frame)
+        i += 1
+
+async def chaos(fake: FakeMisskey, kind: str, interval: float, duration: float):
+    """每隔interval秒断开所有streaming连接或使其变为半开连接（漏掉的提及由断线补齐取回）"""
+    elapsed = interval
+    while elapsed < duration:
+        await asyncio.sleep(interval)
+        if kind == "drop":
+            await fake.drop_connections()
+        else:
+            fake.stall_connections()
+        elapsed += interval
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024 # macOS为字节，Linux为KB
+
+class SyncBot:
+    '''同步模式：与run()相同的BotManager'''
+    def __init__(self, channels: List[str]):
+        from misskey_plugin_huaer_bot import BotManager
+        self.bot = BotManager()
+        for cid in channels:
+            self.bot.add_channel(cid)
+
+    def start(self):
+        self.bot.start()
+
+    def dropped(self) -> int:
+        return self.bot.dispatcher.stats()["dropped"]
+
+    def stop(self):
+        self.bot.stop()
+
+class AsyncBot:
+    '''异步模式：在独立线程的事件循环中运行serve_async'''
+    def __init__(self, channels: List[str]):
+        from misskey_plugin_huaer_bot.aio import serve_async
+        self.channels = channels
+        self.serve_async = serve_async
+        self.loop = asyncio.new_event_loop()
+        self.task: Optional[asyncio.Task] = None
+        self.thread = threading.Thread(target=self._run, name="bench-bot", daemon=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.task = self.loop.create_task(self.serve_async(self.channels))
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+
+    def start(self):
+        self.thread.start()
+
+    def dropped(self) -> int:
+        from misskey_plugin_huaer_bot.metrics import metrics
+        return int(sum(c["value"] for c in metrics.snapshot()["counters"].get("dropped_total", [])))
+
+    def stop(self):
+        if self.task is not None:
+            self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join(timeout=10)
+
+def stage_summary(snapshot: dict) -> Dict[str, dict]:
+    """各处理阶段的耗时分位数（来自进程内指标）"""
+    summary = {}
+    for name, series in snapshot["histograms"].items():
+        for item in series:
+            label = ",".join(f"{k}={v}" for k, v in item["labels"].items())
+            summary[f"{name}{{{label}}}" if label else name] = {
+                "count": item["count"], "p50": item["p50"], "p95": item["p95"], "p99": item["p99"],
+            }
+    return summary
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    misskey = FakeMisskey(conversation_depth=args.conversation_depth)
+    llm = FakeLLM(args.llm_latency, args.llm_distribution, args.llm_jitter, args.llm_error_rate, args.llm_error_status, seed=args.seed)
+    servers = Servers(misskey, llm)
+    channels = [f"bench{i}" for i in range(args.channels)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["HUAER_BOT_CONFIG"] = str(write_config(Path(directory), args, channels, servers.misskey_url, servers.llm_url))
+        from misskey_plugin_huaer_bot.config import setup_logging
+        setup_logging()
+        if not args.log:
+            for name in ("MisskeyChannelBot", "MisskeyChannelIDFinder"):
+                logging.getLogger(name).setLevel(logging.WARNING)
+
+        from misskey_plugin_huaer_bot.metrics import metrics
+        metrics.enable()
+
+        bot = SyncBot(channels) if args.mode == "sync" else AsyncBot(channels)
+        bot.start()
+        deadline = time.time() + 10
+        while not misskey.sockets and time.time() < deadline: # 等待streaming连接建立
+            time.sleep(0.05)
+        time.sleep(0.2)
+
+        sent: Dict[str, float] = {}
+        replies_to_bot: set = set()
+        started = time.perf_counter()
+        load = generate(misskey, channels, args.users, args.rate, args.duration, sent, args.reply_ratio, replies_to_bot, args.seed)
+        if args.chaos:
+            async def with_chaos():
+                await asyncio.gather(load, chaos(misskey, args.chaos, args.chaos_interval, args.duration))
+            servers.call(with_chaos())
+        else:
+            servers.call(load)
+        injected = time.perf_counter() - started
+
+        deadline = time.time() + args.drain
+        while len(misskey.replies) < len(sent) and time.time() < deadline:
+            time.sleep(0.05)
+        finished = max(misskey.replies.values(), default=started)
+
+        dropped = bot.dropped()
+        bot.stop()
+        servers.call(misskey.release_stalled())
+        servers.close()
+
+    latencies = [misskey.replies[note_id] - at for note_id, at in sent.items() if note_id in misskey.replies]
+    elapsed = max(finished - started, 1e-9)
+    counters = metrics.snapshot()["counters"]
+    per_channel = lambda name: max((int(item["value"]) for item in counters.get(name, [])), default=0) # 同一连接上的各频道计数相同
+    shed: Dict[str, int] = {}
+    for item in counters.get("shed_total", []):
+        key = f"{item['labels']['reason']}/{item['labels']['priority']}"
+        shed[key] = shed.get(key, 0) + int(item["value"])
+    by_kind = {}
+    for kind, ids in (("reply", replies_to_bot), ("fresh", set(sent) - replies_to_bot)):
+        kind_latencies = [misskey.replies[note_id] - sent[note_id] for note_id in ids if note_id in misskey.replies]
+        if ids:
+            by_kind[kind] = {"sent": len(ids), "replied": len(kind_latencies), "p50": percentile(kind_latencies, 0.50), "p95": percentile(kind_latencies, 0.95)}
+    return {
+        "mode": args.mode,
+        "channels": args.channels,
+        "target_rate": args.rate,
+        "sent": len(sent),
+        "injected_rate": len(sent) / max(injected, 1e-9),
+        "replied": len(latencies),
+        "unanswered": len(sent) - len(latencies),
+        "dropped": dropped,
+        "shed": shed,
+        "by_kind": by_kind,
+        "throughput": len(latencies) / elapsed,
+        "latency": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies, default=None),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "llm": {"requests": llm.requests, "errors": llm.errors},
+        "misskey": {"notes_created": misskey.created, "conversation_calls": misskey.conversations, "connections": misskey.connections},
+        "stream": {"reconnects": per_channel("reconnects_total"), "dead": per_channel("dead_connections_total"),
+                   "caught_up": int(sum(item["value"] for item in counters.get("caught_up_total", [])))},
+        "stages": stage_summary(metrics.snapshot()),
+    }
+
+def _ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.1f}ms"
+
+def print_report(result: dict):
+    print(f"模式: {result['mode']}  频道: {result['channels']}  目标速率: {result['target_rate']:.1f}/s  实际注入: {result['injected_rate']:.1f}/s")
+    print(f"提及: 发送 {result['sent']}, 已回复 {result['replied']}, 未回复 {result['unanswered']}, 队列丢弃 {result['dropped']}")
+    if result["shed"]:
+        print("准入控制舍弃: " + ", ".join(f"{key} {count}" for key, count in sorted(result["shed"].items())))
+    if len(result["by_kind"]) > 1:
+        for kind, stats in result["by_kind"].items():
+            print(f"  {kind:<6} 发送 {stats['sent']}, 已回复 {stats['replied']}, p50 {_ms(stats['p50'])}, p95 {_ms(stats['p95'])}")
+    print(f"吞吐: {result['throughput']:.1f} 条/秒")
+    latency = result["latency"]
+    print(f"端到端延迟: p50 {_ms(latency['p50'])}, p95 {_ms(latency['p95'])}, p99 {_ms(latency['p99'])}, max {_ms(latency['max'])}")
+    if result["peak_rss_mb"] is not None:
+        print(f"峰值内存: {result['peak_rss_mb']:.1f} MB（含替身服务）")
+    stream = result["stream"]
+    if stream["reconnects"]:
+        print(f"连接: 建立 {result['misskey']['connections']}次, 重连 {stream['reconnects']}次, 其中半开 {stream['dead']}次, 断线补齐 {stream['caught_up']}条")
+    print(f"LLM: 请求 {result['llm']['requests']}, 错误 {result['llm']['errors']}; "
+          f"notes/conversation调用 {result['misskey']['conversation_calls']}")
+    for name, stage in sorted(result["stages"].items()):
+        print(f"  {name:<40} n={stage['count']:<6} p50 {_ms(stage['p50'])}  p95 {_ms(stage['p95'])}  p99 {_ms(stage['p99'])}")
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json is not None:
+        args.json.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+'''
+长期记忆基准测试：在临时目录中写入N条问答，统计追加速率、批量检索的p50/p95/p99延迟，以及后台压缩期间的检索延迟
+
+用法：
+    python benchmarks/recall.py --entries 10000 --searches 500
+    python benchmarks/recall.py --entries 2000 --no-numpy   # 纯Python检索（未安装numpy时的退路）
+'''
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from misskey_plugin_huaer_bot.config import setup_logging
+from misskey_plugin_huaer_bot.recall import LongTermMemory
+
+TOPICS = ["猫", "天气", "游戏", "音乐", "python", "旅行", "考试", "拉面", "动画", "misskey", "睡觉", "跑步"]
+WORDS = "今天明天昨天想要喜欢推荐一下为什么怎么办可以还是已经真的有点非常好像大家朋友周末晚上早上时间"
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="misskey-plugin-huaer-bot 长期记忆基准测试")
+    parser.add_argument("--entries", type=int, default=10000, help="写入的问答数")
+    parser.add_argument("--searches", type=int, default=500, help="检索次数")
+    parser.add_argument("--batch", type=int, default=3, help="每次检索合并的提及数")
+    parser.add_argument("--top-k", type=int, default=3, help="每次检索返回的条数")
+    parser.add_argument("--dim", type=int, default=256, help="向量维数")
+    parser.add_argument("--no-numpy", action="store_true", help="使用纯Python检索")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    parser.add_argument("--json", type=Path, default=None, help="把结果另存为JSON")
+    return parser.parse_args(argv)
+
+def sentence(rng: random.Random) -> str:
+    topic = rng.choice(TOPICS)
+    filler = "".join(rng.choice(WORDS) for _ in range(rng.randint(6, 20)))
+    return f"{filler[:len(filler) // 2]}{topic}{filler[len(filler) // 2:]}"
+
+def quantiles(samples: List[float]) -> dict:
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": ordered[-1] * 1000}
+
+def timed_searches(memory: LongTermMemory, rng: random.Random, args: argparse.Namespace, count: int) -> List[float]:
+    samples = []
+    for _ in range(count):
+        items = [(f"user{rng.randrange(50)}", sentence(rng)) for _ in range(args.batch)]
+        started = time.perf_counter()
+        memory.search("bench", items, args.top_k)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        memory = LongTermMemory(Path(directory), scope="channel", dim=args.dim, max_entries=args.entries,
+                                min_score=0.0, compact_interval=0, use_numpy=not args.no_numpy)
+
+        started = time.perf_counter()
+        for i in range(args.entries):
+            memory.remember("bench", [(f"user{i % 50}", sentence(rng))], sentence(rng))
+        append_seconds = time.perf_counter() - started
+
+        memory.search("bench", [("warmup", "预热")], args.top_k) # 首次检索建立内存映射
+        idle = timed_searches(memory, rng, args, args.searches)
+
+        # 覆盖四分之一的问题后在后台线程压缩，同时检索
+        for i in range(0, args.entries, 4):
+            memory.remember("bench", [("again", f"重复的问题{i % (args.entries // 8 or 1)}")], sentence(rng))
+        compaction = {}
+        def compact():
+            compaction["started"] = time.perf_counter()
+            memory.compact()
+            compaction["seconds"] = time.perf_counter() - compaction["started"]
+        thread = threading.Thread(target=compact)
+        thread.start()
+        during = []
+        while thread.is_alive():
+            during.extend(timed_searches(memory, rng, args, 1))
+        thread.join()
+        stats = memory.stats()
+        memory.close()
+        size = sum(f.stat().st_size for f in Path(directory).iterdir())
+
+    return {
+        "backend": "python" if args.no_numpy else "numpy",
+        "entries": args.entries,
+        "dim": args.dim,
+        "batch": args.batch,
+        "append_per_second": args.entries / append_seconds,
+        "search_ms": quantiles(idle),
+        "compaction_seconds": compaction["seconds"],
+        "search_during_compaction_ms": quantiles(during) if during else None,
+        "entries_after_compaction": stats["entries"],
+        "disk_mb": size / 1024 / 1024,
+    }
+
+def print_report(result: dict):
+    print(f"检索: {result['backend']}  条目: {result['entries']}  维数: {result['dim']}  每次合并提及: {result['batch']}")
+    print(f"追加: {result['append_per_second']:.0f} 条/秒")
+    search = result["search_ms"]
+    print(f"检索延迟: p50 {search['p50']:.2f}ms, p95 {search['p95']:.2f}ms, p99 {search['p99']:.2f}ms, max {search['max']:.2f}ms")
+    print(f"压缩: {result['compaction_seconds'] * 1000:.0f}ms, 压缩后 {result['entries_after_compaction']} 条, 磁盘 {result['disk_mb']:.1f} MB")
+    during = result["search_during_compaction_ms"]
+    if during:
+        print(f"压缩期间检索: p50 {during['p50']:.2f}ms, p95 {during['p95']:.2f}ms, max {during['max']:.2f}ms")
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    setup_logging()
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json is not None:
+        args.json.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+'''
+重放基准测试：把[record]（或 huaer-bot --record）录制的streaming消息帧按原有节奏、N倍速或最快速度送回bot，
+Misskey与LLM均为本地替身，输出吞吐、端到端延迟与各处理阶段耗时；--json保存结果，--baseline与另一版本的结果逐项比较
+
+用法（需aiohttp：pip install misskey-plugin-huaer-bot[async]）：
+    python benchmarks/replay.py stream.jsonl.gz                            # 原速
+    python benchmarks/replay.py stream.jsonl.gz --speed 10 --json new.json # 10倍速
+    python benchmarks/replay.py stream.jsonl.gz --speed 0 --feed direct    # 最快速度，跳过WebSocket直接调用共享连接的消息入口（仅sync）
+    python benchmarks/replay.py stream.jsonl.gz --baseline old.json --mode async --workers 16  # 其余参数同load.py
+    python benchmarks/load.py --rate 50 --duration 20 --record stream.jsonl.gz  # 没有线上录制时，先录一段合成负载
+'''
+import os
+import sys
+import gzip
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import load
+from load import Servers, SyncBot, AsyncBot, write_config, stage_summary, percentile, peak_rss_mb, _ms
+from fake_misskey import FakeMisskey
+from fake_llm import FakeLLM
+
+Frame = Tuple[float, str, Optional[dict]] # (录制时的接收时间, 原始消息, 解析后的帧；无法解析时为None)
+
+def parse_args(argv: Optional[List[str]] = None) -> Tuple[argparse.Namespace, argparse.Namespace]:
+    """返回(重放参数, 传给load.py的bot与替身参数)"""
+    parser = argparse.ArgumentParser(description="misskey-plugin-huaer-bot 录制重放基准测试，未列出的参数同 load.py --help")
+    parser.add_argument("recording", type=Path, help="录制文件（gzip压缩的JSON Lines）")
+    parser.add_argument("--speed", type=float, default=1.0, help="重放倍速，0为最快速度（不等待）")
+    parser.add_argument("--max-gap", type=float, default=5.0, help="相邻两帧的间隔最多按此秒数重放（跳过空闲时段与多次录制之间的空白）")
+    parser.add_argument("--limit", type=int, default=0, help="只重放前N帧（0为全部）")
+    parser.add_argument("--feed", choices=("stream", "direct"), default="stream",
+                        help="stream经替身的WebSocket推送（与线上相同的接收路径），direct在替身的事件循环中直接调用共享连接的_route（仅sync）")
+    parser.add_argument("--baseline", type=Path, default=None, help="另一版本的--json结果，打印逐项对比")
+    args, rest = parser.parse_known_args(argv)
+    bench = load.parse_args(rest)
+    if args.feed == "direct" and bench.mode != "sync":
+        parser.error("--feed direct 仅支持 --mode sync")
+    return args, bench
+
+def read_recording(path: Path) -> Iterator[dict]:
+    """依次读出录制文件中的头部（含"version"）与帧（含"t"与"m"），格式见misskey_plugin_huaer_bot/recorder.py；
+    在读取bot配置之前调用，因此不导入bot的模块。bot崩溃时末尾不完整的部分被忽略"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError: # 最后一行未写完
+                    print(f"跳过不完整的行: {line[:80]!r}", file=sys.stderr)
+        except (EOFError, gzip.BadGzipFile):
+            print("录制文件末尾不完整（bot未正常退出），已读到最后一次刷新为止", file=sys.stderr)
+
+def load_recording(path: Path, limit: int = 0) -> Tuple[dict, List[Frame]]:
+    """读出录制文件，返回(第一个头部, 按接收时间排序的帧)"""
+    header: dict = {}
+    frames: List[Frame] = []
+    for line in read_recording(path):
+        if "version" in line:
+            header = header or line
+            continue
+        try:
+            frame = json.loads(line["m"])
+        except json.JSONDecodeError:
+            frame = None
+        frames.append((line["t"], line["m"], frame if isinstance(frame, dict) else None))
+        if limit and len(frames) >= limit:
+            break
+    frames.sort(key=lambda item: item[0]) # 多个工作进程的录制合并后仍按时间重放
+    return header, frames
+
+def mention_of(frame: Optional[dict]) -> Optional[dict]:
+    if frame is None:
+        return None
+    body = frame.get("body") or {}
+    note = body.get("body")
+    return note if frame.get("type") == "channel" and body.get("type") == "mention" and isinstance(note, dict) else None
+
+def channels_of(header: dict, frames: List[Frame]) -> List[str]:
+    """录制中出现的频道：头部的频道列表加上帧中的频道"""
+    channels = dict.fromkeys(str(cid) for cid in header.get("channels", []))
+    for _, _, frame in frames:
+        body = (frame or {}).get("body") or {}
+        sub_id = str(body.get("id") or "")
+        if sub_id.startswith("channel_"):
+            channels[sub_id[len("channel_"):]] = None
+        note = mention_of(frame)
+        if note is not None and (note.get("channel") or {}).get("id"):
+            channels[str(note["channel"]["id"])] = None
+    return list(channels) or ["replay"]
+
+def retimed(frame: dict, note: dict, received: float) -> str:
+    """把提及的createdAt平移到现在，保留录制时从发帖到收到的延迟（否则旧帖子会被准入控制判为超时）"""
+    try:
+        lag = max(0.0, received - datetime.fromisoformat(note["createdAt"].replace("Z", "+00:00")).timestamp())
+    except (KeyError, AttributeError, ValueError):
+        lag = 0.0
+    note["createdAt"] = datetime.fromtimestamp(time.time() - lag, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    return json.dumps(frame, ensure_ascii=False)
+
+async def replay(frames: List[Frame], feed, speed: float, max_gap: float, bot_user_id: str, sent: Dict[str, float]) -> float:
+    """按录制的节奏送出各帧，落后时立即补发；返回按倍速折算后的计划时长（秒）"""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    offset, previous = 0.0, None
+    for received, raw, frame in frames:
+        if previous is not None:
+            offset += min(max(received - previous, 0.0), max_gap)
+        previous = received
+        if speed > 0:
+            delay = start + offset / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        note = mention_of(frame)
+        if note is not None:
+            raw = retimed(frame, note, received)
+            if note.get("id") and (note.get("user") or {}).get("id") != bot_user_id: # bot自己的帖子不会被回复
+                sent.setdefault(note["id"], time.perf_counter()) # 重复推送的提及按第一次计
+        await feed(raw, frame)
+    return offset / speed if speed > 0 else 0.0
+
+def run_replay(args: argparse.Namespace, bench: argparse.Namespace) -> dict:
+    header, frames = load_recording(args.recording, args.limit)
+    if not frames:
+        raise SystemExit(f"录制文件中没有消息帧: {args.recording}")
+    bot_user_id = header.get("user_id") or "bench-bot"
+    channels = channels_of(header, frames)
+    misskey = FakeMisskey(bot_user_id=bot_user_id, conversation_depth=bench.conversation_depth)
+    llm = FakeLLM(bench.llm_latency, bench.llm_distribution, bench.llm_jitter, bench.llm_error_rate, bench.llm_error_status, seed=bench.seed)
+    servers = Servers(misskey, llm)
+    bench.record = None # 重放时不再录制
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["HUAER_BOT_CONFIG"] = str(write_config(Path(directory), bench, channels, servers.misskey_url, servers.llm_url, bot_user_id))
+        from misskey_plugin_huaer_bot.config import setup_logging
+        setup_logging()
+        if not bench.log:
+            for name in ("MisskeyChannelBot", "MisskeyChannelIDFinder"):
+                logging.getLogger(name).setLevel(logging.WARNING)
+
+        from misskey_plugin_huaer_bot.metrics import metrics
+        metrics.enable()
+
+        bot = SyncBot(channels) if bench.mode == "sync" else AsyncBot(channels)
+        bot.start()
+        deadline = time.time() + 10
+        while not misskey.sockets and time.time() < deadline: # 等待streaming连接建立与订阅
+            time.sleep(0.05)
+        time.sleep(0.2)
+
+        if args.feed == "direct":
+            stream = next(iter(bot.bot.streams.values()))
+            async def feed(raw: str, frame: Optional[dict]):
+                stream._route(raw)
+        else:
+            async def feed(raw: str, frame: Optional[dict]):
+                await misskey.push(frame, raw)
+
+        sent: Dict[str, float] = {}
+        started = time.perf_counter()
+        planned = servers.call(replay(frames, feed, args.speed, args.max_gap, bot_user_id, sent))
+        replayed = time.perf_counter() - started
+
+        deadline = time.time() + bench.drain
+        while len(set(sent) & set(misskey.replies)) < len(sent) and time.time() < deadline:
+            time.sleep(0.05)
+        finished = max((misskey.replies[note_id] for note_id in sent if note_id in misskey.replies), default=started)
+
+        dropped = bot.dropped()
+        bot.stop()
+        servers.close()
+
+    latencies = [misskey.replies[note_id] - at for note_id, at in sent.items() if note_id in misskey.replies]
+    counters = metrics.snapshot()["counters"]
+    count = lambda name: int(sum(item["value"] for item in counters.get(name, [])))
+    recorded = frames[-1][0] - frames[0][0]
+    return {
+        "recording": str(args.recording),
+        "mode": bench.mode,
+        "feed": args.feed,
+        "speed": args.speed,
+        "channels": len(channels),
+        "frames": len(frames),
+        "malformed": sum(1 for _, _, frame in frames if frame is None),
+        "recorded_seconds": recorded,
+        "planned_seconds": planned,
+        "replay_seconds": replayed,
+        "mentions": len(sent),
+        "duplicates": count("duplicates_total"),
+        "replied": len(latencies),
+        "unanswered": len(sent) - len(latencies),
+        "dropped": dropped,
+        "shed": count("shed_total"),
+        "throughput": len(latencies) / max(finished - started, 1e-9),
+        "latency": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies, default=None),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "llm": {"requests": llm.requests, "errors": llm.errors},
+        "stages": stage_summary(metrics.snapshot()),
+    }
+
+def _delta(old: Optional[float], new: Optional[float], scale: float = 1000, unit: str = "ms") -> str:
+    if old is None or new is None:
+        return "-"
+    change = f" ({(new - old) / old:+.0%})" if old else ""
+    return f"{old * scale:.1f}{unit} → {new * scale:.1f}{unit}{change}"
+
+def print_report(result: dict, baseline: Optional[dict] = None):
+    print(f"录制: {result['recording']}  帧 {result['frames']}（无法解析 {result['malformed']}）  频道 {result['channels']}  "
+          f"录制时长 {result['recorded_seconds']:.1f}秒")
+    speed = "最快" if result["speed"] <= 0 else f"{result['speed']:g}倍速（计划 {result['planned_seconds']:.1f}秒）"
+    print(f"重放: {result['mode']}/{result['feed']}  {speed}  实际 {result['replay_seconds']:.1f}秒")
+    print(f"提及: {result['mentions']}, 已回复 {result['replied']}, 未回复 {result['unanswered']}, "
+          f"重复 {result['duplicates']}, 队列丢弃 {result['dropped']}, 准入控制舍弃 {result['shed']}")
+    print(f"吞吐: {result['throughput']:.1f} 条/秒")
+    latency = result["latency"]
+    print(f"端到端延迟: p50 {_ms(latency['p50'])}, p95 {_ms(latency['p95'])}, p99 {_ms(latency['p99'])}, max {_ms(latency['max'])}")
+    if result["peak_rss_mb"] is not None:
+        print(f"峰值内存: {result['peak_rss_mb']:.1f} MB（含替身服务）")
+    print(f"LLM: 请求 {result['llm']['requests']}, 错误 {result['llm']['errors']}")
+    for name, stage in sorted(result["stages"].items()):
+        print(f"  {name:<40} n={stage['count']:<6} p50 {_ms(stage['p50'])}  p95 {_ms(stage['p95'])}  p99 {_ms(stage['p99'])}")
+    if baseline is None:
+        return
+
+    print(f"\n对比 {baseline.get('recording')}（{baseline.get('mode')}/{baseline.get('feed')}）→ 本次:")
+    print(f"  {'吞吐':<38} {_delta(baseline['throughput'], result['throughput'], 1, '条/秒')}")
+    for q in ("p50", "p95", "p99"):
+        print(f"  {'端到端 ' + q:<40} {_delta(baseline['latency'][q], result['latency'][q])}")
+    for name in sorted(set(baseline["stages"]) & set(result["stages"])):
+        old, new = baseline["stages"][name], result["stages"][name]
+        print(f"  {name:<40} p50 {_delta(old['p50'], new['p50'])}  p95 {_delta(old['p95'], new['p95'])}")
+
+def main(argv: Optional[List[str]] = None):
+    args, bench = parse_args(argv)
+    result = run_replay(args, bench)
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline is not None else None
+    print_report(result, baseline)
+    if bench.json is not None:
+        bench.json.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
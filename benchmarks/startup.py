@@ -0,0 +1,136 @@
+'''
+冷启动基准测试：每次在新的解释器进程中导入本包或执行 huaer-bot --profile-startup（到建立连接之前为止），
+统计各启动方式的耗时与峰值内存，用于跟踪导入与初始化的开销
+
+用法：
+    python benchmarks/startup.py --runs 20 --channels 50
+    python benchmarks/startup.py --importtime          # 另外列出线程模式下自身耗时最多的模块（python -X importtime）
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import toml
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="misskey-plugin-huaer-bot 冷启动基准测试")
+    parser.add_argument("--runs", type=int, default=10, help="每种启动方式的重复次数")
+    parser.add_argument("--channels", type=int, default=10, help="配置中的频道数")
+    parser.add_argument("--modes", nargs="+", default=["interpreter", "import", "thread", "async", "shard"],
+                        choices=("interpreter", "import", "thread", "async", "shard"), help="要测量的启动方式")
+    parser.add_argument("--importtime", action="store_true", help="列出线程模式下自身导入耗时最多的模块")
+    parser.add_argument("--json", type=Path, default=None, help="把结果另存为JSON")
+    return parser.parse_args(argv)
+
+def write_config(directory: Path, channels: List[str]) -> Path:
+    """生成只用于启动的config.toml（不会建立连接）"""
+    cfg = {
+        "api": {"mod": "bench-model", "url": "http://127.0.0.1:9/v1/chat/completions"},
+        "misskey": {
+            "user_id": "bench-bot",
+            "channel_id": channels,
+            "instance_url": "http://127.0.0.1:9",
+            "api_token": "bench-token",
+            "stats_interval": 0,
+        },
+        "channels": {"default_personality": "你是名叫华尔的猫娘。"},
+    }
+    for cid in channels:
+        cfg[cid] = {"rd": 6}
+    path = directory / "config.toml"
+    with open(path, "w", encoding="utf-8") as f:
+        toml.dump(cfg, f)
+    return path
+
+def command(mode: str, config_path: Path) -> List[str]:
+    if mode == "interpreter":
+        return [sys.executable, "-c", "pass"]
+    if mode == "import":
+        return [sys.executable, "-c", "import misskey_plugin_huaer_bot"]
+    return [sys.executable, "-m", "misskey_plugin_huaer_bot", "--config", str(config_path),
+            "--mode", mode, "--profile-startup", "--log-level", "WARNING"]
+
+def run_once(cmd: List[str], env: Dict[str, str]) -> Tuple[float, Optional[float]]:
+    """运行一次，返回(墙钟秒数, 峰值内存MB)；峰值内存取自子进程自身的rusage"""
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - started
+        proc.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status
+        peak = usage.ru_maxrss / 1024 / 1024 if sys.platform == "darwin" else usage.ru_maxrss / 1024
+    else: # Windows
+        proc.wait()
+        elapsed, peak = time.perf_counter() - started, None
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} 退出码 {proc.returncode}: {proc.stderr.read().decode('utf-8', 'replace')}")
+    proc.stderr.close()
+    return elapsed, peak
+
+def import_hotspots(config_path: Path, env: Dict[str, str], top: int = 15) -> List[Tuple[str, float]]:
+    """python -X importtime 中自身耗时最多的模块"""
+    cmd = [sys.executable, "-X", "importtime"] + command("thread", config_path)[1:]
+    output = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True).stderr
+    spots = []
+    for line in output.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            parts = line[len("import time:"):].split("|")
+            if parts[0].strip().isdigit():
+                spots.append((parts[2].strip(), int(parts[0]) / 1e6))
+    return sorted(spots, key=lambda item: item[1], reverse=True)[:top]
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    env.pop("HUAER_BOT_CONFIG", None)
+    channels = [f"bench{i}" for i in range(args.channels)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = write_config(Path(directory), channels)
+        for mode in args.modes: # 预热一次，生成字节码缓存（与安装后的情形一致）
+            run_once(command(mode, config_path), env)
+
+        result = {"python": sys.version.split()[0], "runs": args.runs, "channels": args.channels, "modes": {}}
+        samples: Dict[str, List[Tuple[float, Optional[float]]]] = {mode: [] for mode in args.modes}
+        for _ in range(args.runs): # 各方式交替运行，减少机器状态漂移的影响
+            for mode in args.modes:
+                samples[mode].append(run_once(command(mode, config_path), env))
+        for mode in args.modes:
+            times = sorted(elapsed for elapsed, _ in samples[mode])
+            peaks = [peak for _, peak in samples[mode] if peak is not None]
+            result["modes"][mode] = {
+                "min": times[0],
+                "median": statistics.median(times),
+                "max": times[-1],
+                "peak_rss_mb": max(peaks) if peaks else None,
+            }
+        if args.importtime:
+            result["hotspots"] = import_hotspots(config_path, env)
+    return result
+
+def print_report(result: dict):
+    print(f"Python {result['python']}  频道: {result['channels']}  每项 {result['runs']} 次（新进程，含解释器启动）")
+    for mode, stats in result["modes"].items():
+        peak = "-" if stats["peak_rss_mb"] is None else f"{stats['peak_rss_mb']:.1f} MB"
+        print(f"  {mode:<12} min {stats['min'] * 1000:7.1f}ms  median {stats['median'] * 1000:7.1f}ms  max {stats['max'] * 1000:7.1f}ms  峰值内存 {peak}")
+    for name, seconds in result.get("hotspots", []):
+        print(f"    {name:<50} {seconds * 1000:6.1f}ms")
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json is not None:
+        args.json.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
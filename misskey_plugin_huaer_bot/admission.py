@@ -0,0 +1,79 @@
+import time
+import logging
+import threading
+from typing import Dict, Optional
+from .note_store import note_store
+from .config import USER_ID, HIGH_WATER
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+REPLY_TO_BOT, FRESH, THREAD = 0, 1, 2 # 削峰优先级，数字大的先被舍弃
+PRIORITY_NAMES = ("reply", "fresh", "thread")
+REASONS = {"expired": "超时", "overload": "过载"} # 舍弃原因：来不及在期限内回复 / 积压超过高水位
+
+def mention_priority(note: dict, bot_user_id: str = USER_ID) -> int:
+    """提及的优先级：回复bot的帖子（对话的延续）> 新发起的提及 > 别人讨论串中顺带的提及"""
+    reply_id = note.get('replyId')
+    if not reply_id:
+        return FRESH
+    parent = note.get('reply') or (note_store.get(reply_id) if note_store is not None else None) or {}
+    parent_user = parent.get('userId') or (parent.get('user') or {}).get('id')
+    return REPLY_TO_BOT if parent_user == bot_user_id else THREAD
+
+class AdmissionController:
+    '''
+    准入控制类：提及在交给ChatHandler之前检查，不值得处理的提及直接舍弃或以固定回复应答，不请求LLM
+    1. 期限：帖子创建max_age秒后仍未开始处理、或按近期处理耗时已来不及在期限内回复的提及
+    2. 过载：待处理队列的占用率超过高水位后，按优先级从低到高依次舍弃，越接近满越只保留高优先级
+    '''
+    def __init__(self, high_water: float = HIGH_WATER, alpha: float = 0.2):
+        self.high_water = min(max(high_water, 0.0), 1.0)
+        self.alpha = alpha # 处理耗时指数滑动平均的权重
+        self.service_time = 0.0 # 近期处理一条提及的耗时（秒）
+        self.admitted = 0
+        self.shed: Dict[str, Dict[str, int]] = {} # 频道 -> 舍弃原因 -> 条数
+        self._lock = threading.Lock()
+
+    def shed_level(self, priority: int) -> float:
+        """该优先级的提及被舍弃时的队列占用率；最高优先级只在队列满时由分发器丢弃"""
+        if priority <= REPLY_TO_BOT:
+            return float("inf")
+        return self.high_water + (1 - self.high_water) * (THREAD - priority) / THREAD
+
+    def check(self, created: float, priority: int, max_age: float, backlog: float) -> Optional[str]:
+        """
+        :param created: 帖子创建时间戳（合并的多条取最新一条），0为未知
+        :param priority: 优先级（合并的多条取最高）
+        :param max_age: 回复期限，单位秒（0为不限）
+        :param backlog: 待处理队列的占用率（0~1）
+        :return: None表示接纳，否则为舍弃原因（"expired"或"overload"）
+        """
+        if max_age > 0 and created > 0:
+            reserve = min(self.service_time, max_age / 2) # 预留处理耗时，最多按期限的一半计，避免慢后端时全部舍弃
+            if time.time() + reserve > created + max_age:
+                return "expired"
+        if self.high_water < 1 and backlog >= self.shed_level(priority):
+            return "overload"
+        with self._lock:
+            self.admitted += 1
+        return None
+
+    def observe(self, seconds: float):
+        """记录一条接纳的提及的处理耗时"""
+        with self._lock:
+            self.service_time = seconds if self.service_time == 0 else self.service_time + self.alpha * (seconds - self.service_time)
+
+    def record(self, channel: str, reason: str, count: int = 1):
+        with self._lock:
+            counts = self.shed.setdefault(channel, {})
+            counts[reason] = counts.get(reason, 0) + count
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "admitted": self.admitted,
+                "service_time": self.service_time,
+                "shed": {channel: dict(counts) for channel, counts in self.shed.items()},
+            }
+
+admission = AdmissionController() # 进程级共享准入控制
@@ -0,0 +1,671 @@
+import os
+import time
+import json
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+from .config import (
+    ChatConfig, setup_logging, CHANNEL_ID, USER_ID, STREAM,
+    HTTP_MAX_HOSTS, HTTP_PER_HOST, CONNECT_TIMEOUT, LLM_TIMEOUT, MISSKEY_TIMEOUT,
+    LLM_RETRIES, HEDGE, METRICS_ENABLED, METRICS_HOST, METRICS_PORT,
+    CATCHUP_RATE, CATCHUP_MAX, UPLOAD_PARALLELISM, UPLOAD_RETRIES,
+)
+from .chat import ChatHandler, LIMITED
+from .poster import MisskeyPoster
+from .dispatcher import AsyncMentionDispatcher
+from .coalescer import AsyncMentionCoalescer
+from .router import Backend, backend_router
+from .metrics import metrics, timed
+from .reload import ConfigWatcher, plan_reload
+from .durable import durable_queue
+from .admission import admission
+from .drive import drive_cache
+from .recall import long_memory
+from .recorder import stream_recorder
+from .outbox import AsyncNoteScheduler, REPLY, NOTE, rate_gate
+from . import config
+from .connector import (
+    MisskeyNotificationListener, MisskeyStreamManager,
+    MAIN_CONNECT_MSG,
+)
+from .supervisor import connect_options
+
+try: # 异步模式依赖aiohttp（pip install misskey-plugin-huaer-bot[async]）
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try: # websockets>=13 的原生asyncio客户端
+    from websockets.asyncio.client import connect
+except ImportError:
+    from websockets import connect
+from websockets.exceptions import ConnectionClosedOK
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+def _require_aiohttp():
+    if aiohttp is None:
+        raise ImportError("异步模式需要aiohttp，请执行 pip install misskey-plugin-huaer-bot[async]")
+
+class AsyncChatHandler(ChatHandler):
+    '''异步对话响应类，请求体构造与记忆管理复用ChatHandler'''
+    def __init__(self, conf: ChatConfig, session: "aiohttp.ClientSession"):
+        super().__init__(conf)
+        self.session = session
+
+    async def _call_api_stream(self, payload: dict, backend: Backend):
+        """流式调用LLM，达到上限时关闭连接，让服务端停止生成"""
+        started = time.time()
+        read_timeout = min(LLM_TIMEOUT, self.conf.deadline) if self.conf.deadline else LLM_TIMEOUT
+        parts: List[str] = []
+        truncated = False
+        async with self.session.post(
+            backend.url,
+            json=dict(payload, stream=True),
+            headers=backend.headers,
+            timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=read_timeout)
+        ) as response:
+            try:
+                response.raise_for_status()
+                async for line in response.content:
+                    truncated = self._stream_feed(parts, line, started)
+                    if truncated is not None:
+                        break
+            except asyncio.TimeoutError:
+                if not parts:
+                    raise
+                truncated = True
+            finally:
+                response.close()
+        return self._stream_result(parts, truncated)
+
+    # LLM调用函数
+    async def _call_api(self, memo: List, backend: Backend):
+        payload = self._build_payload(memo, backend.model)
+        started = time.time()
+
+        try:
+            if STREAM:
+                result = await self._call_api_stream(payload, backend)
+            else:
+                async with self.session.post(
+                    backend.url,
+                    json=payload,
+                    headers=backend.headers,
+                    timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=LLM_TIMEOUT)
+                ) as response:
+                    response.raise_for_status()
+                    result = await response.json()
+            backend_router.release(backend, True, time.time() - started)
+            return result
+        except asyncio.CancelledError:
+            backend_router.abandon(backend)
+            raise
+        except aiohttp.ClientResponseError as e:
+            self._call_failed(backend, started, e, e.status, e.headers)
+            return None
+        except Exception as e:
+            self._call_failed(backend, started, e)
+            return None
+
+    async def _hedged_call(self, mem: List, backend: Backend):
+        """对冲请求：首个请求超过该后端的p95仍未返回时，向另一个后端再发一个，取先返回的成功结果，另一个取消"""
+        first = asyncio.ensure_future(self._call_api(mem, backend))
+        done, _ = await asyncio.wait([first], timeout=backend.breaker.hedge_delay())
+        if done:
+            return first.result()
+
+        other = backend_router.pick(self.conf.backend, exclude=[backend])
+        if other is None or self._take_backend(other, 0.0) is None: # 对冲请求不等待限流
+            return await first
+        logger.info(f"后端[{backend.name}]响应较慢，向后端[{other.name}]发出对冲请求")
+        pending = {first, asyncio.ensure_future(self._call_api(mem, other))}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    response = task.result()
+                    if response:
+                        return response
+            return None
+        finally:
+            for task in pending: # 取消较慢的请求，连接随之关闭
+                task.cancel()
+
+    async def _guarded_call(self, mem: List):
+        """由路由挑选后端并调用LLM，无可用后端时返回None，该后端的API Key被限流时返回LIMITED"""
+        backend = backend_router.pick(self.conf.backend)
+        if backend is None:
+            return None
+        wait = self._take_backend(backend, self._max_wait())
+        if wait is None:
+            return LIMITED
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                backend_router.abandon(backend)
+                raise
+        return await (self._hedged_call(mem, backend) if HEDGE else self._call_api(mem, backend))
+
+    @timed("conversation_fetch_seconds")
+    async def _get_conversation_chain(self, note_id, bot_user_id = USER_ID, length: Optional[int] = None):
+        '''消息链获取函数，用于构建记忆；length默认为频道的rd'''
+        length = self.conf.rd if length is None else length
+        chain = self._cached_chain(note_id, bot_user_id, length) # 优先从本地回复链缓存重建
+        if chain is not None:
+            return chain
+
+        api_url, payload = self._chain_request(note_id)
+        try:
+            async with self.session.post(
+                api_url,
+                json=payload,
+                timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=MISSKEY_TIMEOUT)
+            ) as response:
+                response.raise_for_status()
+                data = await response.json()
+        except Exception as e:
+            logger.error(f"API请求失败: {e}")
+            return []
+        return self._chain_from(data, bot_user_id, length)
+
+    async def handle_chat(self, name, input, note_id: str) -> Optional[str]:
+        """处理对话请求，返回None表示不回复"""
+        return await self.handle_batch([(name, input)], note_id)
+
+    async def handle_batch(self, items: List[Tuple[str, str]], note_id: str) -> Optional[str]:
+        """处理(用户, 内容)列表组成的对话请求，note_id为最新一条提及"""
+
+        # API调用限制检查
+        wait, notice = self._check_api_limit(items[-1][0])
+        if wait is None:
+            return notice
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        # 生成整个记忆，命中回复缓存时无需请求LLM
+        mem, key, cached = self._prepare(items, await self._get_conversation_chain(note_id))
+        if cached is not None:
+            return cached
+
+        # 执行API请求（所有后端均熔断或限流时快速失败，失败后抖动退避重试）
+        response = None
+        for attempt in range(LLM_RETRIES):
+            if not self._can_call():
+                break
+            with metrics.timer("llm_call_seconds", retry=attempt):
+                response = await self._guarded_call(mem)
+            if response is LIMITED:
+                return self._backend_limited(items[-1][0])
+            if response :
+                break
+            delay = self._retry_delay(attempt)
+            if delay is not None:
+                await asyncio.sleep(delay)
+
+        # 处理响应
+        return self._finish(items, key, response)
+
+class AsyncMisskeyPoster(MisskeyPoster):
+    '''异步信息发送类'''
+    def __init__(self, session: "aiohttp.ClientSession", api_token: str = None, scheduler: AsyncNoteScheduler = None):
+        super().__init__(api_token)
+        self.session = session
+        self.outbox = scheduler or AsyncNoteScheduler()
+
+    async def _request_note(self, payload: dict):
+        async with self.session.post(
+            self.api_endpoint,
+            json=payload,
+            timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=MISSKEY_TIMEOUT)
+        ) as response:
+            try:
+                body = await response.json(content_type=None)
+            except ValueError:
+                body = await response.text()
+            self._note_sent(response.status, body, payload)
+            return response.status, response.headers, body
+
+    @staticmethod
+    def _retryable(e: Exception) -> bool:
+        return isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+    def submit_note(self, text, visibility="public", cw=None, priority: Optional[int] = None, **kwargs) -> "asyncio.Future":
+        """把帖子交给发帖调度器，返回以新帖子ID（失败时为None）完成的Task，参数同MisskeyPoster.submit_note"""
+        if priority is None:
+            priority = REPLY if kwargs.get('replyId') else NOTE
+        sent = self.outbox.submit(self, self._build_payload(text, visibility, cw, **kwargs), priority)
+
+        async def created_id():
+            return self._created_id(await sent)
+
+        return asyncio.ensure_future(created_id())
+
+    async def send_note(self, text, visibility="public", cw=None, **kwargs):
+        """发送帖子到 Misskey 并等待结果，参数同MisskeyPoster.send_note"""
+        priority = REPLY if kwargs.get('replyId') else NOTE
+        return await self.outbox.submit(self, self._build_payload(text, visibility, cw, **kwargs), priority)
+
+    async def send_note_with_files(self, text, file_paths: List[str], visibility="public", cw=None, **kwargs):
+        """上传附件后发帖并等待结果，参数同MisskeyPoster.send_note_with_files"""
+        file_ids = await self.upload_files(file_paths)
+        if None in file_ids:
+            logger.error("附件上传失败，未发帖")
+            return None
+        result = await self.send_note(text, visibility, cw, fileIds=file_ids, **kwargs)
+        if result is None:
+            retry_ids = await self.upload_files(file_paths)
+            if self._should_reupload(file_ids, retry_ids):
+                result = await self.send_note(text, visibility, cw, fileIds=retry_ids, **kwargs)
+        return result
+
+    @timed("upload_file_seconds")
+    async def upload_file(self, file_path) -> Optional[str]:
+        """上传文件到 Misskey Drive（先查本地缓存与find-by-hash），返回文件ID或None"""
+        try: # 大文件的哈希计算不占用事件循环
+            md5 = await asyncio.get_running_loop().run_in_executor(None, drive_cache.md5, file_path)
+        except OSError as e:
+            logger.error(f"文件读取失败: {e}")
+            return None
+
+        file_id = drive_cache.get(self.account, md5)
+        source = "cache"
+        if file_id is None:
+            file_id, source = await self._find_by_hash(md5), "hash"
+        if file_id is None:
+            file_id, source = await self._upload(file_path), "upload"
+        return self._drive_found(md5, file_id, source)
+
+    async def upload_files(self, file_paths: List[str]) -> List[Optional[str]]:
+        unique = list(dict.fromkeys(file_paths))
+        semaphore = asyncio.Semaphore(max(1, UPLOAD_PARALLELISM))
+
+        async def upload(path):
+            async with semaphore:
+                return await self.upload_file(path)
+
+        ids = dict(zip(unique, await asyncio.gather(*(upload(path) for path in unique))))
+        return [ids[path] for path in file_paths]
+
+    async def _find_by_hash(self, md5: str) -> Optional[str]:
+        gate = rate_gate(self.find_url)
+        try:
+            await asyncio.sleep(gate.delay())
+            async with self.session.post(
+                self.find_url,
+                json={"i": self.api_token, "md5": md5},
+                timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=MISSKEY_TIMEOUT)
+            ) as response:
+                gate.update(response.status, response.headers)
+                response.raise_for_status()
+                files = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"按哈希查找网盘文件失败: {e}")
+            return None
+        return files[0].get('id') if files else None
+
+    async def _upload(self, file_path) -> Optional[str]:
+        """文件对象由aiohttp按块读取发送，不整体读入内存"""
+        gate = rate_gate(self.upload_url)
+        for attempt in range(UPLOAD_RETRIES + 1):
+            try:
+                await asyncio.sleep(gate.delay())
+                with open(file_path, 'rb') as f:
+                    form = aiohttp.FormData()
+                    form.add_field('i', self.api_token)
+                    form.add_field('file', f, filename=os.path.basename(file_path))
+                    async with self.session.post(
+                        self.upload_url,
+                        data=form,
+                        timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=MISSKEY_TIMEOUT)
+                    ) as response:
+                        gate.update(response.status, response.headers)
+                        if response.status != 429 and response.status < 500:
+                            response.raise_for_status()
+                            return (await response.json()).get('id')
+                        error = f"HTTP {response.status}"
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+            except (aiohttp.ClientError, OSError, ValueError) as e:
+                logger.error(f"文件上传失败: {e}")
+                return None
+
+            delay = self._upload_retry(attempt, error)
+            if delay is None:
+                return None
+            await asyncio.sleep(delay)
+
+class AsyncMisskeyNotificationListener(MisskeyNotificationListener):
+    '''异步服务器监听类，每条提及作为独立任务并发处理'''
+    def __init__(self, channel_id: Optional[str], chat: AsyncChatHandler, poster: AsyncMisskeyPoster, api_token: str = None):
+        super().__init__(channel_id, chat, poster, api_token)
+        self.tasks: Set[asyncio.Task] = set() # 处理中的提及
+
+    def _new_coalescer(self) -> AsyncMentionCoalescer:
+        return AsyncMentionCoalescer(self._submit)
+
+    def _submit(self, notes: List[dict]):
+        queued = time.perf_counter()
+        if self.dispatcher is not None:
+            if not self.dispatcher.submit(notes[0], self._process, notes, queued):
+                metrics.inc("dropped_total", len(notes), channel=self.channel_label)
+                self._settle(note.get('id') for note in notes)
+            return
+        task = asyncio.get_running_loop().create_task(self._process(notes, queued))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _process(self, notes: List[dict], queued: float):
+        try:
+            reason, priority = self._admit(notes, queued)
+            if reason is not None:
+                return await self._shed(notes, reason, priority)
+            started = time.perf_counter()
+            try:
+                await self.on_mentions(notes)
+            except Exception:
+                metrics.inc("failures_total", channel=self.channel_label)
+                raise
+            finally:
+                admission.observe(time.perf_counter() - started)
+        finally: # 回复已在本协程内发送完成
+            self._settle(note.get('id') for note in notes)
+
+    async def _reply(self, mentions: str, reply: Optional[str], note_id: str, batch: Optional[List[str]] = None):
+        """发送回复，reply为None时不回复；成功或跳过后把batch（默认为note_id）标记为已处理"""
+        if reply is None:
+            return self._skipped(note_id, batch)
+        created_id = await self.poster.submit_note(
+            text = f"{mentions} "+reply,
+            replyId = note_id,
+        )
+        self._on_sent(created_id, batch or [note_id])
+
+    async def on_mentions(self, notes: List[dict]):
+        """处理一批提及，多条时合并为一次回复"""
+        if len(notes) == 1:
+            return await self.on_mention(notes[0])
+
+        mentions, items, note_id = self._batch_info(notes)
+        logger.info(f"👥 合并提及 来自频道{self.channel_id} {mentions}: 共{len(notes)}条")
+
+        try:
+            await self._reply(mentions, await self.chat.handle_batch(items, note_id), note_id, [note['id'] for note in notes])
+        except Exception as e:
+            logger.exception(f"处理提及失败: {e}")
+            self._log_result(None)
+
+    async def on_mention(self, note):
+        """当有人@你时调用（可重写）"""
+        user, note_id, content = self._mention_info(note)
+        logger.info(f"👤 新提及 来自频道{self.channel_id} 用户[{user}]: {content}")
+
+        try:
+            await self._reply(f"@{user}", await self.chat.handle_chat(user, content, note_id), note_id)
+        except Exception as e:
+            logger.exception(f"处理提及失败: {e}")
+            self._log_result(None)
+
+    async def start_listening(self):
+        """开始监听消息（单独使用时自建一条连接）"""
+        self.running = True
+        self.manager = AsyncMisskeyStreamManager(self.api_token)
+        self._owns_manager = True
+        self.manager.add_listener(self)
+        await self.manager.start_listening()
+
+class AsyncMisskeyStreamManager(MisskeyStreamManager):
+    '''异步共享连接管理类，订阅与路由逻辑复用MisskeyStreamManager，须在事件循环内调用'''
+    def __init__(self, api_token: str = None, session: "aiohttp.ClientSession" = None):
+        super().__init__(api_token)
+        self.session = session # 断线补齐使用，为None时不补齐
+        self._catch_up_lock = asyncio.Lock()
+        self._catch_up_task: Optional[asyncio.Task] = None
+
+    def _send(self, websocket, msg: dict):
+        # 在事件循环中排队发送，任务按提交顺序执行
+        asyncio.get_running_loop().create_task(self._asend(websocket, msg))
+
+    async def _asend(self, websocket, msg: dict):
+        try:
+            await websocket.send(json.dumps(msg))
+        except Exception as e:
+            logger.error(f"发送订阅消息失败: {e}")
+
+    async def start_listening(self):
+        """建立连接，订阅main及所有频道后持续接收消息"""
+        self.running = True
+        self.supervisor.connecting()
+        logger.info(f"开始监听通知 (频道数: {len(self.listeners)})")
+        connected = False
+        heartbeat: Optional[asyncio.Task] = None
+
+        try:
+            async with connect(self.ws_url, open_timeout=CONNECT_TIMEOUT, **connect_options(connect)) as websocket:
+                # 必须首先订阅主频道才能接收通知
+                await self._asend(websocket, MAIN_CONNECT_MSG)
+
+                self._websocket = websocket
+                for channel_id in list(self.listeners):
+                    self._subscribe(websocket, channel_id)
+                connected = True
+                self.supervisor.connected()
+                self._start_catch_up()
+                if self.supervisor.ping_interval > 0:
+                    heartbeat = asyncio.get_running_loop().create_task(self._heartbeat(websocket))
+
+                # 持续接收消息（连接失效由心跳任务发现并中止传输，recv随即抛出异常）
+                while self.running:
+                    try:
+                        message = await websocket.recv()
+                    except ConnectionClosedOK: # WebSocket 连接正常关闭
+                        return
+                    self._route(message)
+        except Exception as e:
+            logger.error(f"订阅错误: {e}")
+            raise
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+            self._websocket = None
+            self._closed(connected)
+
+    async def _heartbeat(self, websocket):
+        """每ping_interval秒发送ping并测量往返时间，超时未收到pong时中止传输"""
+        supervisor = self.supervisor
+        while True:
+            await asyncio.sleep(supervisor.ping_interval)
+            sent = time.perf_counter()
+            try:
+                pong = await websocket.ping()
+                await asyncio.wait_for(pong, supervisor.ping_timeout)
+            except asyncio.TimeoutError:
+                supervisor.timed_out()
+                websocket.transport.abort()
+                return
+            except Exception: # 连接已关闭
+                return
+            supervisor.pong(time.perf_counter() - sent)
+
+    async def _fetch_mentions(self, since_id: Optional[str]) -> Optional[List[dict]]:
+        url, payload = self._mentions_request(since_id)
+        try:
+            async with self.session.post(
+                url, json=payload,
+                timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=MISSKEY_TIMEOUT)
+            ) as response:
+                response.raise_for_status()
+                return await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"获取断线期间的提及失败: {e}")
+            return None
+
+    async def _catch_up(self, since: float, since_id: Optional[str]):
+        async with self._catch_up_lock:
+            interval = 1 / CATCHUP_RATE if CATCHUP_RATE > 0 else 0
+            fed = 0
+            while self.running and fed < CATCHUP_MAX:
+                page = await self._fetch_mentions(since_id)
+                if not page:
+                    break
+                for note in self._catch_up_notes(page, since_id, since, fed):
+                    if not self.running:
+                        break
+                    self._feed(note)
+                    fed += 1
+                    if interval:
+                        await asyncio.sleep(interval)
+                since_id = self._next_page(page, since_id)
+                if since_id is None:
+                    break
+            self._caught_up(fed)
+
+    def _start_catch_up(self):
+        since = self._catch_up_since()
+        if since is not None and self.session is not None:
+            self._catch_up_task = asyncio.get_running_loop().create_task(self._catch_up(since, self._cursor()))
+
+    async def run_forever(self):
+        """带重连的监听循环：断线（含服务器正常关闭）后按监督者给出的退避时间无限重试，直到stop()或被取消"""
+        self.running = True
+        try:
+            while self.running:
+                error = None
+                try:
+                    await self.start_listening()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                if not self.running:
+                    break
+                await asyncio.sleep(self._reconnect_delay(error))
+        finally:
+            self.supervisor.stopped()
+
+    def stop(self):
+        self.running = False
+        websocket = self._websocket
+        if websocket is not None:
+            asyncio.get_running_loop().create_task(websocket.close())
+        logger.info("共享连接停止指令已发送")
+
+class AsyncGroupManager:
+    def __init__(self, ID: str, session: "aiohttp.ClientSession", poster: AsyncMisskeyPoster = None):
+        self.id = ID
+        self.conf = ChatConfig(ID)
+        self.chat = AsyncChatHandler(self.conf, session)
+        self.poster = poster or AsyncMisskeyPoster(session, self.conf.api_token)
+        self.connector = AsyncMisskeyNotificationListener(ID, self.chat, self.poster, self.conf.api_token)
+
+    def update_config(self, conf: ChatConfig):
+        self.conf = conf
+        self.chat.update_config(conf)
+
+async def serve_async(channel_ids: Optional[List[str]] = None):
+    """在当前事件循环中运行所有频道，直到被取消"""
+    _require_aiohttp()
+
+    # 与同步模式共用[http]连接池配置
+    connector = aiohttp.TCPConnector(limit=HTTP_MAX_HOSTS * HTTP_PER_HOST, limit_per_host=HTTP_PER_HOST)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        loop = asyncio.get_running_loop()
+        bucket: Dict[str, AsyncGroupManager] = {} # 存储频道管理器的字典
+        streams: Dict[str, AsyncMisskeyStreamManager] = {} # API Token -> 共享连接
+        posters: Dict[str, AsyncMisskeyPoster] = {} # API Token -> 共享发送器
+        tasks: Dict[str, asyncio.Task] = {} # API Token -> 连接任务
+        added = asyncio.Event() # 热重载加入了频道（所有频道都被移除后据此继续等待）
+        dispatcher = AsyncMentionDispatcher()
+        dispatcher.start()
+        scheduler = AsyncNoteScheduler() # 所有发送器共用的发帖调度器
+        if METRICS_ENABLED and METRICS_PORT: # 端点在后台线程中运行，不占用事件循环
+            metrics.serve(METRICS_HOST, METRICS_PORT)
+
+        def add_channel(cid: str):
+            token = ChatConfig(cid).api_token
+            if token not in posters:
+                posters[token] = AsyncMisskeyPoster(session, token, scheduler)
+            group = AsyncGroupManager(cid, session, posters[token])
+            bucket[cid] = group
+            if token not in streams:
+                streams[token] = AsyncMisskeyStreamManager(token, session)
+                tasks[token] = loop.create_task(streams[token].run_forever())
+                added.set()
+            group.connector.dispatcher = dispatcher
+            streams[token].add_listener(group.connector)
+
+        def remove_channel(cid: str):
+            """移除频道；连接上的最后一个频道移除后关闭该连接，其任务随之结束"""
+            group = bucket.pop(cid, None)
+            if group is None:
+                return
+            group.connector.stop()
+            stream = group.connector.manager
+            token = next((token for token, item in streams.items() if item is stream), None)
+            if token is not None and not stream.listeners:
+                del streams[token]
+                tasks.pop(token, None)
+                stream.stop()
+                logger.info("连接上已没有频道，已关闭该连接")
+            logger.info(f"频道 {cid} 已移除")
+
+        async def reload(data: dict):
+            """应用新配置，在事件循环中执行（与同步模式的BotManager.reload相同）"""
+            plan = plan_reload(config.cfg, data, {cid: group.conf for cid, group in bucket.items()})
+            config.replace_config(data)
+            for cid in plan.removed:
+                remove_channel(cid)
+            for cid in plan.added:
+                add_channel(cid)
+                logger.info(f"频道 {cid} 已加入")
+            for cid, conf in plan.updated.items():
+                if cid in bucket:
+                    bucket[cid].update_config(conf)
+                    logger.info(f"频道 {cid} 的配置已更新")
+            if plan.restart:
+                logger.warning(f"以下配置段的修改需重启后生效: {', '.join(plan.restart)}")
+
+        for cid in (CHANNEL_ID if channel_ids is None else channel_ids):
+            add_channel(cid)
+
+        # 校验与比较在监视线程中进行，只有应用变更时进入事件循环
+        watcher = ConfigWatcher(lambda data: asyncio.run_coroutine_threadsafe(reload(data), loop).result())
+        watcher.start()
+
+        for group in bucket.values(): # 上次退出前未完成的提及
+            group.connector.replay()
+
+        logger.info(f"异步模式已启动 (连接数: {len(streams)}, 频道数: {len(bucket)})")
+        try:
+            while True: # 连接任务无限重连，只在出现未预期的异常时结束；全部结束后退出，热重载新增的连接也计入
+                pending = [task for task in tasks.values() if not task.done()]
+                if not pending and bucket:
+                    break
+                added.clear()
+                waiter = loop.create_task(added.wait()) # 新增连接时重新收集待等待的任务
+                try:
+                    await asyncio.wait(pending + [waiter], return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
+        finally:
+            await loop.run_in_executor(None, watcher.stop)
+            for stream in streams.values():
+                stream.running = False
+            for task in tasks.values():
+                task.cancel()
+            # 等待处理中的提及完成
+            await dispatcher.stop()
+            await scheduler.stop()
+            durable_queue.flush()
+            long_memory.close()
+            stream_recorder.close()
+            metrics.close()
+
+def run_async():
+    """以asyncio模式启动监听器的主函数"""
+    setup_logging()
+    try:
+        asyncio.run(serve_async())
+    except KeyboardInterrupt:
+        logger.info("程序已完全停止")
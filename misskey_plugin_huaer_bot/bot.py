@@ -0,0 +1,233 @@
+from . import config
+from .config import ChatConfig, setup_logging, CHANNEL_ID, STATS_INTERVAL, METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+from .dispatcher import MentionDispatcher
+from .session import close_sessions
+from .cache import response_cache
+from .router import backend_router
+from .metrics import metrics
+from .reload import ConfigWatcher, plan_reload
+from .durable import durable_queue
+from .admission import admission, REASONS
+from .drive import drive_cache
+from .recall import long_memory
+from .recorder import stream_recorder
+from .outbox import outbox
+from .connector import MisskeyNotificationListener, MisskeyStreamManager
+from .poster import MisskeyPoster
+from .chat import ChatHandler
+from typing import Dict, Optional
+import threading
+import logging
+import time
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+class GroupManager:
+    def __init__(self, ID: str, poster: MisskeyPoster = None):
+        self.id = ID
+        self.conf = ChatConfig(ID)
+        self.chat = ChatHandler(self.conf)
+        self.poster = poster or MisskeyPoster(self.conf.api_token)
+        self.connector = MisskeyNotificationListener(ID, self.chat, self.poster, self.conf.api_token)
+
+    def update_config(self, conf: ChatConfig):
+        self.conf = conf
+        self.chat.update_config(conf)
+
+class BotManager:
+    '''频道总管理类，同一API Token下的频道共享一条连接，可在运行时增删频道'''
+    def __init__(self):
+        self.bucket: Dict[str, GroupManager] = {} # 存储频道管理器的字典
+        self.streams: Dict[str, MisskeyStreamManager] = {} # API Token -> 共享连接
+        self.threads: Dict[str, threading.Thread] = {} # API Token -> 连接线程
+        self.posters: Dict[str, MisskeyPoster] = {} # API Token -> 共享发送器
+        self.dispatcher = MentionDispatcher() # 所有频道共享的提及工作线程池
+        self.running = False
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.watcher = ConfigWatcher(self.reload) # 配置文件热重载
+        self.metrics_port = METRICS_PORT # 指标端点端口（分片模式下每个工作进程各不相同）
+
+    def _start_stream(self, token: str):
+        thread = threading.Thread(target=self.streams[token].run_forever, daemon=True)
+        thread.start()
+        self.threads[token] = thread
+
+    def add_channel(self, cid: str) -> GroupManager:
+        """加入频道，已在运行时直接在共享连接上订阅"""
+        with self._lock:
+            if cid in self.bucket:
+                return self.bucket[cid]
+            conf = ChatConfig(cid)
+            token = conf.api_token
+            if token not in self.posters:
+                self.posters[token] = MisskeyPoster(token)
+            group = GroupManager(cid, self.posters[token])
+            self.bucket[cid] = group
+
+            if token not in self.streams:
+                self.streams[token] = MisskeyStreamManager(token)
+                if self.running:
+                    self._start_stream(token)
+            group.connector.dispatcher = self.dispatcher
+            self.streams[token].add_listener(group.connector)
+        logger.info(f"频道 {cid} 已加入")
+        return group
+
+    def remove_channel(self, cid: str) -> Optional[GroupManager]:
+        """移除频道，只退订该频道，不影响同一连接上的其它频道；连接上的最后一个频道移除后关闭该连接，返回移除的频道"""
+        thread = None
+        with self._lock:
+            group = self.bucket.pop(cid, None)
+            if group is None:
+                return None
+            group.connector.stop()
+            stream = group.connector.manager
+            token = next((token for token, item in self.streams.items() if item is stream), None)
+            if token is not None and not stream.listeners:
+                del self.streams[token]
+                thread = self.threads.pop(token, None)
+                stream.stop()
+        logger.info(f"频道 {cid} 已移除")
+        if thread is not None: # 等待重连循环结束
+            thread.join(timeout=5)
+            logger.info("连接上已没有频道，已关闭该连接")
+        return group
+
+    def reload(self, data: dict):
+        """应用新配置：增删频道、替换有变化的频道配置，不影响其它频道"""
+        with self._lock:
+            current = {cid: group.conf for cid, group in self.bucket.items()}
+        plan = plan_reload(config.cfg, data, current)
+        config.replace_config(data)
+
+        for cid in plan.removed:
+            self.remove_channel(cid)
+        for cid in plan.added:
+            self.add_channel(cid)
+        for cid, conf in plan.updated.items():
+            group = self.bucket.get(cid)
+            if group is not None:
+                group.update_config(conf)
+                logger.info(f"频道 {cid} 的配置已更新")
+        if plan.restart:
+            logger.warning(f"以下配置段的修改需重启后生效: {', '.join(plan.restart)}")
+
+    def health(self) -> Dict[str, dict]:
+        """各频道所在连接的健康状况：状态、已连接秒数、ping往返时间、重连与半开次数"""
+        with self._lock:
+            groups = {cid: group.conf.api_token for cid, group in self.bucket.items()}
+            streams = dict(self.streams)
+        reports = {token: stream.health() for token, stream in streams.items()}
+        return {cid: reports[token] for cid, token in groups.items() if token in reports}
+
+    def _report_stats(self):
+        """定期输出队列深度与工作线程利用率"""
+        while not self._stopped.wait(STATS_INTERVAL):
+            stats = self.dispatcher.stats()
+            logger.info(
+                f"提及队列: 深度 {stats['queue_depth']}/{stats['queue_capacity']}, "
+                f"忙碌线程 {stats['busy_workers']}/{stats['workers']}, 利用率 {stats['utilization']:.1%}, "
+                f"已处理 {stats['processed']}, 已丢弃 {stats['dropped']}"
+            )
+            durable = durable_queue.stats()
+            caught_up = sum(stream.caught_up for stream in list(self.streams.values()))
+            for stream in list(self.streams.values()):
+                health = stream.health()
+                rtt = "-" if health['rtt'] is None else f"{health['rtt'] * 1000:.0f}ms"
+                logger.info(
+                    f"连接[{', '.join(health['channels'])}]: {health['state']}, 已连接 {health['uptime']:.0f}秒, "
+                    f"RTT {rtt}, 重连 {health['reconnects']}次, 半开 {health['dead']}次"
+                )
+            logger.info(f"提及去重: 索引 {durable['seen']}, 重复 {durable['duplicates']}, 批量提交 {durable['batches']}次/{durable['written']}条, 断线补齐 {caught_up}条")
+            admitted = admission.stats()
+            shed = ", ".join(
+                f"{cid}[" + ", ".join(f"{REASONS[reason]} {count}" for reason, count in counts.items()) + "]"
+                for cid, counts in admitted['shed'].items()
+            )
+            logger.info(f"准入控制: 接纳 {admitted['admitted']}, 处理耗时 {admitted['service_time']:.2f}秒, 舍弃 {shed or 0}")
+            cache = response_cache.stats()
+            logger.info(f"回复缓存: 条目 {cache['entries']}, 命中 {cache['hits']}, 未命中 {cache['misses']}")
+            sender = outbox.stats()
+            logger.info(f"发帖队列: 排队 {sender['queued']}, 已发送 {sender['sent']}, 失败 {sender['failed']}, 重试 {sender['retried']}")
+            drive = drive_cache.stats()
+            logger.info(f"网盘文件缓存: 条目 {drive['entries']}, 命中 {drive['hits']}, 未命中 {drive['misses']}")
+            if long_memory.enabled:
+                recalled = long_memory.stats()
+                logger.info(f"长期记忆: 索引 {recalled['indexes']}, 条目 {recalled['entries']}, 检索 {recalled['searches']}次/平均{recalled['search_ms']:.2f}ms, 压缩 {recalled['compactions']}次")
+            if stream_recorder.enabled:
+                recorded = stream_recorder.stats()
+                logger.info(f"录制: {recorded['path']}, 帧 {recorded['frames']}, 已写入 {recorded['bytes'] / 1024:.0f}KB")
+            for backend in backend_router.stats():
+                logger.info(
+                    f"LLM后端[{backend['name']}]: 在途 {backend['outstanding']}, 延迟 {backend['latency']:.2f}秒, "
+                    f"错误率 {backend['error_rate']:.1%}, 请求 {backend['requests']}, 失败 {backend['errors']}, 熔断 {backend['breaker']}"
+                )
+
+    def start(self):
+        self.dispatcher.start()
+        for group in list(self.bucket.values()): # 上次退出前未完成的提及
+            group.connector.replay()
+        if METRICS_ENABLED and self.metrics_port:
+            metrics.serve(METRICS_HOST, self.metrics_port)
+        self.watcher.start()
+        if STATS_INTERVAL > 0:
+            threading.Thread(target=self._report_stats, daemon=True).start()
+        with self._lock:
+            self.running = True
+            for token in self.streams:
+                if token not in self.threads:
+                    self._start_stream(token)
+        logger.info(f"共享连接已启动 (连接数: {len(self.streams)}, 频道数: {len(self.bucket)})")
+
+    def stop(self):
+        self.watcher.stop()
+        with self._lock:
+            self.running = False
+            streams = list(self.streams.values())
+        for stream in streams:
+            try:
+                stream.stop()
+            except Exception as e:
+                logger.error(f"停止连接时出错: {e}")
+
+        # 等待线程结束
+        for thread in self.threads.values():
+            thread.join(timeout=5)
+
+        # 处理完已入队的提及
+        self._stopped.set()
+        for group in list(self.bucket.values()):
+            if group.connector.coalescer is not None:
+                group.connector.coalescer.flush_all()
+        self.dispatcher.stop()
+        outbox.stop() # 发送完已提交的回复
+        durable_queue.flush()
+        long_memory.close()
+        stream_recorder.close()
+        metrics.close()
+        close_sessions()
+
+def run():
+    """启动监听器的主函数"""
+    setup_logging()
+
+    bot = BotManager()
+
+    for cid in CHANNEL_ID:
+        bot.add_channel(cid)
+
+    bot.start()
+
+    # 主控制循环
+    try:
+        logger.info("所有频道已启动，按 Ctrl+C 终止程序...")
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("接收到终止信号，正在停止所有连接...")
+        bot.stop()
+        logger.info("程序已完全停止")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,112 @@
+import math
+import time
+import random
+import logging
+import threading
+from collections import deque
+from typing import Optional
+from .config import (
+    BREAKER_FAILURES, BREAKER_P95, BREAKER_OPEN_SECONDS, BREAKER_WINDOW,
+    HEDGE_MIN_DELAY, RETRY_BASE, RETRY_CAP,
+)
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+def backoff_delay(attempt: int, base: float = RETRY_BASE, cap: float = RETRY_CAP) -> float:
+    """带完全抖动的指数退避：在[0, min(cap, base*2^attempt)]内随机取值，避免所有请求同时重试"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class CircuitBreaker:
+    '''熔断器类：连续失败或p95延迟过高时断开，期间快速失败；到期后放行一个探测请求，成功则恢复'''
+    def __init__(self, name: str = "llm", failures: int = BREAKER_FAILURES, p95_threshold: float = BREAKER_P95,
+                 open_seconds: float = BREAKER_OPEN_SECONDS, window: int = BREAKER_WINDOW):
+        self.name = name
+        self.failure_threshold = max(1, failures)
+        self.p95_threshold = p95_threshold # 0为不按延迟熔断
+        self.open_seconds = open_seconds
+        self.latencies = deque(maxlen=max(1, window)) # 最近成功请求的耗时
+        self.state = CLOSED
+        self.failures = 0 # 连续失败次数
+        self.opened_at = 0.0
+        self._probing = False # 半开状态下是否已有探测请求
+        self._lock = threading.Lock()
+
+    def _open(self, reason: str):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._probing = False
+        logger.warning(f"熔断器[{self.name}]已断开: {reason}，{self.open_seconds:.0f}秒后尝试恢复")
+
+    def allow(self) -> bool:
+        """当前是否允许发出请求"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    return False
+                self.state = HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True # 半开状态只放行一个探测请求
+            return True
+
+    def rejecting(self, now: float) -> bool:
+        """是否处于断开期内（只读判断，不像allow()那样转入半开或占用探测名额）"""
+        with self._lock:
+            return self.state == OPEN and now - self.opened_at < self.open_seconds
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            return self._p95()
+
+    def _p95(self) -> Optional[float]:
+        if len(self.latencies) < 10: # 样本太少时不作判断
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[math.ceil(len(ordered) * 0.95) - 1]
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.latencies.append(latency)
+            self.failures = 0
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                self._probing = False
+                self.latencies.clear() # 恢复后重新统计延迟
+                logger.info(f"熔断器[{self.name}]已恢复")
+                return
+            p95 = self._p95()
+            if self.p95_threshold and p95 is not None and p95 > self.p95_threshold:
+                self.latencies.clear()
+                self._open(f"p95延迟 {p95:.1f}秒 超过 {self.p95_threshold:.1f}秒")
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self._open("探测请求失败")
+            elif self.state == CLOSED and self.failures >= self.failure_threshold:
+                self._open(f"连续失败{self.failures}次")
+
+    def cancel(self):
+        """请求被取消（如对冲中较慢的一方）：不计成败，半开状态下允许重新探测"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+
+    def hedge_delay(self) -> float:
+        """对冲请求的发出时机：已有请求超过p95仍未返回时"""
+        p95 = self.p95()
+        return max(HEDGE_MIN_DELAY, p95) if p95 is not None else HEDGE_MIN_DELAY
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "p95": self._p95(),
+            }
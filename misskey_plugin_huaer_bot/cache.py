@@ -0,0 +1,88 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+from .config import CACHE_MAX_ENTRIES, CACHE_PATH, CONFIG_PATH
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+_MENTION = re.compile(r"@[\w.-]+(?:@[\w.-]+)?") # @用户名 / @用户名@实例
+
+def normalize_prompt(text: str) -> str:
+    """提问的规范形式：去掉@提及，统一空白与大小写"""
+    return " ".join(_MENTION.sub(" ", text or "").split()).casefold()
+
+def cache_key(model: str, personality: str, memory: List[dict], max_token: int, prompts: List[str]) -> str:
+    """请求指纹：由频道配置（模型、人格、记忆模板、max_token）与规范化后的提问决定，不含提问者（可缓存的请求发给LLM时也不带提问者名字）"""
+    raw = json.dumps([model, personality, memory, max_token, [normalize_prompt(p) for p in prompts]], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    '''LLM回复缓存类：内存LRU+TTL，可选SQLite持久化以便重启后继续命中'''
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, path: Optional[Path] = None):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict() # 指纹 -> (回复, 写入时间)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, stored_at REAL)")
+            self._db.commit()
+            logger.info(f"回复缓存已持久化到: {path}")
+
+    def get(self, key: str, ttl: float) -> Optional[str]:
+        """取得未过期的缓存回复"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT value, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (row[0], row[1])
+                    self._entries[key] = entry
+            if entry is not None and (ttl <= 0 or now - entry[1] <= ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (value, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, value, now))
+                self._writes += 1
+                if self._writes % 100 == 0: # 定期裁剪磁盘上的旧条目
+                    self._db.execute(
+                        "DELETE FROM responses WHERE key NOT IN "
+                        "(SELECT key FROM responses ORDER BY stored_at DESC LIMIT ?)",
+                        (self.max_entries,)
+                    )
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+# 进程级共享回复缓存，path为空时仅在内存中
+response_cache = ResponseCache(CACHE_MAX_ENTRIES, (CONFIG_PATH.parent / CACHE_PATH) if CACHE_PATH else None)
@@ -1,36 +1,111 @@
 import time
+import json
 import logging
-import requests
-from typing import List
-from .config import ChatConfig, URL, MOD, HEADERS, INSTANCE_URL, ROUND, USER_ID
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+from typing import List, Optional, Tuple
+from .config import (
+    ChatConfig, INSTANCE_URL, ROUND, USER_ID, STREAM, CONNECT_TIMEOUT, LLM_TIMEOUT, MISSKEY_TIMEOUT,
+    GLOBAL_RATE, GLOBAL_BURST, LIMIT_MODE, LIMIT_MAX_WAIT, COOLDOWN_REPLY,
+    LLM_RETRIES, HEDGE, FALLBACK_REPLY, WORKERS,
 )
+from .session import lease_session
+from .note_store import note_store, remember
+from .packer import ContextPacker
+from .cache import cache_key, response_cache
+from .recall import long_memory, RECALL_HEADER
+from .ratelimit import rate_limiter
+from .breaker import backoff_delay
+from .router import Backend, backend_router
+from .metrics import metrics, timed
+
 logger = logging.getLogger('MisskeyChannelBot')
 
+_hedge_pool = ThreadPoolExecutor(max_workers=WORKERS * 2, thread_name_prefix="llm-call") # 对冲请求使用的线程池
+LIMITED = object() # 所选后端的API Key触发全局限流
+
 class ChatHandler:
     '''对话响应类'''
     def __init__(self, conf: ChatConfig):
         self.conf = conf
-        self.cooldown_until = 0 # 辅助冷却功能
-        self.cooldown = conf.cooldown # 实现冷却功能
+        self.cooldown = conf.cooldown # 实现冷却功能：频道令牌桶平均每cooldown秒补充一次
+        backend_router.check_pinned(conf.backend)
+
+    def update_config(self, conf: ChatConfig):
+        """热重载时替换配置（整体替换引用，读取方不会看到改了一半的配置）"""
+        self.conf = conf
+        self.cooldown = conf.cooldown
+        backend_router.check_pinned(conf.backend)
 
     # 辅助函数
-    def _manage_memory(self, lst: List) -> List:
-        """管理记忆上下文"""
-        while len(lst) > self.conf.rd:
-            del lst[0]
-        return lst
-
-    def _check_api_limit(self) -> bool:
-        """检查API调用限制"""
-        if time.time() < self.cooldown_until:
-            remaining = self.cooldown_until-time.time()
-            return True,f"冷却中，剩余时间：{remaining:.0f}秒"
-        return False,None
+    def _manage_memory(self, turns: List, recalled: List[str] = ()) -> List:
+        """管理记忆上下文：按token预算保留最新的对话，记忆模板与检索到的长期记忆固定保留"""
+        packer = ContextPacker(self.conf.ctx_tokens, self.conf.rd)
+        pinned = list(self.conf.mess)
+        if recalled:
+            pinned.append({"role": "system", "content": "\n---\n".join([RECALL_HEADER] + list(recalled))})
+        return packer.pack(self.conf.current_personality, pinned, turns)
+
+    def _recall(self, items: List[Tuple[str, str]], chain: List) -> List[str]:
+        """检索与本次提及相关的长期记忆，已在回复链中的发言不重复注入"""
+        if not self.conf.recall or not long_memory.enabled:
+            return []
+        exclude = [message["content"] for message in chain if message.get("role") == "user"]
+        return long_memory.search(self.conf.id, items, self.conf.recall, exclude)
+
+    def _memorize(self, items: List[Tuple[str, str]], reply: str):
+        """把本轮问答写入长期记忆"""
+        if self.conf.recall and long_memory.enabled:
+            long_memory.remember(self.conf.id, items, reply)
+
+    def _rate_limits(self, user) -> List[Tuple[str, float, float]]:
+        """本次请求需通过的令牌桶：(桶标识, 速率, 突发量)"""
+        return [
+            (f"user:{user}", self.conf.user_rate, self.conf.user_burst),
+            (f"channel:{self.conf.id}", 1 / self.cooldown if self.cooldown > 0 else 0, self.conf.channel_burst),
+        ]
+
+    @staticmethod
+    def _global_limit(backend: Backend) -> Tuple[str, float, float]:
+        """全局令牌桶：每个API Key一个，在路由选定后端之后申请"""
+        return (f"global:{backend.credential}", GLOBAL_RATE, GLOBAL_BURST)
+
+    @staticmethod
+    def _max_wait() -> Optional[float]:
+        """触发限流时可接受的最长等待秒数，None为无限"""
+        if LIMIT_MODE == "queue":
+            return None
+        if LIMIT_MODE == "delay":
+            return LIMIT_MAX_WAIT
+        return 0.0
+
+    def _limited(self, user) -> Optional[str]:
+        """被限流时的回复，drop模式下为None（不回复）"""
+        logger.info(f"用户[{user}] 在频道{self.conf.id} 触发限流")
+        return None if LIMIT_MODE == "drop" else COOLDOWN_REPLY
+
+    def _backend_limited(self, user) -> Optional[str]:
+        """所选后端的API Key被全局限流：本次请求未被服务，归还已取得的用户与频道令牌，返回限流回复"""
+        rate_limiter.refund(self._rate_limits(user))
+        return self._limited(user)
+
+    def _check_api_limit(self, user) -> Tuple[Optional[float], Optional[str]]:
+        """检查用户与频道的调用限制，返回(需等待的秒数, None)；被限流时返回(None, 冷却回复)，drop模式下冷却回复为None"""
+        wait = rate_limiter.acquire(self._rate_limits(user), self._max_wait())
+        if wait is not None:
+            if wait > 0:
+                logger.info(f"冷却中，用户[{user}] 的请求将等待{wait:.1f}秒")
+            return wait, None
+        return None, self._limited(user)
+
+    def _take_backend(self, backend: Backend, max_wait: Optional[float]) -> Optional[float]:
+        """申请所选后端API Key的全局令牌，返回需等待的秒数；超出max_wait时归还后端并返回None"""
+        wait = rate_limiter.acquire([self._global_limit(backend)], max_wait)
+        if wait is None:
+            backend_router.abandon(backend)
+            logger.info(f"后端[{backend.name}]的API Key触发全局限流")
+        elif wait > 0:
+            logger.info(f"后端[{backend.name}]的API Key限流中，请求将等待{wait:.1f}秒")
+        return wait
 
     def _process_response(self, data: dict) -> dict:
         """处理API响应"""
@@ -43,10 +118,10 @@ class ChatHandler:
         
         return result
 
-    # LLM调用函数
-    def _call_api(self, memo: List):
-        payload = {
-            "model": MOD,
+    def _build_payload(self, memo: List, model: str) -> dict:
+        """构造LLM请求体"""
+        return {
+            "model": model,
             "messages": [{
                 "role": "system",
                 "content": self.conf.current_personality
@@ -54,44 +129,13 @@ class ChatHandler:
             "max_tokens": self.conf.max_token,
         }
 
-        try:
-            response = requests.post(
-                url=URL,
-                json=payload,
-                headers=HEADERS,
-                timeout=60
-            )
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            logger.error(f"API请求失败: {e}")
-            return None
-        
-    def _get_conversation_chain(self, note_id, bot_user_id = USER_ID, length = ROUND):
-        '''消息链获取函数，用于构建记忆'''
-        # 1. 构建 API 请求
-        instance_url = INSTANCE_URL.rstrip('/')
-        api_url = f"{instance_url}/api/notes/conversation"
-        payload = {"noteId": note_id}
-        headers = {"Content-Type": "application/json"}
-        
-        # 2. 发送同步请求
-        try:
-            response = requests.post(api_url, json=payload, headers=headers)
-            response.raise_for_status()  # 检查HTTP错误
-            data = response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f"API请求失败: {e}")
-            return []
-        
-        # 3. 提取并处理消息
-        notes = data
-        
+    @staticmethod
+    def _format_chain(notes: List, bot_user_id = USER_ID, length = ROUND) -> List:
+        """把回复链（从新到旧）格式化为llm请求格式"""
         # 应用长度限制（取最近的N条）
         if length is not None and length > 0:
             notes = notes[0:length]  # 取最近length条
         
-        # 4. 格式化为llm请求格式
         formatted_chain = []
         for note in reversed(notes):
             is_bot = note.get("userId") == bot_user_id
@@ -109,36 +153,294 @@ class ChatHandler:
             })
         
         return formatted_chain
+
+    @staticmethod
+    def _remember_chain(notes: List):
+        """把远程获取的回复链写入缓存"""
+        for note in notes:
+            remember(note)
+
+    def _build_memory(self, name, input, chain: List) -> List:
+        """生成整个记忆"""
+        return self._build_batch_memory([(name, input)], chain)
+
+    def _build_batch_memory(self, items: List[Tuple[str, str]], chain: List, recalled: Optional[List[str]] = None, named: bool = True) -> List:
+        """生成整个记忆，合并的多条提及作为同一轮用户发言；named为False时不带提问者前缀"""
+        content = "\n".join(f"用户[{name}]: {input}" if named else input for name, input in items)
+        if recalled is None:
+            recalled = self._recall(items, chain)
+        return self._manage_memory(chain + [{ "role": "user", "content": content}], recalled) # 记忆管理
+
+    def _hedged_call(self, mem: List, backend: Backend):
+        """对冲请求：首个请求超过该后端的p95仍未返回时，向另一个后端再发一个，取先返回的成功结果"""
+        first = _hedge_pool.submit(self._call_api, mem, backend)
+        try:
+            return first.result(timeout=backend.breaker.hedge_delay())
+        except FutureTimeout:
+            pass
+
+        other = backend_router.pick(self.conf.backend, exclude=[backend])
+        if other is None or self._take_backend(other, 0.0) is None: # 对冲请求不等待限流
+            return first.result()
+        logger.info(f"后端[{backend.name}]响应较慢，向后端[{other.name}]发出对冲请求")
+        second = _hedge_pool.submit(self._call_api, mem, other)
+        for future in as_completed([first, second]):
+            response = future.result()
+            if response:
+                return response
+        return None
+
+    def _guarded_call(self, mem: List):
+        """由路由挑选后端并调用LLM，无可用后端时返回None，该后端的API Key被限流时返回LIMITED"""
+        backend = backend_router.pick(self.conf.backend)
+        if backend is None:
+            return None
+        wait = self._take_backend(backend, self._max_wait())
+        if wait is None:
+            return LIMITED
+        if wait > 0:
+            time.sleep(wait)
+        return self._hedged_call(mem, backend) if HEDGE else self._call_api(mem, backend)
+
+    def _cache_lookup(self, items: List[Tuple[str, str]], chain: List, recalled: List[str]):
+        """
+        查询回复缓存，返回(指纹, 缓存回复)；本频道未启用缓存或请求不可缓存时均为None
+        只缓存不在回复链中、也没有注入长期记忆的独立提问：这类请求发给LLM时不带提问者名字（见_prepare），
+        上下文只由频道配置与提问本身决定，指纹不含提问者，不同用户的相同提问共用一条回复
+        """
+        if not self.conf.cache or chain or recalled:
+            return None, None
+        model = ",".join(backend_router.models(self.conf.backend))
+        key = cache_key(model, self.conf.current_personality, self.conf.mess, self.conf.max_token, [input for _, input in items])
+        return key, response_cache.get(key, self.conf.cache_ttl)
+
+    def _cache_store(self, key: Optional[str], response: str):
+        if key is not None and response:
+            response_cache.put(key, response)
+
+    @staticmethod
+    def _parse_stream_line(line) -> Optional[str]:
+        """解析一行SSE数据，返回增量文本；流结束时返回None"""
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line.startswith("data:"):
+            return ""
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return None
+        choices = json.loads(data).get("choices") or [{}]
+        return (choices[0].get("delta") or {}).get("content") or ""
+
+    def _stream_exhausted(self, length: int, started: float) -> bool:
+        """是否已达到字符上限或时限"""
+        if self.conf.max_chars and length >= self.conf.max_chars:
+            return True
+        return bool(self.conf.deadline) and time.time() - started >= self.conf.deadline
+
+    def _stream_feed(self, parts: List[str], line, started: float) -> Optional[bool]:
+        """把一行SSE数据追加到parts；返回None继续读取，流结束时为False，达到字符上限或时限时为True（截断）"""
+        delta = self._parse_stream_line(line)
+        if delta is None:
+            return False
+        parts.append(delta)
+        return True if self._stream_exhausted(sum(map(len, parts)), started) else None
+
+    def _stream_result(self, parts: List[str], truncated: bool) -> dict:
+        """把流式片段整理为与非流式相同的响应结构"""
+        text = "".join(parts)
+        if self.conf.max_chars:
+            text = text[:self.conf.max_chars]
+        if truncated:
+            logger.info(f"流式回复已截断 (长度: {len(text)})")
+        return {"choices": [{"message": {"content": text}}]}
+
+    def _call_api_stream(self, payload: dict, backend: Backend):
+        """流式调用LLM，达到上限时关闭连接，让服务端停止生成"""
+        import requests # 延迟导入，asyncio模式由AsyncChatHandler覆盖本方法，不加载requests
+        started = time.time()
+        read_timeout = min(LLM_TIMEOUT, self.conf.deadline) if self.conf.deadline else LLM_TIMEOUT
+        parts: List[str] = []
+        truncated = False
+        with lease_session(backend.url) as session: # 读完整个流之前会话不会被淘汰关闭
+            response = session.post(
+                url=backend.url,
+                json=dict(payload, stream=True),
+                headers=backend.headers,
+                timeout=(CONNECT_TIMEOUT, read_timeout),
+                stream=True
+            )
+            try:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    truncated = self._stream_feed(parts, line, started)
+                    if truncated is not None:
+                        break
+            except requests.exceptions.Timeout:
+                if not parts: # 一个字也没收到时按失败处理
+                    raise
+                truncated = True
+            finally:
+                response.close()
+        return self._stream_result(parts, truncated)
+
+    @staticmethod
+    def _retry_after(headers) -> Optional[float]:
+        """解析Retry-After响应头（仅支持秒数形式）"""
+        try:
+            return float(headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+
+    def _call_failed(self, backend: Backend, started: float, error: Exception, status: Optional[int] = None, headers = None):
+        """记录一次失败的LLM调用并归还后端，status/headers为后端返回的错误响应（如有）"""
+        logger.error(f"后端[{backend.name}] API请求失败: {error}")
+        if status is not None:
+            retry_after = self._retry_after(headers) if headers is not None else None
+            backend_router.release(backend, False, time.time() - started, status, retry_after)
+        else:
+            backend_router.release(backend, False, time.time() - started)
+
+    # LLM调用函数
+    def _call_api(self, memo: List, backend: Backend):
+        payload = self._build_payload(memo, backend.model)
+        started = time.time()
+
+        try:
+            if STREAM:
+                result = self._call_api_stream(payload, backend)
+            else:
+                with lease_session(backend.url) as session:
+                    response = session.post(
+                        url=backend.url,
+                        json=payload,
+                        headers=backend.headers,
+                        timeout=(CONNECT_TIMEOUT, LLM_TIMEOUT)
+                    )
+                response.raise_for_status()
+                result = response.json()
+            backend_router.release(backend, True, time.time() - started)
+            return result
+        except Exception as e:
+            response = getattr(e, "response", None)
+            if response is not None:
+                self._call_failed(backend, started, e, response.status_code, response.headers)
+            else:
+                self._call_failed(backend, started, e)
+            return None
+
+    @staticmethod
+    def _cached_chain(note_id, bot_user_id, length) -> Optional[List]:
+        """从本地回复链缓存重建消息链，缓存不完整时返回None"""
+        if note_store is None:
+            return None
+        notes = note_store.ancestors(note_id, length)
+        return None if notes is None else ChatHandler._format_chain(notes, bot_user_id, length)
+
+    @staticmethod
+    def _chain_request(note_id) -> Tuple[str, dict]:
+        """获取回复链的API地址与请求体"""
+        return f"{INSTANCE_URL.rstrip('/')}/api/notes/conversation", {"noteId": note_id}
+
+    def _chain_from(self, data: List, bot_user_id, length) -> List:
+        """写入缓存，提取并格式化消息"""
+        self._remember_chain(data)
+        return self._format_chain(data, bot_user_id, length)
+
+    @timed("conversation_fetch_seconds")
+    def _get_conversation_chain(self, note_id, bot_user_id = USER_ID, length: Optional[int] = None):
+        '''消息链获取函数，用于构建记忆；length默认为频道的rd（热重载后立即生效）'''
+        length = self.conf.rd if length is None else length
+        # 0. 优先从本地回复链缓存重建
+        chain = self._cached_chain(note_id, bot_user_id, length)
+        if chain is not None:
+            return chain
+
+        # 1. 发送同步请求
+        api_url, payload = self._chain_request(note_id)
+        headers = {"Content-Type": "application/json"}
+        import requests
+        try:
+            with lease_session(api_url) as session:
+                response = session.post(api_url, json=payload, headers=headers, timeout=(CONNECT_TIMEOUT, MISSKEY_TIMEOUT))
+            response.raise_for_status()  # 检查HTTP错误
+            data = response.json()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"API请求失败: {e}")
+            return []
+
+        # 2. 写入缓存，提取并格式化消息
+        return self._chain_from(data, bot_user_id, length)
+
+    # 对话流程中的判定（同步与异步共用，只有请求与等待不同）
+    def _prepare(self, items: List[Tuple[str, str]], chain: List) -> Tuple[List, Optional[str], Optional[str]]:
+        """生成整个记忆并查询回复缓存，返回(记忆, 缓存指纹, 缓存回复)"""
+        recalled = self._recall(items, chain)
+        key, cached = self._cache_lookup(items, chain, recalled)
+        # 可缓存的请求不告诉LLM提问者是谁，否则回复中称呼的第一位提问者会原样发给之后的所有用户
+        mem: List = self._build_batch_memory(items, chain, recalled, named=key is None)
+        return mem, key, cached
+
+    def _can_call(self) -> bool:
+        """是否还有可用的LLM后端（所有后端均熔断或限流时快速失败）"""
+        if backend_router.available(self.conf.backend):
+            return True
+        logger.warning("没有可用的LLM后端，使用兜底回复")
+        return False
+
+    @staticmethod
+    def _retry_delay(attempt: int) -> Optional[float]:
+        """第attempt次调用失败后的抖动退避秒数，已无重试机会时为None"""
+        if attempt + 1 >= LLM_RETRIES:
+            return None
+        delay = backoff_delay(attempt)
+        logger.info(f"请求失败，{delay:.1f}秒后重试...")
+        return delay
+
+    def _finish(self, items: List[Tuple[str, str]], key: Optional[str], response) -> str:
+        """处理LLM响应，写入回复缓存与长期记忆；调用失败时返回兜底回复"""
+        if not response:
+            return FALLBACK_REPLY
+        result = self._process_response(response)
+        self._cache_store(key, result["response"])
+        self._memorize(items, result["response"])
+        return result["response"]
         
-    def handle_chat(self, name, input, note_id: str) -> str:
-        """处理对话请求"""
+    def handle_chat(self, name, input, note_id: str) -> Optional[str]:
+        """处理对话请求，返回None表示不回复"""
+        return self.handle_batch([(name, input)], note_id)
 
-        # API调用限制检查
-        boolean, string = self._check_api_limit()
-        if boolean : logger.info(string)
+    def handle_batch(self, items: List[Tuple[str, str]], note_id: str) -> Optional[str]:
+        """处理(用户, 内容)列表组成的对话请求，note_id为最新一条提及"""
 
-        # 生成整个记忆
-        mem: List = self.conf.mess + self._get_conversation_chain(note_id) + [{ "role": "user", "content": f"用户[{name}]: {input}"}]
+        # API调用限制检查
+        wait, notice = self._check_api_limit(items[-1][0])
+        if wait is None:
+            return notice
+        time.sleep(wait)
 
-        # 执行API请求
-        reconnect = 3 #请求失败重连次数
+        # 生成整个记忆，命中回复缓存时无需请求LLM
+        mem, key, cached = self._prepare(items, self._get_conversation_chain(note_id))
+        if cached is not None:
+            return cached
 
-        while reconnect:
-            response = self._call_api(self._manage_memory(mem))# 记忆管理
+        # 执行API请求（所有后端均熔断或限流时快速失败，失败后抖动退避重试）
+        response = None
+        for attempt in range(LLM_RETRIES):
+            if not self._can_call():
+                break
+            with metrics.timer("llm_call_seconds", retry=attempt):
+                response = self._guarded_call(mem)
+            if response is LIMITED:
+                return self._backend_limited(items[-1][0])
             if response :
                 break
-            else : 
-                logger.info("请求失败，尝试重连...")
-                reconnect -= 1
-                time.sleep(1)
-        
+            delay = self._retry_delay(attempt)
+            if delay is not None:
+                time.sleep(delay)
+
         # 处理响应
-        result = self._process_response(response)
-        
-        # 更新API调用时间
-        self.cooldown_until = time.time() + self.cooldown
-        
-        return result["response"]
+        return self._finish(items, key, response)
 
 if __name__ == "__main__":
     chat1 = ChatHandler()
@@ -0,0 +1,134 @@
+'''
+命令行入口（pip安装后为 huaer-bot 命令，也可 python -m misskey_plugin_huaer_bot）
+
+    huaer-bot                                 # 线程模式，同 run()
+    huaer-bot --config /etc/huaer/config.toml # 指定配置文件
+    huaer-bot --mode async                    # asyncio模式，同 run_async()
+    huaer-bot --mode shard                    # 分片模式，同 python -m misskey_plugin_huaer_bot.shard
+    huaer-bot --record stream.jsonl.gz        # 同时录制收到的streaming消息帧（同[record]），供benchmarks/replay.py重放
+    huaer-bot --profile-startup               # 输出各启动阶段的耗时、新导入的模块数与峰值内存后退出（不建立连接）
+'''
+import sys
+import time
+import importlib
+import logging
+import argparse
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Tuple
+from . import config
+
+try: # Windows没有resource模块
+    import resource
+except ImportError:
+    resource = None
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="huaer-bot", description="misskey-plugin-huaer-bot 频道对话机器人")
+    parser.add_argument("--config", type=Path, default=None, help="配置文件路径，默认为环境变量HUAER_BOT_CONFIG或包内的config.toml")
+    parser.add_argument("--mode", choices=("thread", "async", "shard"), default="thread", help="thread为run()，async为run_async()，shard为分片模式")
+    parser.add_argument("--log-level", default="INFO", choices=("DEBUG", "INFO", "WARNING", "ERROR"), help="日志级别")
+    parser.add_argument("--record", type=Path, default=None, help="把收到的streaming消息帧录制到该文件（gzip压缩的JSON Lines），分片模式不支持")
+    parser.add_argument("--profile-startup", action="store_true", help="输出启动各阶段的耗时后退出，不建立连接")
+    parser.add_argument("--version", action="version", version=f"%(prog)s {config.MAJOR_VERSION}.{config.MINOR_VERSION}.{config.PATCH_VERSION}")
+    args = parser.parse_args(argv)
+    if args.config is not None and not args.config.is_file():
+        parser.error(f"配置文件不存在: {args.config}")
+    return args
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024 # macOS为字节，Linux为KB
+
+def _pad(text: str, width: int) -> str:
+    """按终端显示宽度补齐（中文占两格）"""
+    shown = sum(2 if unicodedata.east_asian_width(c) in "WF" else 1 for c in text)
+    return text + " " * max(0, width - shown)
+
+class StartupProfile:
+    '''启动耗时记录：各阶段的耗时与其间新导入的模块数'''
+    def __init__(self):
+        self.phases: List[Tuple[str, float, int]] = [] # (阶段, 秒, 新导入模块数)
+
+    @contextmanager
+    def phase(self, name: str):
+        modules = len(sys.modules)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started, len(sys.modules) - modules))
+
+    def report(self) -> str:
+        width = 28
+        lines = ["启动耗时（未建立连接）:"]
+        for name, seconds, modules in self.phases:
+            lines.append(f"  {_pad(name, width)} {seconds * 1000:8.1f}ms  模块 +{modules}")
+        lines.append(f"  {_pad('合计', width)} {sum(seconds for _, seconds, _ in self.phases) * 1000:8.1f}ms  模块 {len(sys.modules)}")
+        peak = peak_rss_mb()
+        if peak is not None:
+            lines.append(f"峰值内存: {peak:.1f} MB")
+        return "\n".join(lines)
+
+def profile_startup(mode: str, profile: StartupProfile):
+    """按正式启动的顺序执行到建立连接之前；连接时才导入的依赖单独计时"""
+    with profile.phase("读取配置"):
+        config.load()
+    if mode == "thread":
+        with profile.phase("导入机器人模块"):
+            from .bot import BotManager
+        with profile.phase("创建频道"):
+            bot = BotManager()
+            for cid in config.CHANNEL_ID:
+                bot.add_channel(cid)
+        with profile.phase("启动提及工作线程"):
+            bot.dispatcher.start()
+        with profile.phase("首次请求时导入requests"):
+            importlib.import_module("requests")
+        with profile.phase("连接时导入websockets"):
+            importlib.import_module("websockets.sync.client")
+    elif mode == "async":
+        with profile.phase("导入asyncio模式模块"):
+            from . import aio
+        with profile.phase("创建频道配置"):
+            for cid in config.CHANNEL_ID:
+                config.ChatConfig(cid)
+    else:
+        with profile.phase("导入分片模块"):
+            from . import shard
+
+def main(argv: Optional[List[str]] = None):
+    started = time.perf_counter()
+    args = parse_args(argv)
+    if args.config is not None:
+        config.set_config_path(args.config)
+    config.setup_logging(getattr(logging, args.log_level))
+
+    if args.profile_startup:
+        profile = StartupProfile()
+        profile.phases.append(("解析命令行", time.perf_counter() - started, 0))
+        profile_startup(args.mode, profile)
+        print(profile.report())
+        return
+
+    if args.record is not None:
+        if args.mode == "shard":
+            sys.exit("分片模式下请在配置文件的[record]中开启录制（各工作进程各写一个文件，文件名前加工作进程ID）")
+        from .recorder import stream_recorder
+        stream_recorder.open(args.record)
+
+    if args.mode == "async":
+        from .aio import run_async
+        run_async()
+    elif args.mode == "shard":
+        from .shard import main as shard_main
+        shard_main([])
+    else:
+        from .bot import run
+        run()
+
+if __name__ == "__main__":
+    main()
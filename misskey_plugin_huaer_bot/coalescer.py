@@ -0,0 +1,82 @@
+import logging
+import threading
+from typing import Callable, Dict, List
+from .config import COALESCE_WINDOW, COALESCE_MAX_BATCH
+from .note_store import note_store
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+def thread_key(note: dict) -> str:
+    """提及所属讨论串的标识：回复链缓存中可追溯到的最早帖子"""
+    start = note.get('replyId') or note.get('id')
+    if note_store is not None:
+        return note_store.root(start)
+    return str(start)
+
+class MentionCoalescer:
+    '''提及合并类：同一讨论串在窗口期内的多条提及合并为一批，只调用一次LLM、回复一次'''
+    def __init__(self, flush: Callable[[List[dict]], None], window: float = COALESCE_WINDOW, max_batch: int = COALESCE_MAX_BATCH):
+        self.flush = flush # 收到一批提及后的回调
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._pending: Dict[str, List[dict]] = {} # 讨论串 -> 等待合并的提及
+        self._timers: Dict[str, threading.Timer] = {}
+        self._lock = threading.Lock()
+        self.merged = 0 # 被合并掉的提及数（即节省的LLM调用数）
+
+    def add(self, note: dict):
+        """加入一条提及，窗口到期或达到批量上限时触发回调"""
+        key = thread_key(note)
+        with self._lock:
+            batch = self._pending.setdefault(key, [])
+            batch.append(note)
+            if len(batch) >= self.max_batch:
+                batch = self._take(key)
+            else:
+                if len(batch) == 1:
+                    self._schedule(key)
+                return
+        self._emit(batch)
+
+    def _take(self, key: str) -> List[dict]:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        return self._pending.pop(key, [])
+
+    def _schedule(self, key: str):
+        timer = threading.Timer(self.window, self._expire, args=(key,))
+        timer.daemon = True
+        self._timers[key] = timer
+        timer.start()
+
+    def _expire(self, key: str):
+        with self._lock:
+            self._timers.pop(key, None)
+            batch = self._pending.pop(key, [])
+        if batch:
+            self._emit(batch)
+
+    def _emit(self, batch: List[dict]):
+        if len(batch) > 1:
+            self.merged += len(batch) - 1
+            logger.info(f"已合并同一讨论串的 {len(batch)} 条提及")
+        try:
+            self.flush(batch)
+        except Exception as e:
+            logger.exception(f"提及合并回调失败: {e}")
+
+    def flush_all(self):
+        """立即发出所有等待中的批次（停止时调用）"""
+        with self._lock:
+            keys = list(self._pending)
+            batches = [self._take(key) for key in keys]
+        for batch in batches:
+            if batch:
+                self._emit(batch)
+
+class AsyncMentionCoalescer(MentionCoalescer):
+    '''异步提及合并类，用事件循环定时代替线程定时器，须在事件循环内调用'''
+    def _schedule(self, key: str):
+        import asyncio # 只有asyncio模式才导入
+        self._timers[key] = asyncio.get_running_loop().call_later(self.window, self._expire, key)
@@ -1,20 +1,23 @@
-import toml
+import os
 import logging
+import threading
 from pathlib import Path
-from typing import Dict, Any
+from typing import Any, Dict, Optional
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger('MisskeyChannelBot')
 
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def setup_logging(level: int = logging.INFO):
+    """配置日志；由run、run_async、分片模式与命令行等入口调用，作为库导入时不改动调用方的日志设置"""
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+
 class ConfigManager:
     '''配置管理类'''
 
     @staticmethod
     def load_toml(file_path: Path) -> Dict[str, Any]:
+        import toml
         try:
             if file_path.exists():
                 with open(file_path, "r", encoding="utf-8") as f:
@@ -27,6 +30,7 @@ class ConfigManager:
     
     @staticmethod
     def save_toml(data: Dict[str, Any], file_path: Path):
+        import toml
         try:
             with open(file_path, "w", encoding="utf-8") as f:
                 toml.dump(data, f)
@@ -41,34 +45,209 @@ MINOR_VERSION = 0
 PATCH_VERSION = 4
 VERSION_SUFFIX = "stable"
 
-# 导入配置文件
-cfg = ConfigManager.load_toml(BASE_DIR / "config.toml")
+# 配置文件在首次读取配置项时才加载，导入本包不读取任何文件
+# 默认路径为包内的config.toml，可用环境变量HUAER_BOT_CONFIG（如基准测试）或命令行--config指定其它路径
+CONFIG_ENV = "HUAER_BOT_CONFIG"
+_load_lock = threading.Lock()
+_loaded = False
+
+def _config_path() -> Path:
+    return Path(os.environ.get(CONFIG_ENV) or BASE_DIR / "config.toml")
+
+def set_config_path(path):
+    """指定配置文件路径，须在读取任何配置项之前调用；同时写入环境变量，分片模式的工作进程沿用同一文件"""
+    if _loaded:
+        raise RuntimeError("配置已加载，无法更改配置文件路径")
+    os.environ[CONFIG_ENV] = str(Path(path).resolve())
+    globals().pop("CONFIG_PATH", None)
+
+def load() -> Dict[str, Any]:
+    """加载配置文件并计算各项设置（只在首次调用时读取文件），返回当前生效的配置"""
+    global _loaded
+    with _load_lock:
+        if not _loaded:
+            path = globals().setdefault("CONFIG_PATH", _config_path())
+            data = ConfigManager.load_toml(path)
+            globals().update(_settings(data))
+            globals()["cfg"] = data
+            _loaded = True
+    return globals()["cfg"]
+
+def __getattr__(name: str) -> Any:
+    """CONFIG_PATH、cfg与各项设置（大写名称）在首次访问时才求值"""
+    if name == "CONFIG_PATH":
+        return globals().setdefault("CONFIG_PATH", _config_path())
+    if name == "cfg" or name.isupper():
+        load()
+        if name in globals():
+            return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _settings(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """由解析后的配置计算各项设置（缺少的配置段按默认值处理）"""
+    api = cfg.get("api", {})
+    misskey = cfg.get("misskey", {})
+    channels = cfg.get("channels", {})
+
+    # 解析API配置
+    MOD = api.get("mod", [])
+    URL = api.get("url", "")
+
+    HEADERS = api.get("headers", {})
+    STREAM = api.get("stream", False)
+    LLM_RETRIES = max(1, api.get("retries", 3))
+    RETRY_BASE = api.get("retry_base", 0.5)
+    RETRY_CAP = api.get("retry_cap", 8.0)
+    BREAKER_FAILURES = api.get("breaker_failures", 5)
+    BREAKER_P95 = api.get("breaker_p95", 0.0)
+    BREAKER_OPEN_SECONDS = api.get("breaker_open", 30.0)
+    BREAKER_WINDOW = api.get("breaker_window", 50)
+    HEDGE = api.get("hedge", False)
+    HEDGE_MIN_DELAY = api.get("hedge_min_delay", 2.0)
+    FALLBACK_REPLY = api.get("fallback_reply", "华尔现在有点累了，晚点再来找我吧~")
+    BACKENDS = api.get("backends", []) # 多个LLM后端，为空时使用上面的mod/url/headers
+
+    COOL = channels.get("cooldown", misskey.get("cooldown", 0.0))
+    USER_ID = misskey.get("user_id", "")
+    CHANNEL_ID = misskey.get("channel_id", [])
+    INSTANCE_URL = misskey.get("instance_url", "")
+    API_TOKEN = misskey.get("api_token", "")
+
+    WORKERS = misskey.get("workers", 8)
+    ASYNC_WORKERS = misskey.get("async_workers", 256)
+    QUEUE_SIZE = misskey.get("queue_size", 1000)
+    ORDER_BY = misskey.get("order_by", "user")
+    STATS_INTERVAL = misskey.get("stats_interval", 60)
+    WATCH_INTERVAL = misskey.get("watch_interval", 2.0)
+    USER_RATE = misskey.get("user_rate", 0.2)
+    USER_BURST = misskey.get("user_burst", 3)
+    CHANNEL_BURST = misskey.get("channel_burst", 3)
+    GLOBAL_RATE = misskey.get("global_rate", 5.0)
+    GLOBAL_BURST = misskey.get("global_burst", 20)
+    LIMIT_MODE = misskey.get("limit_mode", "delay")
+    LIMIT_MAX_WAIT = misskey.get("limit_max_wait", 10.0)
+    COOLDOWN_REPLY = misskey.get("cooldown_reply", "冷却中，请稍后再来找我玩~")
+    COALESCE_WINDOW = misskey.get("coalesce_window", 0.0)
+    COALESCE_MAX_BATCH = misskey.get("coalesce_max_batch", 5)
+    CATCHUP_ENABLED = misskey.get("catchup", True)
+    CATCHUP_RATE = misskey.get("catchup_rate", 5.0)
+    CATCHUP_MAX = misskey.get("catchup_max", 500)
+    RECONNECT_BASE = misskey.get("reconnect_base", 1.0)
+    RECONNECT_CAP = misskey.get("reconnect_cap", 60.0)
+    RECONNECT_STABLE = misskey.get("reconnect_stable", 60.0)
+    PING_INTERVAL = misskey.get("ping_interval", 15.0)
+    PING_TIMEOUT = misskey.get("ping_timeout", 10.0)
+    HIGH_WATER = misskey.get("high_water", 0.75)
+    SHED_MODE = misskey.get("shed_mode", "drop")
+    SHED_REPLY = misskey.get("shed_reply", "刚才太忙了没顾上，这条就先不回啦，再@我一次吧~")
 
-# 解析API配置
-MOD = cfg["api"].get("mod", [])
-URL = cfg["api"].get("url", "")
+    HTTP_MAX_HOSTS = cfg.get("http", {}).get("max_hosts", 16)
+    HTTP_PER_HOST = cfg.get("http", {}).get("per_host", 32)
+    HTTP_POOL_BLOCK = cfg.get("http", {}).get("pool_block", False)
+    CONNECT_TIMEOUT = cfg.get("http", {}).get("connect_timeout", 5.0)
+    LLM_TIMEOUT = cfg.get("http", {}).get("llm_timeout", 60.0)
+    MISSKEY_TIMEOUT = cfg.get("http", {}).get("misskey_timeout", 30.0)
 
-HEADERS = cfg["api"].get("headers", {})
+    NOTE_STORE_ENABLED = cfg.get("note_store", {}).get("enabled", True)
+    NOTE_STORE_MAX_NOTES = cfg.get("note_store", {}).get("max_notes", 20000)
+    NOTE_STORE_MAX_BYTES = int(cfg.get("note_store", {}).get("max_mb", 32) * 1024 * 1024)
+    NOTE_STORE_TTL = cfg.get("note_store", {}).get("ttl", 86400)
 
-COOL = cfg["misskey"].get("cooldown", 0.0)
-USER_ID = cfg["misskey"].get("user_id", "")
-CHANNEL_ID = cfg["misskey"].get("channel_id", [])
-INSTANCE_URL = cfg["misskey"].get("instance_url", "")
-API_TOKEN = cfg["misskey"].get("api_token", "")
+    CACHE_MAX_ENTRIES = cfg.get("cache", {}).get("max_entries", 1024)
+    CACHE_PATH = cfg.get("cache", {}).get("path", "")
 
-PERSONALITY = cfg["channels"].get("default_personality", "")
-TOKEN = cfg["channels"].get("max_token", 1024)
-ROUND = cfg["channels"].get("rd", 6)
-MEM = cfg["channels"].get("memory", [])
+    OUTBOX_WORKERS = cfg.get("outbox", {}).get("workers", 4)
+    OUTBOX_RETRIES = cfg.get("outbox", {}).get("retries", 4)
+    OUTBOX_THROTTLE = cfg.get("outbox", {}).get("throttle", 5.0)
+
+    UPLOAD_PARALLELISM = cfg.get("drive", {}).get("parallelism", 4)
+    UPLOAD_RETRIES = cfg.get("drive", {}).get("retries", 3)
+    DRIVE_CACHE_PATH = cfg.get("drive", {}).get("cache_path", "")
+
+    DURABLE_ENABLED = cfg.get("durable", {}).get("enabled", False)
+    DURABLE_PATH = cfg.get("durable", {}).get("path", "mentions.sqlite3")
+    DURABLE_FLUSH_INTERVAL = cfg.get("durable", {}).get("flush_interval", 0.05)
+    DURABLE_REPLAY_MAX_AGE = cfg.get("durable", {}).get("replay_max_age", 3600)
+    DEDUP_SIZE = cfg.get("durable", {}).get("dedup_size", 10000)
+
+    SHARD_WORKERS = cfg.get("shard", {}).get("workers", 2)
+    SHARD_DIR = cfg.get("shard", {}).get("directory", "shard")
+    SHARD_TTL = cfg.get("shard", {}).get("ttl", 15.0)
+    SHARD_HOST = cfg.get("shard", {}).get("host", "")
+
+    MEMORY_ENABLED = cfg.get("long_memory", {}).get("enabled", False)
+    MEMORY_PATH = cfg.get("long_memory", {}).get("path", "long_memory")
+    MEMORY_SCOPE = cfg.get("long_memory", {}).get("scope", "channel")
+    MEMORY_DIM = cfg.get("long_memory", {}).get("dim", 256)
+    MEMORY_MAX_ENTRIES = cfg.get("long_memory", {}).get("max_entries", 10000)
+    MEMORY_MIN_SCORE = cfg.get("long_memory", {}).get("min_score", 0.2)
+    MEMORY_COMPACT_INTERVAL = cfg.get("long_memory", {}).get("compact_interval", 60.0)
+
+    RECORD_ENABLED = cfg.get("record", {}).get("enabled", False)
+    RECORD_PATH = cfg.get("record", {}).get("path", "stream.jsonl.gz")
+    RECORD_FLUSH_INTERVAL = cfg.get("record", {}).get("flush_interval", 1.0)
+    RECORD_MAX_MB = cfg.get("record", {}).get("max_mb", 1024)
+
+    METRICS_ENABLED = cfg.get("metrics", {}).get("enabled", False)
+    METRICS_HOST = cfg.get("metrics", {}).get("host", "127.0.0.1")
+    METRICS_PORT = cfg.get("metrics", {}).get("port", 9464)
+
+    PERSONALITY = channels.get("default_personality", "")
+    TOKEN = channels.get("max_token", 1024)
+    ROUND = channels.get("rd", 6)
+    CTX_TOKENS = channels.get("ctx_tokens", 4096)
+    TOKENIZER = channels.get("tokenizer", "estimate")
+    MEM = channels.get("memory", [])
+    MAX_CHARS = channels.get("max_chars", 0)
+    DEADLINE = channels.get("deadline", 0.0)
+    MAX_AGE = channels.get("max_age", 300.0)
+    CACHE = channels.get("cache", False)
+    CACHE_TTL = channels.get("cache_ttl", 600.0)
+    RECALL = channels.get("recall", 3)
+
+    return {name: value for name, value in locals().items() if name.isupper()}
 
 class ChatConfig:
     '''变量容器类，配置的动态载体'''
-    def __init__(self, ID: int):
+    def __init__(self, ID: int, source: Optional[Dict[str, Any]] = None):
 
         self.id = ID # ID : 此配置归属的组的ID
+        current = load() # 同时确保下面用到的默认设置已计算
+        source = current if source is None else source # source : 解析后的配置，热重载时为新配置
+
+        channel = source.get(f"{self.id}", {}) # 没有单独配置段的频道使用[channels]中的默认值
+        defaults = source.get("channels", {})
+        misskey = source.get("misskey", {})
+        def option(key, fallback):
+            return channel.get(key, defaults.get(key, fallback))
+
+        self.rd : int = option("rd", ROUND)
+        self.ctx_tokens : int = option("ctx_tokens", CTX_TOKENS)
+        self.mess : list = option("memory", MEM)
+        self.cooldown : float = option("cooldown", misskey.get("cooldown", COOL))
+        self.user_rate : float = option("user_rate", misskey.get("user_rate", USER_RATE))
+        self.user_burst : float = option("user_burst", misskey.get("user_burst", USER_BURST))
+        self.channel_burst : float = option("channel_burst", misskey.get("channel_burst", CHANNEL_BURST))
+        self.max_token : int = option("max_token", TOKEN)
+        self.current_personality : str = option("default_personality", PERSONALITY)
+        self.api_token : str = channel.get("api_token", misskey.get("api_token", API_TOKEN)) # 同一Token下的频道共享一条streaming连接
+        self.max_chars : int = option("max_chars", MAX_CHARS)
+        self.deadline : float = option("deadline", DEADLINE)
+        self.max_age : float = option("max_age", MAX_AGE)
+        self.cache : bool = option("cache", CACHE)
+        self.cache_ttl : float = option("cache_ttl", CACHE_TTL)
+        self.recall : int = option("recall", RECALL) # 注入的长期记忆条数（需启用[long_memory]）
+        self.backend : str = option("backend", "") # 固定使用的后端名，为空时由路由挑选
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ChatConfig) and vars(self) == vars(other)
 
-        self.rd : int = cfg[f"{self.id}"].get("rd", ROUND)
-        self.mess : list = cfg[f"{self.id}"].get("memory", MEM) 
-        self.cooldown : float = cfg[f"{self.id}"].get("cooldown", COOL)
-        self.max_token : int = cfg[f"{self.id}"].get("max_token", TOKEN)
-        self.current_personality : str= cfg[f"{self.id}"].get("default_personality", PERSONALITY) 
+def replace_config(data: Dict[str, Any]):
+    """
+    替换当前生效的配置（热重载）并重新计算各项设置，此后新建的ChatConfig读取新配置与新的默认值
+    已在导入时复制了设置的模块（进程级配置段）仍使用旧值，需重启生效
+    """
+    load()
+    with _load_lock:
+        globals().update(_settings(data))
+        globals()["cfg"] = data
@@ -1,160 +1,596 @@
 import time
 import json
+import socket
 import logging
-from typing import Optional
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from .chat import ChatHandler
 from .poster import MisskeyPoster
-from websockets.sync.client import connect
-from websockets.exceptions import ConnectionClosedOK
-from .config import INSTANCE_URL, API_TOKEN, USER_ID, CHANNEL_ID
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from .dispatcher import MentionDispatcher
+from .note_store import remember
+from .coalescer import MentionCoalescer
+from .metrics import metrics
+from .durable import durable_queue
+from .admission import admission, mention_priority, PRIORITY_NAMES, REASONS
+from .session import lease_session
+from .supervisor import ReconnectSupervisor, connect_options
+from .recorder import stream_recorder, CATCHUP
+from . import config
+from .config import (
+    setup_logging, INSTANCE_URL, API_TOKEN, USER_ID, CHANNEL_ID, COALESCE_WINDOW,
+    CATCHUP_ENABLED, CATCHUP_RATE, CATCHUP_MAX, CONNECT_TIMEOUT, MISSKEY_TIMEOUT, SHED_MODE, SHED_REPLY,
 )
 
+
 logger = logging.getLogger('MisskeyChannelIDFinder')
 
+MAIN_CONNECT_MSG = {"type": "connect", "body": {"channel": "main", "id": "main"}} # 主频道订阅
+CATCHUP_PAGE = 100 # notes/mentions每页条数（服务器上限）
+CATCHUP_MARGIN = 30.0 # 没有已处理的提及可作起点时，按断线时间向前多取的秒数（断线往往在心跳超时后才发现）
+
+def streaming_url(instance_url: str, api_token: str) -> str:
+    """由实例地址构造streaming地址（http实例对应ws，https对应wss）"""
+    scheme = "ws" if instance_url.startswith("http://") else "wss"
+    return f"{scheme}://{instance_url.split('//')[1]}/streaming?i={api_token}"
+
+def subscription_id(channel_id: str) -> str:
+    """频道订阅ID，服务器推送的channel帧以此标识来源"""
+    return f"channel_{channel_id}"
+
+def created_at(note: dict) -> float:
+    """帖子的创建时间戳，无法解析时为0"""
+    try:
+        return datetime.fromisoformat(note['createdAt'].replace('Z', '+00:00')).timestamp()
+    except (KeyError, AttributeError, ValueError):
+        return 0.0
+
+def mention_frame(note: dict) -> dict:
+    """把通过API取得的提及包装成main频道推送的消息帧"""
+    return {"type": "channel", "body": {"id": "main", "type": "mention", "body": note}}
+
 class MisskeyNotificationListener:
     '''服务器监听类'''
-    def __init__(self, channel_id: Optional[str], chat: ChatHandler, poster: MisskeyPoster):
+    def __init__(self, channel_id: Optional[str], chat: ChatHandler, poster: MisskeyPoster, api_token: str = None):
         self.instance_url = INSTANCE_URL.rstrip('/')
-        self.api_token = API_TOKEN
+        self.api_token = api_token or config.API_TOKEN # 热重载后新建的监听器与连接使用新值
         self.user_id = USER_ID
         self.channel_id = channel_id
-        self.ws_url = f"wss://{self.instance_url.split('//')[1]}/streaming?i={self.api_token}"
+        self.ws_url = streaming_url(self.instance_url, self.api_token)
         self.running = False
         self.chat = chat
         self.poster = poster
-        
+        self.manager: Optional["MisskeyStreamManager"] = None # 所属的共享连接
+        self._owns_manager = False # 是否为单独监听时自建的连接
+        self.dispatcher: Optional[MentionDispatcher] = None # 设置后提及交由工作线程池处理
+        self.coalescer: Optional[MentionCoalescer] = self._new_coalescer() if COALESCE_WINDOW > 0 else None # 同一讨论串的提及合并
+        self.last_mention_id: Optional[str] = None # 最近收到的提及ID，重连后从这里补齐
+        self._inflight: Set[str] = set() # 已接收、尚未回复完成的提及ID（移交频道前等待清空）
+        self._idle = threading.Condition()
+
     def _handle_message(self, message):
         """处理接收到的消息"""
         try:
-            data = json.loads(message)
+            self._dispatch(json.loads(message))
+        except json.JSONDecodeError:
+            logger.error("消息解析失败")
+
+    def _extract_mention(self, data: dict) -> Optional[dict]:
+        """从消息帧中取出需要回应的提及帖子"""
+        try:
             if data.get('type') == 'channel':
                 body = data.get('body', {})
 
                 if not body.get('body') :
-                    return
-                
+                    return None
+
                 note = body['body']
+                if body.get('type') in ('note', 'mention', 'reply'):
+                    remember(note) # 填充回复链缓存
 
                 if self.channel_id and str(note.get('channel', {}).get('id')) != self.channel_id:
-                    return
+                    return None
 
                 # 处理提及消息，其它消息（如reply）同理
                 if body.get('type') == 'mention':
                     if note.get('user', {}).get('id') != self.user_id:
-                        self.on_mention(note)
-                
-        except json.JSONDecodeError:
-            logger.error("消息解析失败")
+                        return note
+
         except KeyError as e:
             logger.error(f"消息格式错误: {e}")
+        return None
 
-    def on_mention(self, note):
-        """当有人@你时调用（可重写）"""
-        # 尝试获取用户信息
-        user_info = note.get('user', {})
-        user = user_info.get('username') if user_info.get('username') else user_info.get('id')
-        note_id = note.get('id')
+    def _dispatch(self, data: dict):
+        """处理已解析的消息帧（共享连接路由后直接调用）"""
+        note = self._extract_mention(data)
+        if note is not None:
+            if not durable_queue.add(self.channel_id, note): # 重连后服务器可能重复推送同一帖子
+                logger.info(f"忽略重复的提及 {note.get('id')}")
+                metrics.inc("duplicates_total", channel=self.channel_label)
+                return
+            metrics.inc("mentions_total", channel=self.channel_label)
+            self._track([note])
+            note_id = note.get('id')
+            if note_id and (self.last_mention_id is None or note_id > self.last_mention_id): # Misskey的ID按时间有序
+                self.last_mention_id = note_id
+            if self.coalescer is not None:
+                self.coalescer.add(note)
+            else:
+                self._submit([note])
 
-        content = note['text']
-        logger.info(f"👤 新提及 来自频道{self.channel_id} 用户[{user}]: {content}")
+    def _new_coalescer(self) -> MentionCoalescer:
+        return MentionCoalescer(self._submit)
 
-        result = self.poster.send_note(
-            text = f"@{user} "+self.chat.handle_chat(user, content, note_id),
-            replyId = note_id,
-        )
+    @property
+    def channel_label(self) -> str:
+        """指标中的频道标签"""
+        return self.channel_id or "main"
+
+    def _track(self, notes: List[dict]):
+        with self._idle:
+            self._inflight.update(note['id'] for note in notes if note.get('id'))
 
-        note_id = result.get('createdNote', {}).get('id')
+    def _settle(self, note_ids: Iterable[str]):
+        """提及已回复、跳过或放弃"""
+        with self._idle:
+            self._inflight.difference_update(note_ids)
+            if not self._inflight:
+                self._idle.notify_all()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """发出合并中的提及并等待已接收的提及全部回复完成，timeout秒内完成时返回True（须先stop，不再接收新提及）"""
+        if self.coalescer is not None:
+            self.coalescer.flush_all()
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._inflight, timeout)
+
+    def _submit(self, notes: List[dict]):
+        """提交一批（通常为一条）提及"""
+        queued = time.perf_counter()
+        if self.dispatcher is not None: # 接收循环只入队，不等待处理
+            if not self.dispatcher.submit(notes[0], self._process, notes, queued):
+                metrics.inc("dropped_total", len(notes), channel=self.channel_label)
+                self._settle(note.get('id') for note in notes)
+        else:
+            self._process(notes, queued)
 
-        if result:
+    def _process(self, notes: List[dict], queued: float):
+        """处理一批提及，记录从接收到开始处理的等待时间；未通过准入控制的提及不交给ChatHandler"""
+        reason, priority = self._admit(notes, queued)
+        if reason is not None:
+            return self._shed(notes, reason, priority)
+        started = time.perf_counter()
+        try:
+            self.on_mentions(notes)
+        except Exception:
+            metrics.inc("failures_total", channel=self.channel_label)
+            self._settle(note.get('id') for note in notes)
+            raise
+        finally:
+            admission.observe(time.perf_counter() - started)
+
+    def _admit(self, notes: List[dict], queued: float) -> Tuple[Optional[str], int]:
+        """记录排队等待时间并做准入检查，返回(舍弃原因, 优先级)，原因为None时处理；合并的多条按最新的创建时间与最高的优先级计"""
+        metrics.observe("receive_to_dispatch_seconds", time.perf_counter() - queued)
+        priority = min(mention_priority(note, self.user_id) for note in notes)
+        backlog = self.dispatcher.backlog(notes[0]) if self.dispatcher is not None else 0.0
+        return admission.check(max(created_at(note) for note in notes), priority, self.chat.conf.max_age, backlog), priority
+
+    def _shed(self, notes: List[dict], reason: str, priority: int):
+        """舍弃提及：不回复，或以固定回复应答（不请求LLM）；异步子类中返回待await的协程"""
+        admission.record(self.channel_label, reason, len(notes))
+        metrics.inc("shed_total", len(notes), channel=self.channel_label, reason=reason, priority=PRIORITY_NAMES[priority])
+        mentions, _, note_id = self._batch_info(notes)
+        logger.info(f"舍弃频道{self.channel_id}的提及 {note_id}（{REASONS[reason]}）")
+        return self._reply(mentions, SHED_REPLY if SHED_MODE == "reply" else None, note_id, [note['id'] for note in notes])
+
+    @staticmethod
+    def _mention_info(note: dict):
+        """尝试获取用户信息，返回(用户名, 帖子ID, 内容)"""
+        user_info = note.get('user', {})
+        user = user_info.get('username') if user_info.get('username') else user_info.get('id')
+        return user, note.get('id'), note['text']
+
+    def _log_result(self, note_id: Optional[str]):
+        metrics.inc("replies_total" if note_id else "failures_total", channel=self.channel_label)
+        if note_id:
             logger.info(f"成功回复! Note ID: {note_id}")
             logger.info(f"查看链接: {INSTANCE_URL}/notes/{note_id}")
         else:
             logger.error("回复失败，请检查错误信息")
 
+    def _batch_info(self, notes: List[dict]):
+        """合并的提及：返回(@提及前缀, (用户, 内容)列表, 回复目标帖子ID)"""
+        items = [self._mention_info(note) for note in notes]
+        users = list(dict.fromkeys(user for user, _, _ in items)) # 去重并保持顺序
+        mentions = " ".join(f"@{user}" for user in users)
+        return mentions, [(user, content) for user, _, content in items], items[-1][1]
+
+    def _reply(self, mentions: str, reply: Optional[str], note_id: str, batch: Optional[List[str]] = None):
+        """发送回复，reply为None时（如被限流丢弃）不回复；成功或跳过后把batch（默认为note_id）标记为已处理"""
+        if reply is None:
+            return self._skipped(note_id, batch)
+        future = self.poster.submit_note( # 交给发帖调度器，工作线程不等待发送
+            text = f"{mentions} "+reply,
+            replyId = note_id,
+        )
+        future.add_done_callback(lambda sent: self._on_sent(sent.result(), batch or [note_id]))
+
+    def _skipped(self, note_id: str, batch: Optional[List[str]]):
+        """不回复的提及同样标记为已处理"""
+        logger.info(f"已跳过对帖子 {note_id} 的回复")
+        durable_queue.done(batch or [note_id])
+        self._settle(batch or [note_id])
+
+    def _on_sent(self, created_id: Optional[str], batch: List[str]):
+        """回复发送完成（created_id为新帖子ID，失败时为None）"""
+        self._log_result(created_id)
+        if created_id:
+            durable_queue.done(batch)
+        self._settle(batch)
+
+    def on_mentions(self, notes: List[dict]):
+        """处理一批提及，多条时合并为一次回复"""
+        if len(notes) == 1:
+            return self.on_mention(notes[0])
+
+        mentions, items, note_id = self._batch_info(notes)
+        logger.info(f"👥 合并提及 来自频道{self.channel_id} {mentions}: 共{len(notes)}条")
+
+        self._reply(mentions, self.chat.handle_batch(items, note_id), note_id, [note['id'] for note in notes])
+
+    def on_mention(self, note):
+        """当有人@你时调用（可重写）"""
+        user, note_id, content = self._mention_info(note)
+        logger.info(f"👤 新提及 来自频道{self.channel_id} 用户[{user}]: {content}")
+
+        self._reply(f"@{user}", self.chat.handle_chat(user, content, note_id), note_id)
+
+
+    def replay(self) -> int:
+        """重新提交持久化队列中本频道未完成的提及，返回条数"""
+        notes = durable_queue.pending(self.channel_id)
+        self._track(notes)
+        for note in notes:
+            self._submit([note])
+        if notes:
+            logger.info(f"频道{self.channel_id} 重放未完成的提及 {len(notes)}条")
+        return len(notes)
+
+    def start_listening(self):
+        """开始监听消息，支持指定频道（单独使用时自建一条连接）"""
+        self.running = True
+        if not self._owns_manager: # 反复调用时沿用同一连接，以便重连后补齐漏掉的提及
+            self.manager = MisskeyStreamManager(self.api_token)
+            self._owns_manager = True
+            self.manager.add_listener(self)
+        self.manager.start_listening()
+
+    def stop(self):
+        self.running = False
+        if self.manager is not None:
+            if self._owns_manager:
+                self.manager.stop()
+            else:
+                self.manager.remove_listener(self.channel_id)
+        logger.info("监听器停止指令已发送")
+
+
+class MisskeyStreamManager:
+    '''共享连接管理类，同一API Token下的所有频道复用一条streaming连接'''
+    def __init__(self, api_token: str = None):
+        self.instance_url = INSTANCE_URL.rstrip('/')
+        self.api_token = api_token or config.API_TOKEN # 热重载后新建的监听器与连接使用新值
+        self.ws_url = streaming_url(self.instance_url, self.api_token)
+        self.running = False
+        self.listeners: Dict[Optional[str], MisskeyNotificationListener] = {} # 订阅的频道 -> 监听器
+        self._lock = threading.Lock() # 保护listeners与websocket的并发访问
+        self._websocket = None
+        self._disconnected_at: Optional[float] = None # 断线时间，重连后据此补齐漏掉的提及
+        self._catch_up_lock = threading.Lock() # 多次重连时补齐依次进行
+        self.caught_up = 0 # 累计补齐的提及数
+        self.supervisor = ReconnectSupervisor(self._channel_labels) # 重连退避与连接健康状况
+        self._stop_event = threading.Event() # 停止时打断重连前的等待
+
+    def _channel_labels(self) -> List[str]:
+        return [listener.channel_label for listener in list(self.listeners.values())]
+
+    def health(self) -> dict:
+        """连接健康状况：状态、已连接秒数、ping往返时间、重连与半开次数，以及连接上的频道"""
+        return dict(self.supervisor.snapshot(), channels=self._channel_labels())
+
+    # 订阅管理
+    def _send(self, websocket, msg: dict):
+        try:
+            websocket.send(json.dumps(msg))
+        except Exception as e:
+            # 发送失败说明连接已断开，重连后会重新订阅全部频道
+            logger.error(f"发送订阅消息失败: {e}")
+
+    def _subscribe(self, websocket, channel_id: Optional[str]):
+        if channel_id is None: # 无频道ID的监听器只依赖main推送
+            return
+        self._send(websocket, {
+            "type": "connect",
+            "body": {
+                "channel": "channel",
+                "id": subscription_id(channel_id),
+                "params": {
+                    "channelId": channel_id
+                }
+            }
+        })
+        logger.info(f"已订阅频道: {channel_id}")
+
+    def add_listener(self, listener: MisskeyNotificationListener):
+        """加入频道监听器，连接已建立时立即订阅"""
+        with self._lock:
+            self.listeners[listener.channel_id] = listener
+            listener.manager = self
+            websocket = self._websocket
+        self.supervisor.publish([listener.channel_label])
+        if websocket is not None:
+            self._subscribe(websocket, listener.channel_id)
+
+    def remove_listener(self, channel_id: Optional[str]):
+        """移除频道监听器并退订，不影响其它频道"""
+        with self._lock:
+            listener = self.listeners.pop(channel_id, None)
+            websocket = self._websocket
+        if listener is None:
+            return
+        listener.running = False
+        metrics.set_gauge("stream_connected", 0, channel=listener.channel_label)
+        if websocket is not None and channel_id is not None:
+            self._send(websocket, {"type": "disconnect", "body": {"id": subscription_id(channel_id)}})
+            logger.info(f"已退订频道: {channel_id}")
+
+    # 消息路由
+    def _route(self, message):
+        """按订阅ID把消息帧分发给对应频道的监听器"""
+        stream_recorder.write(message)
+        try:
+            data = json.loads(message)
+        except json.JSONDecodeError:
+            logger.error("消息解析失败")
+            return
+        self._route_frame(data)
+
+    def _route_frame(self, data: dict):
+        """分发已解析的消息帧；单个帧或某个频道的处理出错只记录日志，不断开所有频道共用的连接"""
+        try:
+            listener = self._listener_for(data)
+            if listener is not None:
+                listener._dispatch(data)
+        except Exception as e:
+            logger.exception(f"处理消息帧失败: {e}")
+            metrics.inc("frame_errors_total")
+
+    def _listener_for(self, data: dict) -> Optional[MisskeyNotificationListener]:
+        """消息帧所属频道的监听器，无需处理的帧为None"""
+        if data.get('type') != 'channel':
+            return None
+
+        body = data.get('body') or {}
+        sub_id = body.get('id') or ''
+
+        if sub_id == 'main': # 提及等通知只推送一次，按帖子所属频道分发
+            note = body.get('body') or {}
+            channel_id = (note.get('channel') or {}).get('id')
+            listener = self.listeners.get(str(channel_id)) if channel_id else None
+            if listener is None:
+                listener = self.listeners.get(None)
+            return listener
+        if sub_id.startswith('channel_'):
+            return self.listeners.get(sub_id[len('channel_'):])
+        return None
 
     def start_listening(self):
-        """开始监听消息，支持指定频道"""
+        """建立连接，订阅main及所有频道后持续接收消息"""
+        from websockets.sync.client import connect # 延迟导入，asyncio模式使用websockets的异步客户端
+        from websockets.exceptions import ConnectionClosedOK
         self.running = True
-        logger.info(f"开始监听通知 (频道ID: {self.channel_id})")
-        
+        self.supervisor.connecting()
+        logger.info(f"开始监听通知 (频道数: {len(self.listeners)})")
+        connected = False
+        closed = threading.Event() # 通知心跳线程连接已结束
+
         try:
-            with connect(self.ws_url) as websocket:
+            with connect(self.ws_url, open_timeout=CONNECT_TIMEOUT, **connect_options(connect)) as websocket:
                 # 必须首先订阅主频道才能接收通知
-                main_connect_msg = {
-                    "type": "connect",
-                    "body": {
-                        "channel": "main",
-                        "id": "main"
-                    }
-                }
-                websocket.send(json.dumps(main_connect_msg))
-                
-                # 如果提供了频道ID，则额外订阅该频道
-                if self.channel_id:
-                    channel_connect_msg = {
-                        "type": "connect",
-                        "body": {
-                            "channel": "channel",
-                            "id": f"channel_{self.channel_id}",
-                            "params": {
-                                "channelId": self.channel_id
-                            }
-                        }
-                    }
-                    websocket.send(json.dumps(channel_connect_msg))
-                    logger.info(f"已订阅频道: {self.channel_id}")
-            
-                # 持续接收消息
+                self._send(websocket, MAIN_CONNECT_MSG)
+
+                with self._lock:
+                    self._websocket = websocket
+                    channel_ids = list(self.listeners)
+                for channel_id in channel_ids:
+                    self._subscribe(websocket, channel_id)
+                connected = True
+                self.supervisor.connected()
+                self._start_catch_up()
+                if self.supervisor.ping_interval > 0:
+                    threading.Thread(target=self._heartbeat, args=(websocket, closed), name="stream-heartbeat", daemon=True).start()
+
+                # 持续接收消息（连接失效由心跳线程发现并关闭套接字，recv随即抛出异常）
                 while self.running:
-                        try:
-                            message = websocket.recv(timeout=10)
-                            self._handle_message(message)
-                        except TimeoutError:
-                            # 心跳包保持
-                            ping_msg = {"type": "ping", "body": {"id": "heartbeat"}}
-                            websocket.send(json.dumps(ping_msg))
-                        except ConnectionClosedOK as e: # WebSocket 连接正常关闭
-                            return
-                        except Exception as e:
-                            logger.exception(f"连接错误: {e}")
-                            raise  # 关键修改：向上抛出异常
+                    try:
+                        message = websocket.recv()
+                    except ConnectionClosedOK: # WebSocket 连接正常关闭
+                        return
+                    self._route(message)
         except Exception as e:
             logger.error(f"订阅错误: {e}")
-            raise  # 关键修改：向上抛出异常
-            
+            raise
+        finally:
+            closed.set()
+            with self._lock:
+                self._websocket = None
+            self._closed(connected)
+
+    def _closed(self, connected: bool):
+        """连接结束：记录断线时间供重连后补齐（连续重连失败时保留最早的断线时间）"""
+        if connected and self._disconnected_at is None:
+            self._disconnected_at = time.time()
+
+    def _heartbeat(self, websocket, closed: threading.Event):
+        """每ping_interval秒发送ping并测量往返时间；超时未收到pong时直接关闭套接字（半开连接上close()要等关闭握手超时）"""
+        supervisor = self.supervisor
+        while not closed.wait(supervisor.ping_interval):
+            sent = time.perf_counter()
+            try:
+                pong = websocket.ping()
+            except Exception: # 连接已关闭
+                return
+            if pong.wait(supervisor.ping_timeout):
+                supervisor.pong(time.perf_counter() - sent)
+            elif not closed.is_set():
+                supervisor.timed_out()
+                try:
+                    websocket.socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                return
+
+    # 断线补齐
+    def _catch_up_since(self) -> Optional[float]:
+        """取出待补齐的断线时间，没有断线或未启用补齐时为None"""
+        since, self._disconnected_at = self._disconnected_at, None
+        if since is None or not CATCHUP_ENABLED or not self.running:
+            return None
+        return since
+
+    def _cursor(self) -> Optional[str]:
+        """补齐的起点：各频道最近收到的提及中最新的一条（同一连接上的提及按ID顺序推送）"""
+        ids = [listener.last_mention_id for listener in list(self.listeners.values()) if listener.last_mention_id]
+        return max(ids) if ids else None
+
+    def _mentions_request(self, since_id: Optional[str]):
+        """notes/mentions的地址与请求体"""
+        payload = {"i": self.api_token, "limit": CATCHUP_PAGE}
+        if since_id is not None:
+            payload["sinceId"] = since_id
+        return f"{self.instance_url}/api/notes/mentions", payload
+
+    @staticmethod
+    def _missed(page: List[dict], since_id: Optional[str], since: float) -> List[dict]:
+        """从一页结果中选出需要补齐的提及，按时间从旧到新排列"""
+        notes = sorted(page, key=lambda note: (created_at(note), note.get('id') or ''))
+        if since_id is None: # 没有起点ID时按断线时间筛选
+            notes = [note for note in notes if created_at(note) >= since - CATCHUP_MARGIN]
+        return [note for note in notes if note.get('id') and not durable_queue.seen(note['id'])]
+
+    def _catch_up_notes(self, page: List[dict], since_id: Optional[str], since: float, fed: int) -> List[dict]:
+        """一页中本次要送入处理的提及（总数不超过CATCHUP_MAX）"""
+        return self._missed(page, since_id, since)[:CATCHUP_MAX - fed]
+
+    @staticmethod
+    def _next_page(page: List[dict], since_id: Optional[str]) -> Optional[str]:
+        """下一页的起点ID，没有更多页时为None"""
+        if since_id is None:
+            if len(page) >= CATCHUP_PAGE:
+                logger.warning("断线期间的提及超过一页，更早的提及无法补齐")
+            return None
+        if len(page) < CATCHUP_PAGE:
+            return None
+        return max(note['id'] for note in page)
+
+    @staticmethod
+    def _caught_up(fed: int):
+        if fed:
+            logger.info(f"已补齐断线期间的提及 {fed}条")
+
+    def _feed(self, note: dict):
+        """把补齐的提及送入与实时推送相同的处理流程（同样经过去重）"""
+        frame = mention_frame(note)
+        stream_recorder.write(frame, CATCHUP)
+        self._route_frame(frame)
+        self.caught_up += 1
+        metrics.inc("caught_up_total")
+
+    def _fetch_mentions(self, since_id: Optional[str]) -> Optional[List[dict]]:
+        """取一页提及：有since_id时为其后最早的一页（从旧到新），否则为最新的一页"""
+        import requests # 延迟导入，asyncio模式由子类覆盖本方法，不加载requests
+        url, payload = self._mentions_request(since_id)
+        try:
+            with lease_session(url) as session:
+                response = session.post(url, json=payload, timeout=(CONNECT_TIMEOUT, MISSKEY_TIMEOUT))
+            response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"获取断线期间的提及失败: {e}")
+            return None
+
+    def _catch_up(self, since: float, since_id: Optional[str]):
+        """分页拉取断线期间的提及并限速送入处理"""
+        with self._catch_up_lock:
+            interval = 1 / CATCHUP_RATE if CATCHUP_RATE > 0 else 0
+            fed = 0
+            while self.running and fed < CATCHUP_MAX:
+                page = self._fetch_mentions(since_id)
+                if not page:
+                    break
+                for note in self._catch_up_notes(page, since_id, since, fed):
+                    if not self.running:
+                        break
+                    self._feed(note)
+                    fed += 1
+                    if interval:
+                        time.sleep(interval)
+                since_id = self._next_page(page, since_id)
+                if since_id is None:
+                    break
+            self._caught_up(fed)
+
+    def _start_catch_up(self):
+        """重连后在后台补齐，不阻塞实时消息的接收；起点须在开始接收前取得"""
+        since = self._catch_up_since()
+        if since is not None:
+            threading.Thread(target=self._catch_up, args=(since, self._cursor()), name="mention-catch-up", daemon=True).start()
+
+    def run_forever(self):
+        """带重连的监听循环：断线（含服务器正常关闭）后按监督者给出的退避时间无限重试，直到stop()"""
+        self.running = True
+        while self.running:
+            error = None
+            try:
+                self.start_listening()
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            if not self.running:
+                break
+            self._stop_event.wait(self._reconnect_delay(error))
+        self.supervisor.stopped()
+
+    def _reconnect_delay(self, error: Optional[str]) -> float:
+        """记录断线，返回重连前的退避秒数"""
+        delay = self.supervisor.disconnected(error)
+        logger.error(f"连接断开{': ' + error if error else ''}; 将在{delay:.1f}秒后重连 (连续第{self.supervisor.attempt}次)")
+        return delay
+
     def stop(self):
         self.running = False
-        logger.info("监听器停止指令已发送")
+        self._stop_event.set()
+        with self._lock:
+            websocket = self._websocket
+        if websocket is not None:
+            websocket.close()
+        logger.info("共享连接停止指令已发送")
 
 
 if __name__ == "__main__":
-    
+    setup_logging()
+
     chat = ChatHandler()
     poster = MisskeyPoster(instance_url=INSTANCE_URL, api_token=API_TOKEN,)
-    
+
     # 启动监听
     listener = MisskeyNotificationListener(CHANNEL_ID[0], chat, poster) # 当没有指定channel_id时需用None占位
-    
-    import time
-    reconnect_attempts = 5
-    max_reconnect_attempts = 10
 
-    try:
-        while max_reconnect_attempts > 1:
-            try :
-                listener.start_listening() # 指定监听频道，默认主频道。
-            except Exception as e:
-                logger.error(f"连接错误: {e}; 即将重连...")
+    manager = MisskeyStreamManager(API_TOKEN)
+    manager.add_listener(listener)
 
-            max_reconnect_attempts -= 1
-            time.sleep(reconnect_attempts)
-            reconnect_attempts += 2
-        logger.error(f"达到最大重连次数，程序终止。")
+    try:
+        manager.run_forever() # 断线后按退避无限重连
     except KeyboardInterrupt:
-        listener.stop()
-        logger.info("程序已停止")
\ No newline at end of file
+        manager.stop()
+        logger.info("程序已停止")
@@ -0,0 +1,182 @@
+import time
+import queue
+import logging
+import threading
+import zlib
+from typing import TYPE_CHECKING, Callable, List, Optional
+from .config import WORKERS, QUEUE_SIZE, ORDER_BY, ASYNC_WORKERS
+
+if TYPE_CHECKING:
+    import asyncio
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+def order_key(note: dict, order_by: str = ORDER_BY) -> str:
+    """提及的排序键：同一键的提及按接收顺序处理"""
+    if order_by == "thread":
+        return str(note.get('threadId') or note.get('replyId') or note.get('id'))
+    user_info = note.get('user') or {}
+    return str(user_info.get('id') or user_info.get('username') or note.get('id'))
+
+def _shard(key: str, n: int) -> int:
+    return zlib.crc32(key.encode("utf-8")) % n
+
+class MentionDispatcher:
+    '''
+    提及分发类：接收循环只负责入队，由工作线程池处理；同一排序键固定落在同一工作线程上以保证顺序
+    各工作线程的队列本身不限长，queue_size限制的是所有队列中待处理提及的总数，热点排序键可以用满整个容量
+    '''
+    def __init__(self, workers: int = WORKERS, queue_size: int = QUEUE_SIZE, order_by: str = ORDER_BY):
+        self.workers = max(1, workers)
+        self.order_by = order_by
+        self.capacity = max(1, queue_size)
+        self.queues = [self._new_queue() for _ in range(self.workers)]
+        self.threads: List[threading.Thread] = []
+        self.running = False
+
+        # 统计信息
+        self.queued = 0 # 所有队列中待处理的提及数（共享计数，不超过capacity）
+        self.busy = 0 # 正在处理的工作线程数
+        self.busy_time = 0.0 # 累计处理耗时
+        self.processed = 0
+        self.dropped = 0
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def _new_queue(self):
+        return queue.Queue()
+
+    def _queue_for(self, note: dict):
+        return self.queues[_shard(order_key(note, self.order_by), self.workers)]
+
+    def submit(self, note: dict, func: Callable, *args) -> bool:
+        """提交任务，待处理的提及总数已达queue_size时丢弃并返回False（不阻塞接收循环）"""
+        with self._lock:
+            if self.queued >= self.capacity:
+                self.dropped += 1
+                full = True
+            else:
+                self.queued += 1
+                full = False
+        if full:
+            logger.warning(f"提及队列已满，丢弃帖子 {note.get('id')}")
+            return False
+        self._queue_for(note).put_nowait((func, args))
+        return True
+
+    def _begin(self) -> float:
+        """工作者取出一条任务"""
+        with self._lock:
+            self.queued -= 1
+            self.busy += 1
+        return time.time()
+
+    def _end(self, start: float):
+        with self._lock:
+            self.busy -= 1
+            self.busy_time += time.time() - start
+            self.processed += 1
+
+    def _worker(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            if item is None: # 停止信号
+                break
+            func, args = item
+            start = self._begin()
+            try:
+                func(*args)
+            except Exception as e:
+                logger.exception(f"提及处理失败: {e}")
+            finally:
+                self._end(start)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.started_at = time.time()
+        for i, q in enumerate(self.queues):
+            thread = threading.Thread(target=self._worker, args=(q,), name=f"mention-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"提及工作线程池已启动 (线程数: {self.workers})")
+
+    def stop(self, timeout: Optional[float] = 5):
+        """处理完已入队的提及后停止"""
+        if not self.running:
+            return
+        self.running = False
+        for q in self.queues:
+            q.put(None)
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+        self.threads.clear()
+
+    def backlog(self, note: Optional[dict] = None) -> float:
+        """
+        待处理队列的占用率（0~1），供准入控制判断是否过载
+        给出note时为其所在工作线程的队列（排在它后面的提及）相对于平均分到每个工作者的容量
+        """
+        if note is not None:
+            return min(1.0, self._queue_for(note).qsize() * self.workers / self.capacity)
+        return self.queued / self.capacity
+
+    def stats(self) -> dict:
+        """队列深度与工作线程利用率"""
+        with self._lock:
+            elapsed = max(time.time() - self.started_at, 1e-9)
+            return {
+                "queue_depth": self.queued,
+                "queue_capacity": self.capacity,
+                "workers": self.workers,
+                "busy_workers": self.busy,
+                "utilization": self.busy_time / (elapsed * self.workers),
+                "processed": self.processed,
+                "dropped": self.dropped,
+            }
+
+class AsyncMentionDispatcher(MentionDispatcher):
+    '''异步提及分发类，工作者为事件循环中的协程，须在事件循环内调用；入队与统计复用MentionDispatcher'''
+    def __init__(self, workers: int = ASYNC_WORKERS, queue_size: int = QUEUE_SIZE, order_by: str = ORDER_BY):
+        super().__init__(workers, queue_size, order_by)
+        self.tasks: List["asyncio.Task"] = []
+
+    def _new_queue(self):
+        import asyncio # 只有asyncio模式才导入（线程模式启动时不加载asyncio）
+        return asyncio.Queue()
+
+    async def _aworker(self, q: "asyncio.Queue"):
+        while True:
+            item = await q.get()
+            if item is None:
+                break
+            func, args = item
+            start = self._begin()
+            try:
+                await func(*args)
+            except Exception as e:
+                logger.exception(f"提及处理失败: {e}")
+            finally:
+                self._end(start)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.started_at = time.time()
+        import asyncio
+        loop = asyncio.get_running_loop()
+        self.tasks = [loop.create_task(self._aworker(q)) for q in self.queues]
+        logger.info(f"提及协程池已启动 (协程数: {self.workers})")
+
+    async def stop(self, timeout: Optional[float] = 5):
+        if not self.running:
+            return
+        self.running = False
+        for q in self.queues:
+            q.put_nowait(None)
+        import asyncio
+        if self.tasks:
+            await asyncio.wait(self.tasks, timeout=timeout)
+        self.tasks.clear()
@@ -0,0 +1,125 @@
+import os
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import mimetypes
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+from .config import DRIVE_CACHE_PATH, CONFIG_PATH
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+CHUNK_SIZE = 1024 * 1024 # 计算哈希与上传时每次读取的字节数
+
+def file_md5(file_path) -> str:
+    """按块读取计算文件的MD5（Misskey网盘以MD5标识文件内容）"""
+    digest = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def account_key(api_token: str) -> str:
+    """网盘属于账号，缓存按Token区分（只保存Token的摘要）"""
+    return hashlib.sha256(api_token.encode("utf-8")).hexdigest()[:16]
+
+class DriveCache:
+    '''网盘文件缓存类：(账号, 内容MD5) -> 网盘文件ID，可选SQLite持久化；本地文件的MD5按大小与修改时间缓存'''
+    def __init__(self, path: Optional[Path] = None):
+        self._ids: Dict[Tuple[str, str], str] = {} # (账号, MD5) -> 文件ID
+        self._hashes: Dict[str, Tuple[int, int, str]] = {} # 文件路径 -> (大小, 修改时间, MD5)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS drive_files (account TEXT, md5 TEXT, file_id TEXT, stored_at REAL, PRIMARY KEY (account, md5))")
+            self._db.commit()
+            for account, md5, file_id in self._db.execute("SELECT account, md5, file_id FROM drive_files"):
+                self._ids[(account, md5)] = file_id
+            logger.info(f"网盘文件缓存已持久化到: {path}")
+
+    def md5(self, file_path) -> str:
+        """文件内容的MD5，文件未改变时不重复计算"""
+        key = os.path.abspath(file_path)
+        stat = os.stat(key)
+        with self._lock:
+            cached = self._hashes.get(key)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        md5 = file_md5(key)
+        with self._lock:
+            self._hashes[key] = (stat.st_size, stat.st_mtime_ns, md5)
+        return md5
+
+    def get(self, account: str, md5: str) -> Optional[str]:
+        with self._lock:
+            file_id = self._ids.get((account, md5))
+            if file_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return file_id
+
+    def put(self, account: str, md5: str, file_id: str):
+        with self._lock:
+            self._ids[(account, md5)] = file_id
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO drive_files VALUES (?, ?, ?, ?)", (account, md5, file_id, time.time()))
+                self._db.commit()
+
+    def forget(self, file_id: str):
+        """网盘中的文件被删除后移除对应条目"""
+        with self._lock:
+            for key in [key for key, value in self._ids.items() if value == file_id]:
+                del self._ids[key]
+            if self._db is not None:
+                self._db.execute("DELETE FROM drive_files WHERE file_id = ?", (file_id,))
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._ids),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+class MultipartFile:
+    '''流式multipart/form-data请求体：文件按块读出，不整体读入内存；带长度，以便按Content-Length而非分块编码发送'''
+    def __init__(self, fields: Dict[str, str], file_path, field: str = "file"):
+        self.file_path = file_path
+        self.boundary = uuid.uuid4().hex
+        name = os.path.basename(file_path).replace('"', '%22')
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        head = "".join(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'
+            for key, value in fields.items()
+        )
+        head += f'--{self.boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{name}"\r\nContent-Type: {mimetype}\r\n\r\n'
+        self.head = head.encode("utf-8")
+        self.tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self.size = len(self.head) + os.path.getsize(file_path) + len(self.tail)
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[bytes]:
+        """每次迭代重新打开文件，重试时可直接复用"""
+        yield self.head
+        with open(self.file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                yield chunk
+        yield self.tail
+
+# 进程级共享网盘文件缓存，path为空时仅在内存中
+drive_cache = DriveCache((CONFIG_PATH.parent / DRIVE_CACHE_PATH) if DRIVE_CACHE_PATH else None)
@@ -0,0 +1,165 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Tuple
+from .config import DURABLE_ENABLED, DURABLE_PATH, DURABLE_FLUSH_INTERVAL, DURABLE_REPLAY_MAX_AGE, DEDUP_SIZE, CONFIG_PATH
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+PENDING, DONE = 0, 1
+PRUNE_INTERVAL = 60 # 清理已完成记录的间隔，单位秒
+
+class DurableQueue:
+    '''
+    持久化提及队列：收到提及时写入SQLite（WAL），回复发送成功后标记完成，启动时重放未完成的提及
+    写入由后台线程按flush_interval成批提交，接收循环只做内存操作；崩溃时最多丢失最近一个提交周期内的记录
+    附带近期帖子ID的去重索引，未启用持久化（path为None）时只做去重
+    '''
+    def __init__(self, path: Optional[Path] = None, dedup_size: int = DEDUP_SIZE, flush_interval: float = DURABLE_FLUSH_INTERVAL):
+        self.dedup_size = max(1, dedup_size)
+        self.flush_interval = flush_interval
+        self._seen: "OrderedDict[str, None]" = OrderedDict() # 近期帖子ID（按接收顺序）
+        self._inserts: List[Tuple] = [] # 待提交的新提及
+        self._dones: List[Tuple] = [] # 待提交的完成标记
+        self._lock = threading.Lock() # 保护内存中的索引与待提交列表
+        self._db_lock = threading.Lock() # 写入线程与重放共用一个连接
+        self._db: Optional[sqlite3.Connection] = None
+        self._stopped = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        self._pruned_at = time.time()
+        self.duplicates = 0
+        self.batches = 0
+        self.written = 0
+
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL") # WAL下NORMAL即可保证提交后的记录不因进程崩溃丢失
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS mentions ("
+                "note_id TEXT PRIMARY KEY, channel_id TEXT, note TEXT, received REAL, status INTEGER, done_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS mentions_status ON mentions (status, received)")
+            self._db.commit()
+            rows = self._db.execute("SELECT note_id FROM mentions ORDER BY received DESC LIMIT ?", (self.dedup_size,)).fetchall()
+            for (note_id,) in reversed(rows): # 重启后去重索引继续有效
+                self._seen[note_id] = None
+            self._writer = threading.Thread(target=self._run, name="durable-writer", daemon=True)
+            self._writer.start()
+            logger.info(f"持久化提及队列: {path}")
+
+    # 接收与完成（只做内存操作）
+    def _mark_seen(self, note_id: str):
+        self._seen[note_id] = None
+        while len(self._seen) > self.dedup_size:
+            self._seen.popitem(last=False)
+
+    def add(self, channel_id: Optional[str], note: dict) -> bool:
+        """记录新提及，重复的帖子返回False"""
+        note_id = note.get('id')
+        if note_id is None:
+            return True
+        with self._lock:
+            if note_id in self._seen:
+                self.duplicates += 1
+                return False
+            self._mark_seen(note_id)
+            if self._db is not None:
+                self._inserts.append((note_id, channel_id, json.dumps(note, ensure_ascii=False), time.time(), PENDING, None))
+        return True
+
+    def seen(self, note_id: str) -> bool:
+        """帖子是否已收到过"""
+        with self._lock:
+            return note_id in self._seen
+
+    def done(self, note_ids: List[str]):
+        """标记提及已处理（回复已发送或按规则跳过）"""
+        if self._db is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._dones.extend((DONE, now, note_id) for note_id in note_ids if note_id is not None)
+
+    # 成批提交
+    def flush(self):
+        """提交积累的写入（一个事务）"""
+        with self._lock:
+            inserts, self._inserts = self._inserts, []
+            dones, self._dones = self._dones, []
+        if self._db is None or not (inserts or dones):
+            return
+        with self._db_lock:
+            try:
+                with self._db:
+                    self._db.executemany("INSERT OR IGNORE INTO mentions VALUES (?, ?, ?, ?, ?, ?)", inserts)
+                    self._db.executemany("UPDATE mentions SET status = ?, done_at = ? WHERE note_id = ?", dones)
+                self.batches += 1
+                self.written += len(inserts) + len(dones)
+            except sqlite3.Error as e:
+                logger.error(f"持久化提及队列写入失败: {e}")
+
+            if time.time() - self._pruned_at >= PRUNE_INTERVAL:
+                self._prune()
+
+    def _prune(self):
+        """只保留去重索引范围内的已完成记录"""
+        self._pruned_at = time.time()
+        try:
+            with self._db:
+                self._db.execute(
+                    "DELETE FROM mentions WHERE status = ? AND note_id NOT IN "
+                    "(SELECT note_id FROM mentions ORDER BY received DESC LIMIT ?)",
+                    (DONE, self.dedup_size)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"持久化提及队列清理失败: {e}")
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    # 启动时重放
+    def pending(self, channel_id: Optional[str], max_age: float = DURABLE_REPLAY_MAX_AGE) -> List[dict]:
+        """取出频道中未完成的提及（按接收顺序）；超过max_age秒的过期提及直接标记完成，不再回复"""
+        if self._db is None:
+            return []
+        self.flush()
+        cutoff = time.time() - max_age if max_age > 0 else 0
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT note_id, note, received FROM mentions WHERE status = ? AND channel_id IS ? ORDER BY received",
+                (PENDING, channel_id)
+            ).fetchall()
+        stale = [note_id for note_id, _, received in rows if received < cutoff]
+        if stale:
+            logger.info(f"频道{channel_id} 有{len(stale)}条过期的未完成提及，已跳过")
+            self.done(stale)
+        return [json.loads(note) for _, note, received in rows if received >= cutoff]
+
+    def close(self):
+        self._stopped.set()
+        if self._writer is not None:
+            self._writer.join(timeout=5)
+            self._writer = None
+        if self._db is not None:
+            self.flush()
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "seen": len(self._seen),
+                "duplicates": self.duplicates,
+                "batches": self.batches,
+                "written": self.written,
+            }
+
+# 进程级共享提及队列，未启用持久化时只做去重
+durable_queue = DurableQueue((CONFIG_PATH.parent / DURABLE_PATH) if DURABLE_ENABLED else None)
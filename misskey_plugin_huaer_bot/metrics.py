@@ -0,0 +1,239 @@
+import json
+import time
+import inspect
+import functools
+import logging
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+from .config import METRICS_ENABLED
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+PREFIX = "huaer_bot_" # Prometheus指标名前缀
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0) # 耗时直方图的桶上界，单位秒
+
+class Histogram:
+    '''耗时直方图：固定桶计数，记录一次只需一次二分查找'''
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # 最后一格为+Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """由桶计数线性插值估算分位数"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else low
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+class _Timer:
+    '''计时上下文，退出时把耗时记入直方图'''
+    __slots__ = ("metrics", "name", "labels", "started")
+
+    def __init__(self, metrics: "Metrics", name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+class _NullTimer:
+    '''未启用指标时使用的空计时上下文'''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Metrics:
+    '''指标收集类：各处理阶段的耗时直方图、各频道计数与当前状态（如连接是否在线），未启用时记录调用直接返回'''
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._histograms: Dict[Tuple[str, tuple], Histogram] = {} # (指标名, 标签) -> 直方图
+        self._counters: Dict[Tuple[str, tuple], float] = {} # (指标名, 标签) -> 计数
+        self._gauges: Dict[Tuple[str, tuple], float] = {} # (指标名, 标签) -> 当前值
+        self._lock = threading.Lock()
+        self._server: Optional["ThreadingHTTPServer"] = None
+
+    def enable(self):
+        """进程内启用指标收集（如基准测试），不启动HTTP端点"""
+        self.enabled = True
+
+    # 记录
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def timer(self, name: str, **labels):
+        """计时上下文：with metrics.timer("llm_call_seconds", retry=0): ..."""
+        return _Timer(self, name, labels) if self.enabled else _NULL_TIMER
+
+    # 导出
+    def snapshot(self) -> dict:
+        """JSON友好的指标快照，可在进程内直接调用"""
+        with self._lock:
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+            histograms = [(key, list(h.counts), h.sum, h.count, h) for key, h in self._histograms.items()]
+            quantiles = {key: {f"p{int(q * 100)}": h.quantile(q) for q in (0.5, 0.95, 0.99)} for key, *_, h in histograms}
+
+        result: Dict[str, Dict[str, List[dict]]] = {"counters": {}, "gauges": {}, "histograms": {}}
+        for (name, labels), value in counters:
+            result["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), value in gauges:
+            result["gauges"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), counts, total, count, h in histograms:
+            result["histograms"].setdefault(name, []).append({
+                "labels": dict(labels),
+                "count": count,
+                "sum": total,
+                "buckets": dict(zip([str(b) for b in h.buckets] + ["+Inf"], counts)),
+                **quantiles[(name, labels)],
+            })
+        return result
+
+    def render_prometheus(self) -> str:
+        """Prometheus文本格式"""
+        lines: List[str] = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted(((key, list(h.counts), h.sum, h.count, h.buckets) for key, h in self._histograms.items()), key=lambda item: item[0])
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                typed.add(name)
+            lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} gauge")
+                typed.add(name)
+            lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+        for (name, labels), counts, total, count, buckets in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, n in zip([str(b) for b in buckets] + ["+Inf"], counts):
+                cumulative += n
+                le = 'le="' + bound + '"'
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, le)} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    # HTTP端点
+    def serve(self, host: str, port: int):
+        """在后台线程启动本地指标端点：/metrics（Prometheus）与 /metrics.json（JSON快照）"""
+        if self._server is not None:
+            return
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer # 启用端点时才导入
+        self.enabled = True
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = metrics.render_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(metrics.snapshot(), ensure_ascii=False).encode("utf-8"), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args): # 不逐条记录抓取日志
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info(f"指标端点已启动: http://{host}:{self._server.server_address[1]}/metrics")
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+metrics = Metrics() # 进程级共享指标
+
+def timed(name: str, **labels):
+    """把函数（同步或协程）的耗时记入直方图的装饰器"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not metrics.enabled:
+                    return await func(*args, **kwargs)
+                with metrics.timer(name, **labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            with metrics.timer(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
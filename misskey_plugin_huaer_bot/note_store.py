@@ -0,0 +1,112 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from .config import NOTE_STORE_ENABLED, NOTE_STORE_MAX_NOTES, NOTE_STORE_MAX_BYTES, NOTE_STORE_TTL
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+_ENTRY_OVERHEAD = 256 # 每条帖子除文本外的估算内存占用，单位字节
+
+class NoteStore:
+    '''回复链缓存类：按帖子ID保存streaming推送与自己发出的帖子，本地重建回复链'''
+    def __init__(self, max_notes: int = NOTE_STORE_MAX_NOTES, max_bytes: int = NOTE_STORE_MAX_BYTES, ttl: float = NOTE_STORE_TTL):
+        self.max_notes = max_notes
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._notes: "OrderedDict[str, tuple]" = OrderedDict() # 帖子ID -> (精简帖子, 写入时间, 估算大小)，按最近使用排序
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _slim(note: dict) -> dict:
+        """只保留构建记忆所需的字段"""
+        user_info = note.get('user') or {}
+        return {
+            "id": note.get('id'),
+            "replyId": note.get('replyId'),
+            "userId": note.get('userId') or user_info.get('id'),
+            "text": note.get('text') or "",
+            "user": {"id": user_info.get('id'), "username": user_info.get('username')},
+        }
+
+    def _evict(self):
+        while self._notes and (len(self._notes) > self.max_notes or self._bytes > self.max_bytes):
+            _, (_, _, size) = self._notes.popitem(last=False)
+            self._bytes -= size
+
+    def put(self, note: Optional[dict]):
+        """写入帖子（连同其内嵌的被回复帖子）"""
+        while note and note.get('id'):
+            slim = self._slim(note)
+            size = _ENTRY_OVERHEAD + len(slim["text"]) * 3 # UTF-8下中文约3字节
+            with self._lock:
+                old = self._notes.pop(slim["id"], None)
+                if old is not None:
+                    self._bytes -= old[2]
+                self._notes[slim["id"]] = (slim, time.time(), size)
+                self._bytes += size
+                self._evict()
+            note = note.get('reply')
+
+    def get(self, note_id: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._notes.get(note_id)
+            if entry is None:
+                return None
+            slim, stored_at, size = entry
+            if time.time() - stored_at > self.ttl:
+                del self._notes[note_id]
+                self._bytes -= size
+                return None
+            self._notes.move_to_end(note_id)
+            return slim
+
+    def ancestors(self, note_id: str, length: Optional[int]) -> Optional[List[dict]]:
+        """沿replyId向上取至多length条祖先帖子（从新到旧，与notes/conversation一致），链不完整时返回None"""
+        note = self.get(note_id)
+        if note is None:
+            self.misses += 1
+            return None
+
+        chain = []
+        parent_id = note["replyId"]
+        while parent_id and (length is None or length <= 0 or len(chain) < length):
+            parent = self.get(parent_id)
+            if parent is None:
+                self.misses += 1
+                return None
+            chain.append(parent)
+            parent_id = parent["replyId"]
+
+        self.hits += 1
+        return chain
+
+    def root(self, note_id: str, max_depth: int = 64) -> str:
+        """沿缓存中的回复链向上找到已知的最早祖先ID，用于识别同一讨论串"""
+        root = note_id
+        note = self.get(note_id)
+        while note is not None and note["replyId"] and max_depth > 0:
+            root = note["replyId"]
+            note = self.get(root)
+            max_depth -= 1
+        return root
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "notes": len(self._notes),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+note_store: Optional[NoteStore] = NoteStore() if NOTE_STORE_ENABLED else None # 进程级共享回复链缓存
+
+def remember(note: Optional[dict]):
+    """写入共享回复链缓存（未启用时忽略）"""
+    if note_store is not None:
+        note_store.put(note)
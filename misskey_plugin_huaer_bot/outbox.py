@@ -0,0 +1,335 @@
+import time
+import heapq
+import logging
+import itertools
+import threading
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from .breaker import backoff_delay
+from .metrics import metrics
+from .config import OUTBOX_WORKERS, OUTBOX_RETRIES, OUTBOX_THROTTLE
+
+if TYPE_CHECKING: # 只用于类型标注，线程模式启动时不加载asyncio
+    import asyncio
+
+logger = logging.getLogger('MisskeyChannelIDFinder')
+
+REPLY, NOTE, BROADCAST = 0, 1, 2 # 发帖优先级，数字小的先发
+_REQUEUE = object() # 遇到限流，放回队列
+
+def rate_limit_wait(status: int, headers, body: Any = None) -> Optional[float]:
+    """
+    根据响应判断需要暂停的秒数，不需要暂停时为None
+    429时依次取Retry-After、Misskey错误信息中的resetMs，都没有时为OUTBOX_THROTTLE；
+    未触发限流但X-RateLimit-Remaining已为0时，暂停到X-RateLimit-Reset
+    """
+    if status == 429:
+        try:
+            return float(headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            pass
+        try:
+            return float(body["error"]["info"]["resetMs"]) / 1000
+        except (TypeError, KeyError, ValueError):
+            return OUTBOX_THROTTLE
+    if headers.get("X-RateLimit-Remaining") == "0":
+        try:
+            return float(headers.get("X-RateLimit-Reset"))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+class RateGate:
+    '''实例限流闸门：收到限流响应后推迟同一实例的所有请求，发帖与网盘上传共用'''
+    def __init__(self):
+        self.until = 0.0 # 暂停到此时间
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def delay(self) -> float:
+        """距离可以发送还需等待的秒数"""
+        return max(0.0, self.until - time.time())
+
+    def wait(self):
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    def update(self, status: int, headers, body: Any = None) -> Optional[float]:
+        """按响应更新暂停时间，返回本次需要暂停的秒数"""
+        wait = rate_limit_wait(status, headers, body)
+        if wait is not None and wait > 0:
+            with self._lock:
+                self.until = max(self.until, time.time() + wait)
+                self.throttled += 1
+            logger.warning(f"实例限流，暂停发送{wait:.1f}秒")
+        return wait
+
+_gates: Dict[str, RateGate] = {}
+_gates_lock = threading.Lock()
+
+def rate_gate(url: str) -> RateGate:
+    """url所在实例的限流闸门"""
+    host = urlsplit(url).netloc
+    with _gates_lock:
+        if host not in _gates:
+            _gates[host] = RateGate()
+        return _gates[host]
+
+class _Job:
+    '''一条待发送的帖子'''
+    __slots__ = ("poster", "payload", "future", "priority", "seq", "attempts", "queued")
+
+    def __init__(self, poster, payload: dict, future, priority: int, seq: int):
+        self.poster = poster
+        self.payload = payload
+        self.future = future
+        self.priority = priority
+        self.seq = seq
+        self.attempts = 0
+        self.queued = time.perf_counter()
+
+    def __lt__(self, other: "_Job") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class NoteScheduler:
+    '''
+    发帖调度类：所有发送器共用的优先级队列（回复先于普通帖子与广播，同优先级按提交顺序），由固定数量的工作线程发送
+    发送前等待实例限流闸门，连接错误、超时与5xx时抖动退避重试，429时按限流响应头暂停后重试
+    '''
+    def __init__(self, workers: int = OUTBOX_WORKERS, retries: int = OUTBOX_RETRIES):
+        self.workers = max(1, workers)
+        self.retries = retries
+        self._heap: List[_Job] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.threads: List[threading.Thread] = []
+        self.running = False
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self._lock = threading.Lock() # 保护统计信息
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def submit(self, poster, payload: dict, priority: int = NOTE) -> Future:
+        """提交帖子，返回以API响应（失败时为None）完成的Future"""
+        job = _Job(poster, payload, Future(), priority, next(self._seq))
+        with self._cond:
+            if not self.running:
+                self._start()
+            heapq.heappush(self._heap, job)
+            self._cond.notify()
+        return job.future
+
+    def _start(self):
+        self.running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"note-sender-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _next(self) -> Optional[_Job]:
+        """取出优先级最高的帖子，实例限流期间不取出（以便解除时仍按优先级发送）；停止且队列为空时返回None"""
+        with self._cond:
+            while True:
+                if self._heap:
+                    delay = rate_gate(self._heap[0].poster.api_endpoint).delay()
+                    if delay <= 0:
+                        return heapq.heappop(self._heap)
+                    self._cond.wait(delay)
+                elif not self.running:
+                    return None
+                else:
+                    self._cond.wait()
+
+    def _worker(self):
+        while True:
+            job = self._next()
+            if job is None:
+                break
+            try:
+                result = self._deliver(job)
+            except Exception as e:
+                logger.exception(f"发帖失败: {e}")
+                result = None
+            if result is _REQUEUE:
+                with self._cond:
+                    heapq.heappush(self._heap, job)
+                    self._cond.notify()
+            else:
+                job.future.set_result(result)
+
+    # 发送结果的判定（同步与异步调度器共用，只有请求与等待不同）
+    def _outcome(self, job: _Job, gate: RateGate, response, started: float) -> Tuple[bool, Any]:
+        """
+        判定一次发帖请求的结果
+        :param response: _request_note返回的(状态码, 响应头, 响应体)，或其抛出的异常
+        :return: (是否结束, 值)；结束时值为API响应体、_REQUEUE或None（失败），否则为可重试的错误说明
+        """
+        if isinstance(response, Exception):
+            if not job.poster._retryable(response):
+                logger.error(f"API请求失败: {response}")
+                return True, self._failed()
+            return False, str(response) or type(response).__name__
+
+        status, headers, body = response
+        metrics.observe("send_note_seconds", time.perf_counter() - started)
+        throttle = gate.update(status, headers, body)
+        if status < 400:
+            metrics.observe("outbox_wait_seconds", started - job.queued)
+            self._count("sent")
+            return True, body
+        if status != 429 and status < 500:
+            logger.error(f"API请求失败: {status}")
+            logger.error(f"API错误详情: {body}")
+            return True, self._failed()
+        if throttle is not None: # 放回队列，限流解除后按优先级重新发送
+            self._count("retried")
+            return True, _REQUEUE
+        return False, f"HTTP {status}"
+
+    def _retry_delay(self, job: _Job, error: str) -> Optional[float]:
+        """可重试的失败后应等待的秒数，重试次数用尽时为None"""
+        if job.attempts > self.retries:
+            return None
+        delay = backoff_delay(job.attempts - 1)
+        logger.error(f"发帖失败: {error} 将在{delay:.1f}秒后重试... (尝试 {job.attempts})")
+        self._count("retried")
+        return delay
+
+    def _failed(self) -> None:
+        self._count("failed")
+        return None
+
+    def _deliver(self, job: _Job) -> Optional[dict]:
+        gate = rate_gate(job.poster.api_endpoint)
+        while job.attempts <= self.retries:
+            job.attempts += 1
+            gate.wait()
+            started = time.perf_counter()
+            try:
+                response = job.poster._request_note(job.payload)
+            except Exception as e:
+                response = e
+            done, value = self._outcome(job, gate, response, started)
+            if done:
+                return value
+            delay = self._retry_delay(job, value)
+            if delay is not None:
+                time.sleep(delay)
+        return self._failed()
+
+    def stop(self, timeout: Optional[float] = 30):
+        """发送完已入队的帖子后停止"""
+        with self._cond:
+            if not self.running:
+                return
+            self.running = False
+            self._cond.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+        self.threads.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": len(self._heap),
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+            }
+
+class AsyncNoteScheduler(NoteScheduler):
+    '''异步发帖调度类，工作者为事件循环中的协程，Future为asyncio.Future；须在事件循环内调用'''
+    def __init__(self, workers: int = OUTBOX_WORKERS, retries: int = OUTBOX_RETRIES):
+        super().__init__(workers, retries)
+        self.tasks: List["asyncio.Task"] = []
+        self._acond: Optional["asyncio.Condition"] = None
+
+    def submit(self, poster, payload: dict, priority: int = NOTE) -> "asyncio.Future":
+        import asyncio # 只有asyncio模式才导入（线程模式启动时不加载asyncio）
+        loop = asyncio.get_running_loop()
+        job = _Job(poster, payload, loop.create_future(), priority, next(self._seq))
+        if not self.running:
+            self.running = True
+            self._acond = asyncio.Condition()
+            self.tasks = [loop.create_task(self._aworker()) for _ in range(self.workers)]
+        heapq.heappush(self._heap, job)
+        loop.create_task(self._notify())
+        return job.future
+
+    async def _notify(self):
+        async with self._acond:
+            self._acond.notify()
+
+    async def _anext(self) -> Optional[_Job]:
+        import asyncio
+        async with self._acond:
+            while True:
+                if self._heap:
+                    delay = rate_gate(self._heap[0].poster.api_endpoint).delay()
+                    if delay <= 0:
+                        return heapq.heappop(self._heap)
+                    try:
+                        await asyncio.wait_for(self._acond.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                elif not self.running:
+                    return None
+                else:
+                    await self._acond.wait()
+
+    async def _aworker(self):
+        while True:
+            job = await self._anext()
+            if job is None:
+                break
+            try:
+                result = await self._adeliver(job)
+            except Exception as e:
+                logger.exception(f"发帖失败: {e}")
+                result = None
+            if result is _REQUEUE:
+                heapq.heappush(self._heap, job)
+                await self._notify()
+            elif not job.future.done():
+                job.future.set_result(result)
+
+    async def _adeliver(self, job: _Job) -> Optional[dict]:
+        import asyncio
+        gate = rate_gate(job.poster.api_endpoint)
+        while job.attempts <= self.retries:
+            job.attempts += 1
+            await asyncio.sleep(gate.delay())
+            started = time.perf_counter()
+            try:
+                response = await job.poster._request_note(job.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                response = e
+            done, value = self._outcome(job, gate, response, started)
+            if done:
+                return value
+            delay = self._retry_delay(job, value)
+            if delay is not None:
+                await asyncio.sleep(delay)
+        return self._failed()
+
+    async def stop(self, timeout: Optional[float] = 30):
+        import asyncio
+        if not self.running:
+            return
+        self.running = False
+        async with self._acond:
+            self._acond.notify_all()
+        if self.tasks:
+            await asyncio.wait(self.tasks, timeout=timeout)
+        self.tasks.clear()
+
+# 进程级共享的发帖调度器（同步模式），首次提交时启动工作线程
+outbox = NoteScheduler()
@@ -0,0 +1,73 @@
+import logging
+import threading
+from functools import lru_cache
+from typing import List
+from .config import TOKENIZER
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+def _load_encoding():
+    """tokenizer为tiktoken时在首次计数时加载分词器（可选依赖，首次使用可能需要下载词表），失败时退回按字符估算"""
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if _encoding_loaded:
+            return _encoding
+        if TOKENIZER == "tiktoken":
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except ImportError:
+                logger.warning("未安装tiktoken，token数按字符估算，请执行 pip install misskey-plugin-huaer-bot[tokens]")
+            except Exception as e:
+                logger.warning(f"加载tiktoken分词器失败，token数按字符估算: {e}")
+        _encoding_loaded = True
+        return _encoding
+
+MESSAGE_OVERHEAD = 4 # 每条消息的角色与分隔符开销
+
+def _is_cjk(ch: str) -> bool:
+    return "\u3000" <= ch <= "\u9fff" or "\uac00" <= ch <= "\ud7af" or "\uff00" <= ch <= "\uffef"
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数（带缓存，同一条帖子在回复链中反复出现时只计算一次）"""
+    if not text:
+        return 0
+    encoding = _encoding if _encoding_loaded else _load_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return cjk + (len(text) - cjk + 3) // 4 # 中日韩字符约1token/字，其余约4字符/token
+
+def message_tokens(message: dict) -> int:
+    return estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD
+
+class ContextPacker:
+    '''上下文打包类：按token预算装填记忆，固定保留系统提示与记忆模板，从最新的对话向前填充'''
+    def __init__(self, budget: int, max_turns: int = 0):
+        self.budget = budget # 整个请求上下文的token预算
+        self.max_turns = max_turns # 对话条数上限（0为不限）
+
+    def pack(self, system: str, pinned: List[dict], turns: List[dict]) -> List[dict]:
+        """返回 pinned + 能装下的最新若干条turns；最新一条（当前提问）总会保留"""
+        if not turns:
+            return list(pinned)
+
+        remaining = self.budget - estimate_tokens(system) - MESSAGE_OVERHEAD - sum(message_tokens(m) for m in pinned)
+        limit = len(turns) if self.max_turns <= 0 else min(self.max_turns, len(turns))
+
+        count = 0
+        for message in reversed(turns): # 从最新向前，一次线性扫描
+            cost = message_tokens(message)
+            if count >= limit or (count > 0 and cost > remaining):
+                break
+            remaining -= cost
+            count += 1
+
+        if remaining < 0:
+            logger.warning(f"当前提问超出上下文预算 {self.budget} tokens")
+        return list(pinned) + turns[len(turns) - count:]
@@ -1,34 +1,32 @@
 import time
 import json
 import logging
-import requests
-from .config import INSTANCE_URL, API_TOKEN, CHANNEL_ID
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+from . import config
+from .config import setup_logging, INSTANCE_URL, CHANNEL_ID, CONNECT_TIMEOUT, MISSKEY_TIMEOUT, UPLOAD_PARALLELISM, UPLOAD_RETRIES
+from .session import lease_session
+from .note_store import remember
+from .metrics import metrics, timed
+from .breaker import backoff_delay
+from .drive import MultipartFile, account_key, drive_cache
+from .outbox import NoteScheduler, REPLY, NOTE, BROADCAST, outbox, rate_gate
+
 logger = logging.getLogger('MisskeyChannelIDFinder')
 
 class MisskeyPoster:
     '''信息发送类'''
-    def __init__(self):
-        self.api_token = API_TOKEN
+    def __init__(self, api_token: str = None, scheduler: NoteScheduler = None):
+        self.api_token = api_token or config.API_TOKEN # 热重载后新建的发送器使用新值
+        self.outbox = scheduler or outbox # 所有发送器默认共用进程级发帖调度器
         self.instance_url = INSTANCE_URL.rstrip('/')
         self.api_endpoint = f"{self.instance_url}/api/notes/create"
         self.upload_url = f"{self.instance_url}/api/drive/files/create"
+        self.find_url = f"{self.instance_url}/api/drive/files/find-by-hash"
+        self.account = account_key(self.api_token)
 
-    def send_note(self, text, visibility="public", cw=None, **kwargs):
-        """
-        发送帖子到 Misskey，带断线重连机制
-        :param text: 帖子内容 (支持 Markdown)
-        :param visibility: 可见性 (public/home/followers/specified)
-        :param cw: 内容警告 (可选)
-        :param kwargs: 其他可选参数 (file_ids, poll, etc.)
-        :return: API 响应或 None（失败时）
-        """
-        headers = {'Content-Type': 'application/json'}
+    def _build_payload(self, text, visibility="public", cw=None, **kwargs) -> dict:
+        """构造发帖请求体"""
         payload = {
             "i": self.api_token,
             "text": text,
@@ -36,74 +34,231 @@ class MisskeyPoster:
             **kwargs
         }
 
-        attempt = 0
-        retry_delay = 1
-        max_retries = 5
-        
         # 添加可选的内容警告
         if cw:
             payload["cw"] = cw
-        
-        # 连接和重试机制
-        while attempt < max_retries:
-            try:
-                response = requests.post(
-                    self.api_endpoint,
-                    data=json.dumps(payload),
-                    headers=headers,
-                    timeout=30
-                )
-                response.raise_for_status()
-                return response.json()
-                
-            except requests.exceptions.ConnectionError as e:
-                # 连接错误（10054等）
-                logger.error(f"连接错误 : {e} 将在{retry_delay}秒后尝试重连... (尝试 {attempt+1})")
-                time.sleep(retry_delay)
-                attempt += 1
-                retry_delay += 2
-                
-            except requests.exceptions.Timeout:
-                logger.error(f"请求超时 : {e} 将在{retry_delay}秒后尝试重连... (尝试 {attempt+1})")
-                time.sleep(retry_delay)
-                attempt += 1
-                retry_delay += 2
-                
-            except requests.exceptions.RequestException as e:
-                # 其他请求错误
-                logger.error(f"API请求失败: {e}")
-                if hasattr(e, 'response') and e.response is not None:
-                    logger.error(f"API错误详情: {e.response.text}")
-                return None
-        
-        logger.error(f"发送失败: 重试{max_retries}次后仍失败")
-        return None
-        
-    def upload_file(self, file_path):
+        return payload
+
+    def _request_note(self, payload: dict):
+        """发送一次发帖请求，返回(状态码, 响应头, 响应体)；由发帖调度器调用"""
+        with lease_session(self.api_endpoint) as session:
+            response = session.post(
+                self.api_endpoint,
+                data=json.dumps(payload),
+                headers={'Content-Type': 'application/json'},
+                timeout=(CONNECT_TIMEOUT, MISSKEY_TIMEOUT)
+            )
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        self._note_sent(response.status_code, body, payload)
+        return response.status_code, response.headers, body
+
+    # 响应的处理（同步与异步发送器共用，只有请求不同）
+    @staticmethod
+    def _note_sent(status: int, body, payload: dict):
+        """
+        发帖成功时把自己的回复也放入回复链缓存（响应体不是JSON对象时跳过）
+        实例因附件不存在而拒绝时，把这些文件ID从网盘缓存中移除（网盘中的文件可能已被删除）
+        """
+        if status < 400:
+            if isinstance(body, dict) and isinstance(body.get('createdNote'), dict):
+                remember(body['createdNote'])
+        elif payload.get('fileIds') and MisskeyPoster._file_rejected(body):
+            logger.warning(f"附件已失效，从网盘缓存中移除: {payload['fileIds']}")
+            for file_id in payload['fileIds']:
+                drive_cache.forget(file_id)
+
+    @staticmethod
+    def _file_rejected(body) -> bool:
+        """错误响应是否由附件的文件ID不存在或无效引起"""
+        error = body.get('error') if isinstance(body, dict) else None
+        if not isinstance(error, dict):
+            return False
+        code = error.get('code')
+        return code == 'NO_SUCH_FILE' or (code == 'INVALID_PARAM' and 'fileIds' in json.dumps(error.get('info') or {}))
+
+    def _should_reupload(self, file_ids: List[Optional[str]], retry_ids: List[Optional[str]]) -> bool:
+        """发帖失败后再次取得的文件ID与发送的不同（失效的文件已重新上传）时重发一次"""
+        if None in retry_ids or retry_ids == file_ids:
+            return False
+        logger.info("附件已重新上传，再次发帖")
+        metrics.inc("drive_reupload_total")
+        return True
+
+    @staticmethod
+    def _created_id(result: Optional[dict]) -> Optional[str]:
+        """从发帖API的响应中取出新帖子ID"""
+        if not isinstance(result, dict):
+            return None
+        created = result.get('createdNote')
+        return created.get('id') if isinstance(created, dict) else None
+
+    def _drive_found(self, md5: str, file_id: Optional[str], source: str) -> Optional[str]:
+        """记录查找或上传得到的网盘文件"""
+        if file_id is None:
+            return None
+        drive_cache.put(self.account, md5, file_id)
+        metrics.inc("drive_files_total", source=source)
+        return file_id
+
+    @staticmethod
+    def _upload_retry(attempt: int, error: str) -> Optional[float]:
+        """上传第attempt次失败后的退避秒数，重试次数用尽时记录日志并返回None"""
+        if attempt >= UPLOAD_RETRIES:
+            logger.error(f"文件上传失败: 重试{UPLOAD_RETRIES}次后仍失败")
+            return None
+        delay = backoff_delay(attempt)
+        logger.error(f"文件上传失败: {error} 将在{delay:.1f}秒后重试... (尝试 {attempt+1})")
+        return delay
+
+    @staticmethod
+    def _retryable(e: Exception) -> bool:
+        """连接错误（10054等）与超时可重试"""
+        import requests # 延迟导入，asyncio模式不加载requests
+        return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def submit_note(self, text, visibility="public", cw=None, priority: Optional[int] = None, **kwargs) -> Future:
+        """
+        把帖子交给发帖调度器，不等待发送
+        :param priority: REPLY / NOTE / BROADCAST，默认带replyId的为REPLY，其余为NOTE
+        :return: 以新帖子ID（失败时为None）完成的Future
+        """
+        if priority is None:
+            priority = REPLY if kwargs.get('replyId') else NOTE
+        future = Future()
+
+        def done(sent: Future):
+            future.set_result(self._created_id(sent.result()))
+
+        self.outbox.submit(self, self._build_payload(text, visibility, cw, **kwargs), priority).add_done_callback(done)
+        return future
+
+    def send_note(self, text, visibility="public", cw=None, **kwargs):
+        """
+        发送帖子到 Misskey 并等待结果（经发帖调度器排队，遇限流暂停、失败时抖动退避重试）
+        :param text: 帖子内容 (支持 Markdown)
+        :param visibility: 可见性 (public/home/followers/specified)
+        :param cw: 内容警告 (可选)
+        :param kwargs: 其他可选参数 (file_ids, poll, etc.)
+        :return: API 响应或 None（失败时）
+        """
+        priority = REPLY if kwargs.get('replyId') else NOTE
+        return self.outbox.submit(self, self._build_payload(text, visibility, cw, **kwargs), priority).result()
+
+    def send_note_with_files(self, text, file_paths: List[str], visibility="public", cw=None, **kwargs):
+        """
+        上传附件（内容相同的文件只上传一次）后发帖并等待结果
+        实例因附件不存在（网盘中的文件已被删除）而拒绝时，失效的文件ID已从缓存移除，重新上传一次后再发
+        :return: API 响应或 None（失败时）
+        """
+        file_ids = self.upload_files(file_paths)
+        if None in file_ids:
+            logger.error("附件上传失败，未发帖")
+            return None
+        result = self.send_note(text, visibility, cw, fileIds=file_ids, **kwargs)
+        if result is None:
+            retry_ids = self.upload_files(file_paths)
+            if self._should_reupload(file_ids, retry_ids):
+                result = self.send_note(text, visibility, cw, fileIds=retry_ids, **kwargs)
+        return result
+
+    def broadcast(self, text, channel_ids: Optional[List[str]] = None, visibility="public", cw=None, **kwargs) -> Dict[str, Future]:
+        """
+        向多个频道（默认为当前配置channel_id中的全部频道，热重载后立即生效）同时发送同一帖子，优先级低于回复
+        :return: 频道ID -> 新帖子ID的Future
         """
-        上传文件到 Misskey Drive
+        return {
+            cid: self.submit_note(text, visibility, cw, priority=BROADCAST, channelId=cid, **kwargs)
+            for cid in dict.fromkeys(config.CHANNEL_ID if channel_ids is None else channel_ids)
+        }
+
+    @timed("upload_file_seconds")
+    def upload_file(self, file_path) -> Optional[str]:
+        """
+        上传文件到 Misskey Drive，内容相同的文件只上传一次
+        依次查找本地缓存、实例的find-by-hash，都没有时才流式上传
         :param file_path: 本地文件路径
         :return: 文件ID (成功) 或 None (失败)
         """
-        
         try:
-            with open(file_path, 'rb') as f:
-                files = {'file': f}
-                data = {'i': self.api_token}
-                response = requests.post(
-                    self.upload_url,
-                    data=data,
-                    files=files,
-                    timeout=30
+            md5 = drive_cache.md5(file_path)
+        except OSError as e:
+            logger.error(f"文件读取失败: {e}")
+            return None
+
+        file_id = drive_cache.get(self.account, md5)
+        source = "cache"
+        if file_id is None:
+            file_id, source = self._find_by_hash(md5), "hash"
+        if file_id is None:
+            file_id, source = self._upload(file_path), "upload"
+        return self._drive_found(md5, file_id, source)
+
+    def upload_files(self, file_paths: List[str]) -> List[Optional[str]]:
+        """同时上传一条帖子的多个附件（最多UPLOAD_PARALLELISM个并行），按顺序返回文件ID"""
+        unique = list(dict.fromkeys(file_paths))
+        if not unique:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(UPLOAD_PARALLELISM, len(unique)))) as pool:
+            ids = dict(zip(unique, pool.map(self.upload_file, unique)))
+        return [ids[path] for path in file_paths]
+
+    def _find_by_hash(self, md5: str) -> Optional[str]:
+        """在网盘中按MD5查找已有文件"""
+        import requests
+        gate = rate_gate(self.find_url)
+        try:
+            gate.wait()
+            with lease_session(self.find_url) as session:
+                response = session.post(
+                    self.find_url,
+                    json={"i": self.api_token, "md5": md5},
+                    timeout=(CONNECT_TIMEOUT, MISSKEY_TIMEOUT)
                 )
+            gate.update(response.status_code, response.headers)
             response.raise_for_status()
-            file_data = response.json()
-            return file_data.get('id')
-        except Exception as e:
-            logger.error(f"文件上传失败: {e}")
+            files = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"按哈希查找网盘文件失败: {e}")
             return None
+        return files[0].get('id') if files else None
+
+    def _upload(self, file_path) -> Optional[str]:
+        """流式上传文件，连接错误、超时或5xx/429时退避重试；与发帖共用实例限流闸门"""
+        import requests
+        gate = rate_gate(self.upload_url)
+        for attempt in range(UPLOAD_RETRIES + 1):
+            try:
+                gate.wait()
+                body = MultipartFile({'i': self.api_token}, file_path)
+                with lease_session(self.upload_url) as session:
+                    response = session.post(
+                        self.upload_url,
+                        data=body,
+                        headers={'Content-Type': body.content_type},
+                        timeout=(CONNECT_TIMEOUT, MISSKEY_TIMEOUT)
+                    )
+                gate.update(response.status_code, response.headers)
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return response.json().get('id')
+                error = f"HTTP {response.status_code}"
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = str(e)
+            except (requests.exceptions.RequestException, OSError, ValueError) as e:
+                logger.error(f"文件上传失败: {e}")
+                return None
+
+            delay = self._upload_retry(attempt, error)
+            if delay is None:
+                return None
+            time.sleep(delay)
 
 if __name__ == "__main__":
+    setup_logging()
+
     # 初始化客户端
     channel_poster = MisskeyPoster()
 
@@ -125,11 +280,10 @@ if __name__ == "__main__":
     # 示例二，发送带有文件的帖子(需先上传文件，仅支持部分格式文件)
     png_path = os.path.join(script_dir, "misc\mikumikubeam.jpg")
     print(png_path)
-    # 上传文件
-    file_id = channel_poster.upload_file(png_path)
-    result = channel_poster.send_note(
+    # 上传文件并发帖（内容相同的文件只上传一次，多个附件并行上传；网盘中的文件被删除时自动重新上传）
+    result = channel_poster.send_note_with_files(
         text="and now, it's the time ... for the moment you've been wait for!",
-        fileIds=[file_id]
+        file_paths=[png_path]
     )'''
 
     '''from datetime import datetime, timedelta, timezone
@@ -0,0 +1,77 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+class TokenBucket:
+    '''令牌桶：以rate个/秒的速度补充，最多存capacity个；允许预支（令牌数为负）以实现排队'''
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """取得一个令牌需要等待的秒数"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def give(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+class RateLimiter:
+    '''多级限流类：一次请求需同时通过用户、频道、全局（每个API Key）的令牌桶，所有频道共享'''
+    def __init__(self, max_buckets: int = 10000):
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict() # 桶标识 -> 令牌桶（LRU，防止用户桶无限增长）
+        self._lock = threading.Lock()
+        self.limited = 0 # 被拒绝的请求数
+
+    def _bucket(self, key: str, rate: float, burst: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, burst)
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            bucket.rate, bucket.capacity = rate, max(1.0, burst) # 配置热更新后立即生效
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def acquire(self, limits: Iterable[Tuple[str, float, float]], max_wait: Optional[float]) -> Optional[float]:
+        """
+        按(桶标识, 速率, 突发量)列表申请一个令牌
+        :param max_wait: 可接受的最长等待秒数，None为无限
+        :return: 需要等待的秒数（已预留令牌），超出max_wait时返回None且不消耗令牌
+        """
+        now = time.monotonic()
+        with self._lock:
+            buckets = [self._bucket(key, rate, burst) for key, rate, burst in limits if rate > 0]
+            wait = max((bucket.delay(now) for bucket in buckets), default=0.0)
+            if max_wait is not None and wait > max_wait:
+                self.limited += 1
+                return None
+            for bucket in buckets:
+                bucket.take()
+            return wait
+
+    def refund(self, limits: Iterable[Tuple[str, float, float]]):
+        """归还acquire已取得的令牌（请求最终未被服务，如之后被全局限流拒绝）"""
+        with self._lock:
+            for key, rate, _ in limits:
+                bucket = self._buckets.get(key)
+                if rate > 0 and bucket is not None:
+                    bucket.give()
+
+rate_limiter = RateLimiter() # 进程级共享限流器
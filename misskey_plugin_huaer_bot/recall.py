@@ -0,0 +1,431 @@
+import os
+import re
+import json
+import time
+import zlib
+import logging
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from .config import (
+    MEMORY_ENABLED, MEMORY_PATH, MEMORY_SCOPE, MEMORY_DIM, MEMORY_MAX_ENTRIES,
+    MEMORY_MIN_SCORE, MEMORY_COMPACT_INTERVAL, CONFIG_PATH,
+)
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+SNIPPET_CHARS = 300 # 注入上下文的每条早先对话的字符上限
+RECALL_HEADER = "以下是与当前话题相关的早先对话，仅供参考：" # 注入的长期记忆前的说明
+
+_CJK_RUN = re.compile("[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]+")
+_WORD = re.compile(r"[a-z0-9]+")
+_SPEAKER = re.compile(r"^用户\[[^\]]*\]: ", re.MULTILINE)
+
+def _load_numpy():
+    """只在启用长期记忆时导入numpy（可选依赖），未安装时退回纯Python检索"""
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        logger.warning("未安装numpy，长期记忆使用纯Python检索（条目多时较慢），建议 pip install misskey-plugin-huaer-bot[memory]")
+        return None
+
+def _features(text: str) -> Iterable[str]:
+    """文本的特征：中日韩字符的单字与相邻二字，其余按单词及其首尾补位的三字符片段"""
+    text = text.lower()
+    for run in _CJK_RUN.findall(text):
+        yield from run
+        for i in range(len(run) - 1):
+            yield run[i:i + 2]
+    for word in _WORD.findall(text):
+        yield word
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            yield padded[i:i + 3]
+
+def _document(question: str, answer: str) -> str:
+    """一轮问答中参与嵌入的文本（去掉用户前缀，否则同一用户的所有问答都会彼此相似）"""
+    return f"{_SPEAKER.sub('', question)}\n{answer}"
+
+def _question_hash(question: str) -> int:
+    return zlib.crc32(question.encode("utf-8"))
+
+def _hashed(text: str, dim: int) -> Tuple[List[int], List[float]]:
+    """特征哈希：crc32（跨进程稳定）的低位定维度、最高位定正负号"""
+    index, sign = [], []
+    for feature in _features(text):
+        h = zlib.crc32(feature.encode("utf-8"))
+        index.append(h % dim)
+        sign.append(-1.0 if h & 0x80000000 else 1.0)
+    return index, sign
+
+class LongTermMemory:
+    '''
+    长期记忆类：按频道（或用户）把过去的问答嵌入为向量，每次提及只取最相关的k条注入上下文，不必加大rd
+    1. 嵌入：本地的字符n-gram特征哈希（无需网络与模型），L2归一化后以余弦相似度检索
+    2. 存储：每个索引一对只追加的文件，<键>.f32为float32向量（numpy时内存映射读取），<键>.jsonl为问答文本（只在内存中保留偏移）
+    3. 压缩：后台线程定期重写超出max_entries或含被覆盖条目（同一问题的旧回答）的索引，重写期间检索与追加照常进行
+    path为None时不启用，检索返回空、记录直接返回
+    '''
+    def __init__(self, path: Optional[Path] = None, scope: str = MEMORY_SCOPE, dim: int = MEMORY_DIM,
+                 max_entries: int = MEMORY_MAX_ENTRIES, min_score: float = MEMORY_MIN_SCORE,
+                 compact_interval: float = MEMORY_COMPACT_INTERVAL, use_numpy: bool = True):
+        self.path = path
+        self.scope = scope
+        self.dim = max(16, dim)
+        self.max_entries = max(1, max_entries)
+        self.min_score = min_score
+        self.compact_interval = compact_interval
+        self.np = _load_numpy() if path is not None and use_numpy else None
+        self._indexes: Dict[str, "_Index"] = {}
+        self._lock = threading.Lock() # 保护索引字典
+        self._stopped = threading.Event()
+        self._compactor: Optional[threading.Thread] = None
+        self.searches = 0
+        self.search_seconds = 0.0
+        self.compactions = 0
+
+        if path is not None:
+            path.mkdir(parents=True, exist_ok=True)
+            if compact_interval > 0:
+                self._compactor = threading.Thread(target=self._run, name="memory-compactor", daemon=True)
+                self._compactor.start()
+            logger.info(f"长期记忆: {path} (按{'用户' if scope == 'user' else '频道'}索引, {'numpy' if self.np is not None else '纯Python'})")
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def embed(self, texts: Sequence[str]):
+        """批量嵌入，numpy时返回(len(texts), dim)的float32矩阵，否则为array('f')列表"""
+        if self.np is not None:
+            np = self.np
+            matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+            for row, text in enumerate(texts):
+                index, sign = _hashed(text, self.dim)
+                if index:
+                    matrix[row] = np.bincount(index, weights=sign, minlength=self.dim)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            return matrix / np.maximum(norms, 1e-12)
+
+        vectors = []
+        for text in texts:
+            vector = [0.0] * self.dim
+            for i, s in zip(*_hashed(text, self.dim)):
+                vector[i] += s
+            norm = sum(v * v for v in vector) ** 0.5 or 1.0
+            vectors.append(array("f", (v / norm for v in vector)))
+        return vectors
+
+    def _key(self, channel_id: str, user: str) -> str:
+        key = f"user-{user}" if self.scope == "user" else f"channel-{channel_id}"
+        return re.sub(r"[^\w.-]", "_", key)
+
+    def _index(self, key: str) -> "_Index":
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = self._indexes[key] = _Index(self, self.path / key)
+            return index
+
+    # 检索与记录
+    def search(self, channel_id: str, items: List[Tuple[str, str]], k: int, exclude: Iterable[str] = ()) -> List[str]:
+        """
+        检索与本次提及最相关的至多k条早先对话（从相关到不相关）
+        :param items: (用户, 内容)列表，合并的多条提及一次批量检索，每条早先对话取与各条提及相似度的最大值
+        :param exclude: 已在回复链中的用户发言，对应的早先对话不再重复注入
+        """
+        if self.path is None or k <= 0 or not items:
+            return []
+        started = time.perf_counter()
+        groups: Dict[str, List[str]] = {}
+        for user, text in items:
+            groups.setdefault(self._key(channel_id, user), []).append(text)
+
+        exclude = set(exclude)
+        found: List[Tuple[float, str]] = []
+        for key, texts in groups.items():
+            if key in self._indexes or (self.path / f"{key}.jsonl").exists():
+                found.extend(self._index(key).search(self.embed(texts), k, self.min_score, exclude))
+        found.sort(key=lambda hit: hit[0], reverse=True)
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.searches += 1
+            self.search_seconds += elapsed
+        from .metrics import metrics
+        metrics.observe("recall_seconds", elapsed)
+        return [snippet for _, snippet in found[:k]]
+
+    def remember(self, channel_id: str, items: List[Tuple[str, str]], reply: str):
+        """记录一轮问答（合并的多条提及按用户分别记录）"""
+        if self.path is None or not reply:
+            return
+        groups: Dict[str, List[str]] = {}
+        for user, text in items:
+            groups.setdefault(self._key(channel_id, user), []).append(f"用户[{user}]: {text}")
+        for key, lines in groups.items():
+            question = "\n".join(lines)
+            self._index(key).append(question, reply, self.embed([_document(question, reply)]))
+
+    # 后台压缩
+    def _run(self):
+        while not self._stopped.wait(self.compact_interval):
+            self.compact()
+
+    def compact(self):
+        """重写需要压缩的索引"""
+        with self._lock:
+            indexes = list(self._indexes.values())
+        for index in indexes:
+            if index.needs_compaction():
+                try:
+                    index.compact()
+                    with self._lock:
+                        self.compactions += 1
+                except OSError as e:
+                    logger.error(f"长期记忆压缩失败 {index.base.name}: {e}")
+
+    def close(self):
+        self._stopped.set()
+        if self._compactor is not None:
+            self._compactor.join(timeout=5)
+            self._compactor = None
+        with self._lock:
+            indexes = list(self._indexes.values())
+            self._indexes.clear()
+        for index in indexes:
+            index.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            indexes = list(self._indexes.values())
+            return {
+                "indexes": len(indexes),
+                "entries": sum(index.live() for index in indexes),
+                "searches": self.searches,
+                "search_ms": self.search_seconds / self.searches * 1000 if self.searches else 0.0,
+                "compactions": self.compactions,
+            }
+
+class _Index:
+    '''一个频道（或用户）的向量索引；向量文件与文本文件逐行对应，文本文件为准'''
+    def __init__(self, memory: LongTermMemory, base: Path):
+        self.memory = memory
+        self.base = base
+        self.dim = memory.dim
+        self._lock = threading.Lock()
+        self._compacting = threading.Lock()
+        self._offsets: List[int] = [] # 每条记录在文本文件中的偏移
+        self._hashes: List[int] = [] # 每条记录问题文本的crc32
+        self._latest: Dict[int, int] = {} # 问题文本的crc32 -> 最新一条记录的行号，同一问题的旧回答视为被覆盖
+        self._dead: Set[int] = set() # 被覆盖的行号
+        self._matrix = None # numpy时为前rows行向量的内存映射，否则为array('f')列表
+        self._rows = 0 # _matrix中的行数
+        self._open()
+
+    @property
+    def vectors_path(self) -> Path:
+        return self.base.with_suffix(".f32")
+
+    @property
+    def texts_path(self) -> Path:
+        return self.base.with_suffix(".jsonl")
+
+    def _open(self):
+        """读取文本文件的偏移；向量文件行数不符（写入中途崩溃或dim已修改）时由文本重新嵌入"""
+        offsets, hashes, questions = [], [], []
+        if self.texts_path.exists():
+            with open(self.texts_path, "rb") as f:
+                offset = 0
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError: # 末尾不完整的一行
+                        break
+                    offsets.append(offset)
+                    hashes.append(_question_hash(entry["q"]))
+                    questions.append((entry["q"], entry["a"]))
+                    offset += len(line)
+            if offset != self.texts_path.stat().st_size:
+                os.truncate(self.texts_path, offset)
+        self._reset(offsets, hashes)
+
+        rows = self.vectors_path.stat().st_size // (self.dim * 4) if self.vectors_path.exists() else 0
+        if rows != len(self._offsets) or (self.vectors_path.exists() and self.vectors_path.stat().st_size % (self.dim * 4)):
+            logger.warning(f"长期记忆 {self.base.name} 的向量文件与文本不一致，重新嵌入{len(questions)}条")
+            self._write_vectors(self.vectors_path, self.memory.embed([_document(q, a) for q, a in questions]))
+        self._reopen()
+
+    def _reopen(self):
+        self._texts = open(self.texts_path, "a+b")
+        self._vectors = open(self.vectors_path, "ab")
+        self._matrix, self._rows = None, 0
+
+    def _reset(self, offsets: List[int], hashes: List[int]):
+        self._offsets, self._hashes, self._latest, self._dead = [], [], {}, set()
+        for offset, h in zip(offsets, hashes):
+            self._add(offset, h)
+
+    def _add(self, offset: int, h: int):
+        previous = self._latest.get(h)
+        if previous is not None:
+            self._dead.add(previous)
+        self._latest[h] = len(self._offsets)
+        self._offsets.append(offset)
+        self._hashes.append(h)
+
+    def _write_vectors(self, path: Path, vectors):
+        with open(path, "wb") as f:
+            if self.memory.np is not None:
+                f.write(self.memory.np.ascontiguousarray(vectors, dtype=self.memory.np.float32).tobytes())
+            else:
+                for vector in vectors:
+                    vector.tofile(f)
+
+    def live(self) -> int:
+        with self._lock:
+            return len(self._offsets) - len(self._dead)
+
+    def append(self, question: str, answer: str, vectors):
+        line = (json.dumps({"q": question, "a": answer, "t": time.time()}, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self._texts.seek(0, os.SEEK_END)
+            offset = self._texts.tell()
+            self._write_row(vectors)
+            self._texts.write(line)
+            self._texts.flush()
+            self._add(offset, _question_hash(question))
+
+    def _write_row(self, vectors):
+        if self.memory.np is not None:
+            self._vectors.write(vectors.astype(self.memory.np.float32).tobytes())
+        else:
+            for vector in vectors:
+                vector.tofile(self._vectors)
+        self._vectors.flush()
+
+    def _mapped(self):
+        """前len(_offsets)行向量；追加后按需重新映射（只追加，旧映射中的数据不会变化）"""
+        count = len(self._offsets)
+        if self._rows != count:
+            np = self.memory.np
+            if count == 0:
+                self._matrix = None
+            elif np is not None:
+                self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+            else: # 纯Python时只读入新追加的行
+                matrix = self._matrix or []
+                data = array("f")
+                with open(self.vectors_path, "rb") as f:
+                    f.seek(len(matrix) * self.dim * 4)
+                    data.fromfile(f, (count - len(matrix)) * self.dim)
+                self._matrix = matrix + [data[i * self.dim:(i + 1) * self.dim] for i in range(count - len(matrix))]
+            self._rows = count
+        return self._matrix
+
+    def search(self, queries, k: int, min_score: float, exclude: Set[str]) -> List[Tuple[float, str]]:
+        """返回(相似度, 早先对话)，至多k条"""
+        with self._lock:
+            matrix = self._mapped()
+            if matrix is None:
+                return []
+            np = self.memory.np
+            if np is not None:
+                scores = (matrix @ queries.T).max(axis=1) # 批量：每条记录取与各条提及的最大相似度
+                if self._dead:
+                    scores[list(self._dead)] = -1.0
+                want = min(len(scores), k + len(exclude))
+                top = np.argpartition(scores, -want)[-want:]
+                ranked = [(float(scores[row]), int(row)) for row in top[np.argsort(scores[top])[::-1]]]
+            else:
+                ranked = sorted(
+                    ((max(sum(a * b for a, b in zip(vector, query)) for query in queries), row)
+                     for row, vector in enumerate(matrix) if row not in self._dead),
+                    reverse=True,
+                )
+
+            hits = []
+            for score, row in ranked:
+                if score < min_score or len(hits) >= k:
+                    break
+                entry = self._read(row)
+                if entry["q"] in exclude:
+                    continue
+                hits.append((score, self._snippet(entry)))
+            return hits
+
+    def _read(self, row: int) -> dict:
+        self._texts.seek(self._offsets[row])
+        return json.loads(self._texts.readline())
+
+    @staticmethod
+    def _snippet(entry: dict) -> str:
+        question, answer = entry["q"], entry["a"]
+        if len(question) > SNIPPET_CHARS:
+            question = question[:SNIPPET_CHARS] + "…"
+        if len(answer) > SNIPPET_CHARS:
+            answer = answer[:SNIPPET_CHARS] + "…"
+        return f"{question}\n回复: {answer}"
+
+    # 压缩
+    def needs_compaction(self) -> bool:
+        with self._lock:
+            return len(self._offsets) > self.memory.max_entries or len(self._dead) > len(self._offsets) // 4
+
+    def compact(self):
+        """
+        去掉被覆盖的记录，只保留最新的max_entries条：先在锁外复制快照中的存活记录到临时文件，
+        再在锁内补上复制期间新追加的记录并替换文件（锁内只处理少量新记录）
+        """
+        with self._compacting:
+            with self._lock:
+                count = len(self._offsets)
+                dead = set(self._dead)
+                offsets, hashes = list(self._offsets), list(self._hashes)
+            keep = [row for row in range(count) if row not in dead][-self.memory.max_entries:]
+            vectors_tmp, texts_tmp = self.vectors_path.with_suffix(".f32.tmp"), self.texts_path.with_suffix(".jsonl.tmp")
+            new_offsets: List[int] = []
+            new_hashes: List[int] = []
+            with open(self.vectors_path, "rb") as vsrc, open(self.texts_path, "rb") as tsrc, \
+                    open(vectors_tmp, "wb") as vdst, open(texts_tmp, "wb") as tdst:
+                def copy(rows: List[int], offsets: List[int], hashes: List[int]):
+                    record = self.dim * 4
+                    np = self.memory.np
+                    if np is not None and rows: # 整批复制向量（释放GIL，不拖慢同时进行的检索）
+                        mapped = np.memmap(vsrc, dtype=np.float32, mode="r", shape=(rows[-1] + 1, self.dim))
+                        vdst.write(mapped[rows].tobytes())
+                        del mapped
+                    for row in rows:
+                        if np is None:
+                            vsrc.seek(row * record)
+                            vdst.write(vsrc.read(record))
+                        tsrc.seek(offsets[row])
+                        new_offsets.append(tdst.tell())
+                        new_hashes.append(hashes[row])
+                        tdst.write(tsrc.readline())
+
+                copy(keep, offsets, hashes)
+                with self._lock:
+                    added = list(range(count, len(self._offsets)))
+                    copy(added, self._offsets, self._hashes)
+                    vdst.flush()
+                    tdst.flush()
+                    self._texts.close()
+                    self._vectors.close()
+                    self._matrix = None # Windows下须先释放映射才能替换文件
+                    os.replace(vectors_tmp, self.vectors_path) # 先替换向量：两次替换之间崩溃时由文本重新嵌入
+                    os.replace(texts_tmp, self.texts_path)
+                    self._reset(new_offsets, new_hashes)
+                    self._reopen()
+            logger.info(f"长期记忆 {self.base.name} 已压缩: 存活 {count - len(dead)}/{count} 条，保留 {len(new_offsets)} 条")
+
+    def close(self):
+        with self._lock:
+            self._matrix = None
+            self._texts.close()
+            self._vectors.close()
+
+# 进程级共享长期记忆，未启用时检索返回空
+long_memory = LongTermMemory((CONFIG_PATH.parent / MEMORY_PATH) if MEMORY_ENABLED else None)
@@ -0,0 +1,106 @@
+import io
+import gzip
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Optional
+from . import config
+from .config import RECORD_ENABLED, RECORD_PATH, RECORD_FLUSH_INTERVAL, RECORD_MAX_MB, USER_ID, CONFIG_PATH
+
+logger = logging.getLogger('MisskeyChannelIDFinder')
+
+RECORD_VERSION = 1
+STREAM, CATCHUP = "stream", "catchup" # 帧的来源：streaming推送 / 断线补齐取回的提及
+
+class StreamRecorder:
+    '''
+    streaming录制类：把收到的原始消息帧连同接收时间追加写入gzip压缩的JSON Lines文件，供benchmarks/replay.py重放
+    1. 每次打开文件先写一行头部（版本、bot用户ID、频道），随后每帧一行 {"t": 接收时间, "m": 原始消息}，断线补齐的帧另带 "src": "catchup"
+    2. 文件在收到第一帧时才打开；追加模式下每次启动是一个新的gzip成员，整个文件仍可由gzip直接读取；每flush_interval秒同步刷新一次，崩溃时最多丢失这段时间内的帧
+    3. 文件超过max_mb或close()后停止录制（0为不限），open()重新开始
+    '''
+    def __init__(self, path: Optional[Path] = None, flush_interval: float = RECORD_FLUSH_INTERVAL, max_mb: float = RECORD_MAX_MB):
+        self.flush_interval = flush_interval
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.path: Optional[Path] = Path(path) if path is not None else None
+        self.frames = 0
+        self._file: Optional[io.TextIOWrapper] = None
+        self._raw = None # 底层文件，用于统计压缩后的大小
+        self._base = 0 # 打开时文件已有的字节数
+        self._flushed_at = 0.0
+        self._stopped = False # 已超过max_mb或已关闭
+        self.bytes = 0 # 本次打开后写入的压缩字节数（最近一次刷新时）
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None and not self._stopped
+
+    def open(self, path: Path):
+        """改为录制到path（如分片模式下每个工作进程各写一个文件），已打开的文件先关闭"""
+        with self._lock:
+            self._close()
+            self.path = Path(path)
+            self._stopped = False
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._raw = open(self.path, "ab")
+        self._base = self._raw.tell()
+        self._file = io.TextIOWrapper(gzip.GzipFile(fileobj=self._raw, mode="ab", compresslevel=6), encoding="utf-8")
+        self._file.write(json.dumps({"version": RECORD_VERSION, "started": time.time(), "user_id": USER_ID,
+                                     "channels": list(config.CHANNEL_ID)}, ensure_ascii=False) + "\n")
+        self._flushed_at = time.monotonic()
+        logger.info(f"开始录制streaming消息帧: {self.path}")
+
+    def write(self, message, source: str = STREAM):
+        """记录一帧；message为收到的原始字符串（或已解析的帧）"""
+        if not self.enabled:
+            return
+        if not isinstance(message, str):
+            message = json.dumps(message, ensure_ascii=False)
+        line = {"t": time.time(), "m": message}
+        if source != STREAM:
+            line["src"] = source
+        line = json.dumps(line, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                if not self.enabled:
+                    return
+                self._open()
+            self._file.write(line)
+            self.frames += 1
+            now = time.monotonic()
+            if now - self._flushed_at >= self.flush_interval:
+                self._file.flush()
+                self._flushed_at = now
+                self.bytes = self._raw.tell() - self._base
+                if self.max_bytes and self._raw.tell() >= self.max_bytes:
+                    logger.warning(f"录制文件已超过{self.max_bytes / 1024 / 1024:.0f}MB，停止录制")
+                    self._stopped = True
+                    self._close()
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self.bytes = self._raw.tell() - self._base
+            self._raw.close()
+            self._file = self._raw = None
+
+    def close(self):
+        with self._lock:
+            self._stopped = True
+            self._close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "path": str(self.path) if self.path else None,
+                "frames": self.frames,
+                "bytes": self.bytes,
+            }
+
+# 进程级共享录制，未启用时write直接返回
+stream_recorder = StreamRecorder((CONFIG_PATH.parent / RECORD_PATH) if RECORD_ENABLED else None)
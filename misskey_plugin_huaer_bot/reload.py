@@ -0,0 +1,145 @@
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+from .config import ChatConfig, ConfigManager, CONFIG_PATH, WATCH_INTERVAL
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+RESTART_SECTIONS = ( # 进程级配置，修改后需重启生效（RELOADABLE_KEYS中的项除外）
+    "api", "misskey", "http", "note_store", "cache", "outbox", "drive", "durable", "shard", "long_memory", "record", "metrics",
+)
+RELOADABLE_KEYS = { # 上述配置段中可热重载的项
+    "misskey": ("channel_id", "cooldown", "user_rate", "user_burst", "channel_burst", "api_token"),
+    "shard": ("workers",), # 由分片监督进程增减工作进程
+}
+RESTART_KEYS = {"channels": ("tokenizer",)} # 可热重载的配置段中只在启动时读取的项
+
+def validate_config(data: Dict[str, Any]) -> List[str]:
+    """校验配置，返回错误列表（为空表示通过）"""
+    errors = []
+    for section in ("api", "misskey", "channels"):
+        if not isinstance(data.get(section), dict):
+            errors.append(f"缺少[{section}]")
+    if errors:
+        return errors
+
+    channel_ids = data["misskey"].get("channel_id", [])
+    if not isinstance(channel_ids, list) or not all(isinstance(cid, str) for cid in channel_ids):
+        return ["[misskey] channel_id 应为字符串列表"]
+
+    for cid in channel_ids:
+        conf = ChatConfig(cid, data) # 没有单独配置段的频道使用[channels]中的默认值
+        if not isinstance(conf.rd, int) or conf.rd < 0:
+            errors.append(f"[{cid}] rd 应为非负整数")
+        if not isinstance(conf.max_token, int) or conf.max_token <= 0:
+            errors.append(f"[{cid}] max_token 应为正整数")
+        if not isinstance(conf.ctx_tokens, int) or conf.ctx_tokens <= 0:
+            errors.append(f"[{cid}] ctx_tokens 应为正整数")
+        if not isinstance(conf.cooldown, (int, float)) or conf.cooldown < 0:
+            errors.append(f"[{cid}] cooldown 应为非负数")
+        if not isinstance(conf.current_personality, str):
+            errors.append(f"[{cid}] default_personality 应为字符串")
+        if not isinstance(conf.mess, list):
+            errors.append(f"[{cid}] memory 应为列表")
+        if not isinstance(conf.recall, int) or conf.recall < 0:
+            errors.append(f"[{cid}] recall 应为非负整数")
+        if not isinstance(conf.backend, str):
+            errors.append(f"[{cid}] backend 应为字符串")
+    return errors
+
+class ReloadPlan(NamedTuple):
+    '''热重载需执行的变更'''
+    added: List[str] # 新增的频道（含更换了API Token的频道）
+    removed: List[str] # 移除的频道（含更换了API Token的频道）
+    updated: Dict[str, ChatConfig] # 配置有变化的频道 -> 新配置
+    restart: List[str] # 有变化但需重启才能生效的配置段
+
+def plan_reload(old: Dict[str, Any], new: Dict[str, Any], current: Dict[str, ChatConfig]) -> ReloadPlan:
+    """
+    比较新旧配置
+    :param current: 正在运行的频道 -> 当前配置
+    """
+    wanted = list(dict.fromkeys(new["misskey"].get("channel_id", [])))
+    added = [cid for cid in wanted if cid not in current]
+    removed = [cid for cid in current if cid not in wanted]
+    updated: Dict[str, ChatConfig] = {}
+
+    for cid in wanted:
+        if cid not in current:
+            continue
+        conf = ChatConfig(cid, new)
+        if conf.api_token != current[cid].api_token: # 换了连接，按移除后重新加入处理
+            removed.append(cid)
+            added.append(cid)
+        elif conf != current[cid]:
+            updated[cid] = conf
+
+    def strip(data: Dict[str, Any], section: str) -> Any:
+        value = data.get(section, {})
+        if not isinstance(value, dict):
+            return value
+        return {k: v for k, v in value.items() if k not in RELOADABLE_KEYS.get(section, ())}
+    restart = [section for section in RESTART_SECTIONS if strip(old, section) != strip(new, section)]
+    for section, keys in RESTART_KEYS.items():
+        restart += [f"{section}.{key}" for key in keys if old.get(section, {}).get(key) != new.get(section, {}).get(key)]
+    return ReloadPlan(added, removed, updated, restart)
+
+class ConfigWatcher:
+    '''配置文件监视类：定期检查文件变化，校验通过后交给apply应用，校验失败时保留旧配置'''
+    def __init__(self, apply: Callable[[Dict[str, Any]], None], path: Path = CONFIG_PATH, interval: float = WATCH_INTERVAL):
+        self.apply = apply
+        self.path = path
+        self.interval = interval
+        self.reloads = 0
+        self.failures = 0
+        self._signature = self._stat()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _stat(self):
+        try:
+            stat = self.path.stat()
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def check(self) -> bool:
+        """文件有变化时重新加载，返回是否应用了新配置"""
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+
+        data = ConfigManager.load_toml(self.path)
+        errors = validate_config(data) if data else ["无法解析配置文件"]
+        if errors:
+            self.failures += 1
+            logger.error(f"配置文件校验失败，继续使用旧配置: {'; '.join(errors)}")
+            return False
+
+        try:
+            self.apply(data)
+        except Exception as e:
+            self.failures += 1
+            logger.exception(f"应用新配置失败: {e}")
+            return False
+        self.reloads += 1
+        logger.info(f"配置已重新加载: {self.path}")
+        return True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
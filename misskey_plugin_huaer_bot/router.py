@@ -0,0 +1,157 @@
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+from .config import URL, MOD, HEADERS, BACKENDS
+from .breaker import CircuitBreaker
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+EWMA_ALPHA = 0.3 # 延迟与错误率的平滑系数
+INITIAL_LATENCY = 1.0 # 新后端的假定延迟，单位秒（偏乐观，使其能分到流量）
+THROTTLE_SECONDS = 5.0 # 收到429且无Retry-After时的避让时间
+
+class Backend:
+    '''LLM后端：地址、模型、密钥及实时的延迟与错误统计'''
+    def __init__(self, name: str, url: str, model: str, headers: Dict[str, str], weight: float = 1.0, concurrency: int = 0):
+        self.name = name
+        self.url = url
+        self.model = model
+        self.headers = headers
+        self.weight = max(weight, 1e-6)
+        self.concurrency = concurrency # 同时在途请求上限（0为不限）
+        self.breaker = CircuitBreaker(name)
+        self.credential = self._credential(url, headers) # 全局限流按API Key计，共用同一Key的后端共用一个令牌桶
+
+        self.outstanding = 0 # 在途请求数
+        self.latency = INITIAL_LATENCY # 成功请求耗时的EWMA
+        self.error_rate = 0.0 # 失败率的EWMA
+        self.throttled_until = 0.0 # 429后的避让截止时间
+        self.requests = 0
+        self.errors = 0
+
+    @classmethod
+    def from_config(cls, index: int, entry: dict) -> "Backend":
+        headers = dict(entry.get("headers", {}))
+        if entry.get("key"):
+            headers["Authorization"] = f"Bearer {entry['key']}"
+        headers.setdefault("Content-Type", "application/json")
+        return cls(
+            name=entry.get("name", f"backend{index}"),
+            url=entry.get("url", URL),
+            model=entry.get("mod", MOD),
+            headers=headers,
+            weight=entry.get("weight", 1.0),
+            concurrency=entry.get("concurrency", 0),
+        )
+
+    @staticmethod
+    def _credential(url: str, headers: Dict[str, str]) -> str:
+        """API Key的摘要（只保存摘要）；没有认证头时按地址区分"""
+        lowered = {key.lower(): value for key, value in headers.items()}
+        secret = lowered.get("authorization") or lowered.get("api-key") or lowered.get("x-api-key") or url
+        return hashlib.sha256(str(secret).encode("utf-8")).hexdigest()[:16]
+
+    def score(self) -> float:
+        """越小越优：EWMA延迟 ×（在途请求+1）÷ 权重，并按错误率加罚"""
+        return self.latency * (self.outstanding + 1) / self.weight * (1 + 4 * self.error_rate)
+
+    def usable(self, now: float) -> bool:
+        if now < self.throttled_until:
+            return False
+        if self.concurrency and self.outstanding >= self.concurrency:
+            return False
+        return not self.breaker.rejecting(now)
+
+class BackendRouter:
+    '''后端路由类：按实时延迟与负载挑选后端，避开返回429的后端（5xx只计入错误率，持续失败由熔断器处理），支持频道固定后端'''
+    def __init__(self, backends: List[Backend]):
+        self.backends = backends
+        self._lock = threading.Lock()
+        self._unknown: Set[str] = set() # 已警告过的未知后端名
+
+    def check_pinned(self, pinned: str) -> bool:
+        """加载或热重载频道配置时校验固定的后端名，未知的名称只警告一次"""
+        if not pinned or any(backend.name == pinned for backend in self.backends):
+            return True
+        with self._lock:
+            if pinned in self._unknown:
+                return False
+            self._unknown.add(pinned)
+        logger.warning(f"未找到固定的后端 {pinned}，改用全部后端")
+        return False
+
+    def candidates(self, pinned: str = "") -> List[Backend]:
+        """频道可用的后端（pinned为后端名，空或未知时为全部后端，未知名称由check_pinned警告）"""
+        if pinned:
+            matched = [backend for backend in self.backends if backend.name == pinned]
+            if matched:
+                return matched
+        return self.backends
+
+    def models(self, pinned: str = "") -> List[str]:
+        return sorted({backend.model for backend in self.candidates(pinned)})
+
+    def available(self, pinned: str = "") -> bool:
+        """是否还有可以接收请求的后端"""
+        now = time.monotonic()
+        return any(backend.usable(now) for backend in self.candidates(pinned))
+
+    def pick(self, pinned: str = "", exclude: Iterable[Backend] = ()) -> Optional[Backend]:
+        """挑选得分最优的可用后端并占用一个在途名额，无可用后端时返回None"""
+        now = time.monotonic()
+        excluded = set(id(backend) for backend in exclude)
+        with self._lock:
+            ranked = sorted(
+                (backend for backend in self.candidates(pinned) if backend.usable(now)),
+                key=lambda backend: (id(backend) in excluded, backend.score()) # 对冲请求优先选另一个后端
+            )
+            for backend in ranked:
+                if backend.breaker.allow():
+                    backend.outstanding += 1
+                    backend.requests += 1
+                    return backend
+        return None
+
+    def release(self, backend: Backend, ok: bool, latency: float, status: Optional[int] = None, retry_after: Optional[float] = None):
+        """归还在途名额并更新统计"""
+        with self._lock:
+            backend.outstanding -= 1
+            backend.error_rate = (1 - EWMA_ALPHA) * backend.error_rate + (0 if ok else EWMA_ALPHA)
+            if ok:
+                backend.latency = (1 - EWMA_ALPHA) * backend.latency + EWMA_ALPHA * latency
+            else:
+                backend.errors += 1
+                if status == 429:
+                    backend.throttled_until = time.monotonic() + (retry_after or THROTTLE_SECONDS)
+                    logger.warning(f"后端[{backend.name}]触发限流，避让{retry_after or THROTTLE_SECONDS:.0f}秒")
+
+        if ok:
+            backend.breaker.record_success(latency)
+        else:
+            backend.breaker.record_failure()
+
+    def abandon(self, backend: Backend):
+        """请求被取消时只归还在途名额，不计入统计"""
+        with self._lock:
+            backend.outstanding -= 1
+        backend.breaker.cancel()
+
+    def stats(self) -> List[dict]:
+        return [{
+            "name": backend.name,
+            "outstanding": backend.outstanding,
+            "latency": backend.latency,
+            "error_rate": backend.error_rate,
+            "requests": backend.requests,
+            "errors": backend.errors,
+            "breaker": backend.breaker.stats()["state"],
+        } for backend in self.backends]
+
+def _build_backends() -> List[Backend]:
+    if BACKENDS:
+        return [Backend.from_config(i, entry) for i, entry in enumerate(BACKENDS)]
+    return [Backend("default", URL, MOD, HEADERS)] # 未配置backends时沿用[api]中的单一后端
+
+backend_router = BackendRouter(_build_backends()) # 进程级共享的后端路由
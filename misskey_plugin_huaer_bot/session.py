@@ -0,0 +1,93 @@
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import ContextManager, Iterator
+from urllib.parse import urlsplit
+from .config import HTTP_MAX_HOSTS, HTTP_PER_HOST, HTTP_POOL_BLOCK
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+class _Entry:
+    __slots__ = ("session", "users", "retired")
+
+    def __init__(self, session: "requests.Session"):
+        self.session = session
+        self.users = 0 # 正在使用该会话的请求数
+        self.retired = False # 已被淘汰或关闭，最后一个使用者归还时关闭
+
+class SessionPool:
+    '''
+    HTTP会话池类：每个主机一个保持连接的Session，供所有频道共享
+    会话按引用计数借出，超出主机数上限时淘汰最久未用的会话；仍有请求在用的会话等最后一个使用者归还后再关闭
+    '''
+    def __init__(self, max_hosts: int = HTTP_MAX_HOSTS, per_host: int = HTTP_PER_HOST, pool_block: bool = HTTP_POOL_BLOCK):
+        self.max_hosts = max(1, max_hosts)
+        self.per_host = per_host
+        self.pool_block = pool_block
+        self._sessions: "OrderedDict[str, _Entry]" = OrderedDict() # 主机 -> 会话（LRU）
+        self._lock = threading.Lock()
+
+    def _new_session(self) -> "requests.Session":
+        import requests # 首次发起请求时才导入（asyncio模式不使用requests）
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.per_host, pool_block=self.pool_block)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _acquire(self, url: str) -> _Entry:
+        """借出url所在主机的会话，不存在时创建"""
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            entry = self._sessions.get(host)
+            if entry is not None:
+                self._sessions.move_to_end(host)
+            else:
+                entry = _Entry(self._new_session())
+                self._sessions[host] = entry
+                logger.info(f"已创建HTTP会话: {host}")
+                if len(self._sessions) > self.max_hosts: # 超出主机数上限时淘汰最久未用的会话
+                    _, evicted = self._sessions.popitem(last=False)
+                    self._retire(evicted)
+            entry.users += 1
+            return entry
+
+    def _release(self, entry: _Entry):
+        with self._lock:
+            entry.users -= 1
+            if entry.retired and entry.users == 0:
+                entry.session.close()
+
+    @staticmethod
+    def _retire(entry: _Entry):
+        entry.retired = True
+        if entry.users == 0:
+            entry.session.close()
+
+    @contextmanager
+    def lease(self, url: str) -> Iterator["requests.Session"]:
+        """在with块内使用url所在主机的Session，块内不会被淘汰关闭"""
+        entry = self._acquire(url)
+        try:
+            yield entry.session
+        finally:
+            self._release(entry)
+
+    def close(self):
+        """关闭所有会话（仍在使用的会话在归还时关闭）"""
+        with self._lock:
+            for entry in self._sessions.values():
+                self._retire(entry)
+            self._sessions.clear()
+
+_pool = SessionPool() # 进程级共享会话池
+
+def lease_session(url: str) -> ContextManager["requests.Session"]:
+    """借用共享会话池中url所在主机的Session：with lease_session(url) as session: ..."""
+    return _pool.lease(url)
+
+def close_sessions():
+    _pool.close()
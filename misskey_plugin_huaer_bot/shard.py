@@ -0,0 +1,385 @@
+'''
+分片模式：频道按一致性哈希分配给多个工作进程，突破单进程的GIL与单机连接数限制
+
+    python -m misskey_plugin_huaer_bot.shard            # 监督进程，启动并看护本机的[shard] workers个工作进程
+    python -m misskey_plugin_huaer_bot.shard worker 0   # 单个工作进程（通常由监督进程启动）
+
+协调目录（[shard] directory，跨主机时为共享目录）：
+    members/<工作进程ID>      心跳文件，修改时间在ttl内视为存活，所有存活成员构成哈希环
+    leases/<频道ID>.lease     频道租约，内容为持有者，修改时间为最近续约时间；持有租约的进程才会回复该频道
+
+频道移交时，原持有者先停止接收，等已接收的提及回复完成后才释放租约，新持有者再重放持久化队列中未完成的提及
+持久化队列（[durable]）的SQLite文件由本机所有工作进程共用，须位于本机磁盘，不能放在网络共享目录上；
+跨主机分片时各主机各用一份本地文件，频道移交到其它主机后不重放原主机上未完成的提及
+'''
+import os
+import sys
+import json
+import time
+import signal
+import bisect
+import socket
+import hashlib
+import logging
+import threading
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from .breaker import backoff_delay
+from .reload import ConfigWatcher
+from .config import setup_logging, CHANNEL_ID, CONFIG_PATH, METRICS_PORT, SHARD_WORKERS, SHARD_DIR, SHARD_TTL, SHARD_HOST
+
+logger = logging.getLogger('MisskeyChannelBot')
+
+REPLICAS = 160 # 每个成员在哈希环上的虚拟节点数
+RESTART_RESET = 60.0 # 工作进程连续运行超过此秒数后，重启退避从头计算
+HANDOFF_TIMEOUT = 120.0 # 移交频道时等待已接收的提及回复完成的最长秒数，超时后不再续约，租约过期后由新持有者接管
+
+def _hash(key: str) -> int:
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+class HashRing:
+    '''一致性哈希环：成员增减时只有约1/N的频道改变归属'''
+    def __init__(self, nodes: List[str], replicas: int = REPLICAS):
+        self.nodes = sorted(set(nodes))
+        ring = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._keys = [key for key, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    def owner(self, key: str) -> Optional[str]:
+        """key归属的成员，环为空时为None"""
+        if not self._keys:
+            return None
+        return self._nodes[bisect.bisect(self._keys, _hash(key)) % len(self._keys)]
+
+    def assign(self, keys: List[str]) -> Dict[str, List[str]]:
+        """成员 -> 归属的key列表"""
+        result: Dict[str, List[str]] = {node: [] for node in self.nodes}
+        for key in keys:
+            node = self.owner(key)
+            if node is not None:
+                result[node].append(key)
+        return result
+
+class Coordinator:
+    '''
+    协调目录上的成员心跳与频道租约，只依赖原子的文件创建（O_EXCL）与改名，本机与共享目录均适用
+    租约超过ttl未续约才可被接管；接管前先把旧租约改名移走，同一时刻只有一个进程能成功
+    '''
+    def __init__(self, directory: Path, worker_id: str, ttl: float = SHARD_TTL):
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.members = directory / "members"
+        self.leases = directory / "leases"
+        self.members.mkdir(parents=True, exist_ok=True)
+        self.leases.mkdir(parents=True, exist_ok=True)
+
+    # 成员
+    def heartbeat(self):
+        path = self.members / self.worker_id
+        if path.exists():
+            os.utime(path)
+        else:
+            path.write_text(json.dumps({"host": socket.gethostname(), "pid": os.getpid()}))
+
+    def live_members(self) -> List[str]:
+        """心跳未过期的成员（总是包括自己）"""
+        now = time.time()
+        members = {self.worker_id}
+        for path in self.members.iterdir():
+            try:
+                if now - path.stat().st_mtime <= self.ttl:
+                    members.add(path.name)
+            except FileNotFoundError: # 成员恰好退出
+                continue
+        return sorted(members)
+
+    def leave(self):
+        try:
+            (self.members / self.worker_id).unlink()
+        except FileNotFoundError:
+            pass
+
+    # 租约
+    def _lease(self, channel_id: str) -> Path:
+        return self.leases / f"{channel_id}.lease"
+
+    @staticmethod
+    def _read(path: Path) -> Tuple[Optional[str], float]:
+        """返回(持有者, 最近续约时间)，文件不存在时为(None, 0)"""
+        try:
+            mtime = path.stat().st_mtime
+            holder = json.loads(path.read_text() or "{}").get("owner")
+        except FileNotFoundError:
+            return None, 0.0
+        except (OSError, ValueError): # 正在写入的新租约
+            return None, time.time()
+        return holder, mtime
+
+    def holder(self, channel_id: str) -> Optional[str]:
+        holder, mtime = self._read(self._lease(channel_id))
+        return holder if time.time() - mtime <= self.ttl else None
+
+    def acquire(self, channel_id: str) -> bool:
+        """取得频道租约，已被其它进程持有且未过期时返回False"""
+        path = self._lease(channel_id)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            holder, mtime = self._read(path)
+            if holder == self.worker_id:
+                return self.renew(channel_id)
+            if time.time() - mtime <= self.ttl:
+                return False
+            if not self._take_over(path, holder, mtime):
+                return False
+            logger.warning(f"频道 {channel_id} 的租约已过期（持有者 {holder}），由 {self.worker_id} 接管")
+            return self.acquire(channel_id)
+
+        with os.fdopen(fd, "w") as f:
+            json.dump({"owner": self.worker_id, "host": socket.gethostname(), "pid": os.getpid()}, f)
+        return True
+
+    def _take_over(self, path: Path, holder: Optional[str], mtime: float) -> bool:
+        """移走过期租约；移走的若已不是读到的那份（其它进程抢先接管），原样放回"""
+        stale = path.with_name(f"{path.name}.{self.worker_id}.stale")
+        try:
+            os.rename(path, stale)
+        except OSError:
+            return False
+        if self._read(stale) != (holder, mtime):
+            try:
+                os.link(stale, path) # 目标已存在时失败，不覆盖更新的租约
+            except OSError:
+                pass
+            stale.unlink()
+            return False
+        stale.unlink()
+        return True
+
+    def renew(self, channel_id: str) -> bool:
+        """续约，租约已不属于自己时返回False"""
+        path = self._lease(channel_id)
+        holder, _ = self._read(path)
+        if holder != self.worker_id:
+            return False
+        os.utime(path)
+        return True
+
+    def release(self, channel_id: str):
+        path = self._lease(channel_id)
+        holder, _ = self._read(path)
+        if holder == self.worker_id:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+class ShardWorker:
+    '''分片工作进程：按哈希环取得归属于自己的频道，持有租约期间在自己的BotManager中运行'''
+    def __init__(self, index: int, directory: Path = None, ttl: float = SHARD_TTL, host: str = SHARD_HOST):
+        self.id = f"{host or socket.gethostname()}-{index}"
+        self.coordinator = Coordinator(directory or CONFIG_PATH.parent / SHARD_DIR, self.id, ttl)
+        self.interval = ttl / 3 # 租约过期前至少有两次续约机会
+        self.channels: List[str] = list(dict.fromkeys(CHANNEL_ID))
+        self.held: Dict[str, float] = {} # 持有租约的频道 -> 最近续约时间
+        self.handoffs: Dict[str, threading.Thread] = {} # 移交中的频道 -> 等待回复完成后释放租约的线程
+        from .bot import BotManager # 监督进程只导入本模块，不加载机器人本体
+        self.bot = BotManager()
+        self.bot.watcher = ConfigWatcher(self.reload) # 频道列表的变化由本进程按分片筛选后交给BotManager
+        self.bot.metrics_port = METRICS_PORT + 1 + index if METRICS_PORT else 0
+        from .recorder import stream_recorder
+        if stream_recorder.path is not None: # 各工作进程各写一个录制文件
+            stream_recorder.open(stream_recorder.path.with_name(f"{self.id}-{stream_recorder.path.name}"))
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def desired(self) -> List[str]:
+        """哈希环上归属于自己的频道"""
+        ring = HashRing(self.coordinator.live_members())
+        return [cid for cid in self.channels if ring.owner(cid) == self.id]
+
+    def _drop(self, cid: str, release: bool = True):
+        self.held.pop(cid, None)
+        group = self.bot.remove_channel(cid)
+        if not release:
+            return
+        if group is None:
+            self.coordinator.release(cid)
+            return
+        # 已接收的提及回复完成后再释放，新持有者重放时不会再回复一次；等待期间不持有self._lock，其它频道照常续约
+        thread = threading.Thread(target=self._handoff, args=(cid, group.connector), name=f"handoff-{cid}", daemon=True)
+        self.handoffs[cid] = thread
+        thread.start()
+
+    def _handoff(self, cid: str, connector, timeout: float = HANDOFF_TIMEOUT):
+        """等待频道已接收的提及回复完成（期间继续续约）后释放租约"""
+        deadline = time.time() + timeout
+        try:
+            while not connector.drain(self.interval):
+                if time.time() >= deadline:
+                    logger.warning(f"[{self.id}] 频道 {cid} 的提及{timeout:.0f}秒内未处理完，不再续约，租约过期后由新持有者接管")
+                    return
+                if not self.coordinator.renew(cid):
+                    return
+            self.coordinator.release(cid)
+        except OSError as e:
+            logger.error(f"[{self.id}] 释放频道 {cid} 的租约失败: {e}")
+        finally:
+            with self._lock:
+                if self.handoffs.get(cid) is threading.current_thread():
+                    del self.handoffs[cid]
+
+    def balance(self):
+        """心跳、续约，并按当前成员重新分配频道"""
+        with self._lock:
+            self.coordinator.heartbeat()
+            desired = set(self.desired())
+            now = time.time()
+
+            for cid in list(self.held):
+                if cid not in desired:
+                    self._drop(cid)
+                    logger.info(f"[{self.id}] 频道 {cid} 已移交")
+                elif self.coordinator.renew(cid):
+                    self.held[cid] = now
+                else:
+                    self._drop(cid, release=False)
+                    logger.warning(f"[{self.id}] 频道 {cid} 的租约已失效，停止回复")
+
+            for cid in self.channels:
+                if cid in desired and cid not in self.held and cid not in self.handoffs and self.coordinator.acquire(cid):
+                    self.held[cid] = now
+                    group = self.bot.add_channel(cid)
+                    group.connector.replay() # 上一个持有者未完成的提及
+                    logger.info(f"[{self.id}] 取得频道 {cid}")
+
+    def reload(self, data: dict):
+        """应用新配置：频道列表的增删留给下一次balance，已持有的频道更新配置"""
+        with self._lock:
+            self.channels = list(dict.fromkeys(data["misskey"].get("channel_id", [])))
+            for cid in [cid for cid in self.held if cid not in self.channels]:
+                self._drop(cid)
+            misskey = dict(data["misskey"], channel_id=[cid for cid in self.channels if cid in self.held])
+            self.bot.reload(dict(data, misskey=misskey))
+
+    def stop(self, *_):
+        self._stopped.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        self.bot.start()
+        logger.info(f"分片工作进程 {self.id} 已启动")
+        try:
+            while not self._stopped.is_set():
+                try:
+                    self.balance()
+                except OSError as e:
+                    logger.error(f"[{self.id}] 访问协调目录失败: {e}")
+                self._stopped.wait(self.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.bot.stop() # 处理并发送完已接收的提及，移交中的频道随之完成
+            for thread in list(self.handoffs.values()):
+                thread.join(timeout=self.interval)
+            with self._lock:
+                for cid in list(self.held):
+                    self.coordinator.release(cid)
+                self.held.clear()
+            self.coordinator.leave()
+            logger.info(f"分片工作进程 {self.id} 已停止")
+
+class ShardSupervisor:
+    '''分片监督进程：启动本机的工作进程，退出的按退避重启，进程数随配置热更新'''
+    def __init__(self, workers: int = SHARD_WORKERS):
+        self.workers = max(0, workers)
+        self.procs: Dict[int, subprocess.Popen] = {} # 序号 -> 工作进程
+        self.started: Dict[int, float] = {} # 序号 -> 最近启动时间
+        self.restarts: Dict[int, int] = {} # 序号 -> 连续重启次数
+        self.next_start: Dict[int, float] = {} # 序号 -> 允许重启的时间
+        self.watcher = ConfigWatcher(self.reload)
+        self._stopped = threading.Event()
+
+    def _spawn(self, index: int):
+        env = dict(os.environ, HUAER_BOT_CONFIG=str(CONFIG_PATH))
+        self.procs[index] = subprocess.Popen([sys.executable, "-m", "misskey_plugin_huaer_bot.shard", "worker", str(index)], env=env)
+        self.started[index] = time.time()
+        logger.info(f"工作进程 {index} 已启动 (pid: {self.procs[index].pid})")
+
+    @staticmethod
+    def _terminate(procs: List[subprocess.Popen], timeout: float = 30.0):
+        """先请求正常退出（释放租约），超时后强制结束"""
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+        deadline = time.time() + timeout
+        for proc in procs:
+            try:
+                proc.wait(max(0.0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+    def scale(self, workers: int):
+        """调整工作进程数，频道由工作进程按新的成员自动重新分配"""
+        self.workers = max(0, workers)
+        extra = [index for index in self.procs if index >= self.workers]
+        self._terminate([self.procs.pop(index) for index in extra])
+        for index in range(self.workers):
+            if index not in self.procs:
+                self._spawn(index)
+
+    def check(self):
+        """重启已退出的工作进程"""
+        now = time.time()
+        for index, proc in list(self.procs.items()):
+            code = proc.poll()
+            if code is None:
+                if now - self.started[index] > RESTART_RESET:
+                    self.restarts[index] = 0
+                continue
+            if index not in self.next_start:
+                delay = backoff_delay(self.restarts.get(index, 0), base=1.0, cap=30.0)
+                self.next_start[index] = now + delay
+                logger.error(f"工作进程 {index} 已退出 (退出码: {code})，{delay:.1f}秒后重启")
+            if now >= self.next_start[index]:
+                del self.next_start[index]
+                self.restarts[index] = self.restarts.get(index, 0) + 1
+                self._spawn(index)
+
+    def reload(self, data: dict):
+        workers = data.get("shard", {}).get("workers", SHARD_WORKERS)
+        if workers != self.workers:
+            logger.info(f"工作进程数 {self.workers} -> {workers}")
+            self.scale(workers)
+
+    def stop(self, *_):
+        self._stopped.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        self.scale(self.workers)
+        self.watcher.start()
+        logger.info(f"分片模式已启动 (工作进程数: {self.workers})，按 Ctrl+C 终止程序...")
+        try:
+            while not self._stopped.wait(1.0):
+                self.check()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.watcher.stop()
+            self._terminate(list(self.procs.values()))
+            self.procs.clear()
+            logger.info("分片模式已停止")
+
+def main(argv: List[str] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    setup_logging()
+    if argv[:1] == ["worker"]:
+        ShardWorker(int(argv[1])).run()
+    else:
+        ShardSupervisor().run()
+
+if __name__ == "__main__":
+    main()
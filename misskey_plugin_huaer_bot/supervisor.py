@@ -0,0 +1,123 @@
+import time
+import inspect
+import logging
+import threading
+from typing import Callable, Iterable, Optional
+from .breaker import backoff_delay
+from .metrics import metrics
+from .config import RECONNECT_BASE, RECONNECT_CAP, RECONNECT_STABLE, PING_INTERVAL, PING_TIMEOUT
+
+logger = logging.getLogger('MisskeyChannelIDFinder')
+
+CONNECTING, CONNECTED, BACKOFF, STOPPED = "connecting", "connected", "backoff", "stopped"
+
+def connect_options(connect) -> dict:
+    """关闭websockets自带的保活ping（由ReconnectSupervisor统一发送并计时），旧版本的同步客户端没有该参数"""
+    try:
+        parameters = inspect.signature(connect).parameters
+    except (TypeError, ValueError):
+        return {}
+    return {"ping_interval": None} if "ping_interval" in parameters else {}
+
+class ReconnectSupervisor:
+    '''
+    重连监督类：记录一条streaming连接的健康状况，决定断线后等待多久再重连
+    1. 无限重试，等待时间为带完全抖动的指数退避（上限cap），服务器同时断开所有连接时各连接错开重连
+    2. 连接保持stable秒以上再断开视为偶发断线，退避从头开始
+    3. 心跳：每ping_interval秒发送WebSocket ping并记录往返时间，ping_timeout秒内没有pong即判定为半开连接
+    '''
+    def __init__(self, channels: Callable[[], Iterable[str]], base: float = RECONNECT_BASE, cap: float = RECONNECT_CAP,
+                 stable: float = RECONNECT_STABLE, ping_interval: float = PING_INTERVAL, ping_timeout: float = PING_TIMEOUT):
+        self.channels = channels # 返回该连接上各频道的指标标签
+        self.base = base
+        self.cap = cap
+        self.stable = stable
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.state = CONNECTING
+        self.attempt = 0 # 连续失败次数，决定下一次的退避上限
+        self.connected_at: Optional[float] = None
+        self.reconnects = 0
+        self.dead = 0 # 判定为半开连接的次数
+        self.rtt: Optional[float] = None # 最近一次ping的往返时间，单位秒
+        self.last_pong: Optional[float] = None
+        self.last_error = ""
+        self._lock = threading.Lock()
+
+    def _gauges(self, channels: Optional[Iterable[str]] = None):
+        online = 1 if self.state == CONNECTED else 0
+        for channel in (self.channels() if channels is None else channels):
+            metrics.set_gauge("stream_connected", online, channel=channel)
+            if self.rtt is not None:
+                metrics.set_gauge("stream_rtt_seconds", self.rtt, channel=channel)
+
+    def publish(self, channels: Optional[Iterable[str]] = None):
+        """重新写入各频道的连接状态指标（如新加入的频道）"""
+        with self._lock:
+            self._gauges(channels)
+
+    # 状态变化
+    def connecting(self):
+        with self._lock:
+            self.state = CONNECTING
+
+    def connected(self):
+        with self._lock:
+            self.state = CONNECTED
+            self.connected_at = time.time()
+            self._gauges()
+
+    def disconnected(self, error: Optional[str] = None) -> float:
+        """连接断开（或未能建立），返回重连前应等待的秒数"""
+        with self._lock:
+            if self.connected_at is not None and time.time() - self.connected_at >= self.stable:
+                self.attempt = 0
+            delay = backoff_delay(self.attempt, self.base, self.cap)
+            self.attempt += 1
+            self.reconnects += 1
+            self.connected_at = None
+            self.state = BACKOFF
+            self.last_error = error or ""
+            channels = list(self.channels())
+            self._gauges(channels)
+        for channel in channels:
+            metrics.inc("reconnects_total", channel=channel)
+        return delay
+
+    def stopped(self):
+        with self._lock:
+            self.state = STOPPED
+            self.connected_at = None
+            self._gauges()
+
+    # 心跳
+    def pong(self, rtt: float):
+        with self._lock:
+            self.rtt = rtt
+            self.last_pong = time.time()
+            channels = list(self.channels())
+            for channel in channels:
+                metrics.set_gauge("stream_rtt_seconds", rtt, channel=channel)
+        metrics.observe("stream_ping_rtt_seconds", rtt) # 直方图另起名字，不与按频道的gauge混为同一指标族
+
+    def timed_out(self):
+        """ping超时：连接已不可用但TCP未断开（半开），由调用方强制关闭后走重连流程"""
+        with self._lock:
+            self.dead += 1
+            channels = list(self.channels())
+        for channel in channels:
+            metrics.inc("dead_connections_total", channel=channel)
+        logger.warning(f"{self.ping_timeout:.0f}秒内未收到pong，判定为半开连接，断开重连")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "uptime": time.time() - self.connected_at if self.connected_at is not None else 0.0,
+                "rtt": self.rtt,
+                "last_pong": self.last_pong,
+                "attempt": self.attempt,
+                "reconnects": self.reconnects,
+                "dead": self.dead,
+                "last_error": self.last_error,
+            }
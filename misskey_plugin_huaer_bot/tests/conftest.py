@@ -0,0 +1,42 @@
+import pytest
+
+class FakeClock:
+    '''可手动拨动的时钟，替换被测模块中的time，monotonic与time返回同一读数'''
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+@pytest.fixture
+def use_clock(monkeypatch, clock):
+    """把被测模块的time换成clock：use_clock(ratelimit, breaker)"""
+    def use(*modules):
+        for module in modules:
+            monkeypatch.setattr(module, "time", clock)
+        return clock
+    return use
+
+@pytest.fixture
+def recorded_metrics():
+    """启用进程级指标并在用例前后清空"""
+    from misskey_plugin_huaer_bot.metrics import metrics
+    enabled = metrics.enabled
+    metrics.enable()
+    metrics.reset()
+    yield metrics
+    metrics.reset()
+    metrics.enabled = enabled
@@ -0,0 +1,65 @@
+import pytest
+from misskey_plugin_huaer_bot import breaker
+from misskey_plugin_huaer_bot.breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN, backoff_delay
+
+@pytest.fixture
+def cb(use_clock):
+    use_clock(breaker)
+    return CircuitBreaker("test", failures=3, p95_threshold=0, open_seconds=30)
+
+def test_opens_after_consecutive_failures(cb, clock):
+    for _ in range(2):
+        cb.record_failure()
+    assert cb.state == CLOSED and cb.allow()
+    cb.record_success(0.1) # 成功后连续失败计数清零
+    for _ in range(3):
+        cb.record_failure()
+    assert cb.state == OPEN
+    assert not cb.allow()
+    assert cb.rejecting(clock.monotonic())
+
+def test_half_open_lets_single_probe_through(cb, clock):
+    for _ in range(3):
+        cb.record_failure()
+    clock.advance(30)
+    assert not cb.rejecting(clock.monotonic())
+    assert cb.allow()
+    assert cb.state == HALF_OPEN
+    assert not cb.allow() # 探测请求返回前不再放行
+    cb.record_success(0.2)
+    assert cb.state == CLOSED
+    assert cb.allow() and cb.allow()
+
+def test_failed_probe_reopens(cb, clock):
+    for _ in range(3):
+        cb.record_failure()
+    clock.advance(30)
+    assert cb.allow()
+    cb.record_failure()
+    assert cb.state == OPEN
+    assert not cb.allow()
+    clock.advance(29)
+    assert not cb.allow()
+    clock.advance(1)
+    assert cb.allow()
+
+def test_cancelled_probe_frees_the_slot(cb, clock):
+    for _ in range(3):
+        cb.record_failure()
+    clock.advance(30)
+    assert cb.allow()
+    cb.cancel()
+    assert cb.allow()
+
+def test_opens_on_p95_latency(use_clock):
+    use_clock(breaker)
+    cb = CircuitBreaker("slow", failures=100, p95_threshold=1.0, open_seconds=10)
+    for _ in range(9):
+        cb.record_success(5.0)
+    assert cb.state == CLOSED # 样本不足10个时不判断
+    cb.record_success(5.0)
+    assert cb.state == OPEN
+
+def test_backoff_is_capped():
+    for attempt in range(20):
+        assert 0 <= backoff_delay(attempt, base=0.5, cap=8.0) <= min(8.0, 0.5 * 2 ** attempt)
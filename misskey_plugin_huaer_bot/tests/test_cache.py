@@ -0,0 +1,43 @@
+import pytest
+from misskey_plugin_huaer_bot import cache
+from misskey_plugin_huaer_bot.cache import ResponseCache, cache_key, normalize_prompt
+
+@pytest.fixture
+def memory_cache(use_clock):
+    use_clock(cache)
+    return ResponseCache(max_entries=2)
+
+def test_ttl(memory_cache, clock):
+    memory_cache.put("k", "v")
+    clock.advance(10)
+    assert memory_cache.get("k", ttl=10) == "v"
+    clock.advance(0.1)
+    assert memory_cache.get("k", ttl=10) is None
+    assert memory_cache.get("k", ttl=0) == "v" # ttl为0时不过期
+    assert (memory_cache.hits, memory_cache.misses) == (2, 1)
+
+def test_lru_eviction(memory_cache):
+    memory_cache.put("a", "1")
+    memory_cache.put("b", "2")
+    assert memory_cache.get("a", 0) == "1" # a变为最近使用
+    memory_cache.put("c", "3")
+    assert memory_cache.get("b", 0) is None
+    assert memory_cache.get("a", 0) == "1"
+    assert memory_cache.get("c", 0) == "3"
+    assert memory_cache.stats()["entries"] == 2
+
+def test_persistence(tmp_path, use_clock):
+    clock = use_clock(cache)
+    path = tmp_path / "cache.sqlite3"
+    ResponseCache(4, path).put("k", "v")
+    assert ResponseCache(4, path).get("k", 60) == "v"
+    clock.advance(61)
+    assert ResponseCache(4, path).get("k", 60) is None
+
+def test_key_ignores_mentions_whitespace_and_case():
+    assert normalize_prompt("@huaer  Hello\n World @a@misskey.io") == "hello world"
+    key = cache_key("m", "persona", [], 512, ["@huaer 你好 World"])
+    assert key == cache_key("m", "persona", [], 512, ["你好  world "])
+    assert key != cache_key("m", "other persona", [], 512, ["你好 world"])
+    assert key != cache_key("m", "persona", [{"role": "user", "content": "x"}], 512, ["你好 world"])
+    assert key != cache_key("m", "persona", [], 256, ["你好 world"])
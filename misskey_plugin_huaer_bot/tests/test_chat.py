@@ -0,0 +1,49 @@
+import pytest
+from misskey_plugin_huaer_bot import chat
+from misskey_plugin_huaer_bot.cache import ResponseCache
+from misskey_plugin_huaer_bot.chat import ChatHandler
+from misskey_plugin_huaer_bot.config import ChatConfig
+
+def handler(cache: bool) -> ChatHandler:
+    return ChatHandler(ChatConfig(1, {"channels": {"cache": cache, "cache_ttl": 600.0, "recall": 0}}))
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(chat, "response_cache", ResponseCache(16))
+
+def prompt(mem: list) -> str:
+    return mem[-1]["content"]
+
+def test_cacheable_prompt_does_not_name_the_asker():
+    bot = handler(cache=True)
+    mem_a, key_a, cached = bot._prepare([("alice", "今天吃什么")], [])
+    assert cached is None and key_a is not None
+    assert "alice" not in prompt(mem_a)
+    bot._cache_store(key_a, "吃鱼喵")
+
+    mem_b, key_b, cached = bot._prepare([("bob", "今天吃什么")], [])
+    assert key_b == key_a and cached == "吃鱼喵"
+    assert prompt(mem_b) == prompt(mem_a) # 两人的请求与缓存回复对应的请求完全相同
+    assert bot._prepare([("carol", "@huaer  今天吃什么")], [])[1] == key_a
+
+def test_uncached_prompt_names_the_asker():
+    mem, key, cached = handler(cache=False)._prepare([("alice", "今天吃什么")], [])
+    assert key is None and cached is None
+    assert prompt(mem) == "用户[alice]: 今天吃什么"
+
+def test_reply_chain_is_not_cached():
+    chain = [{"role": "user", "content": "用户[alice]: 你好"}, {"role": "assistant", "content": "你好喵"}]
+    mem, key, _ = handler(cache=True)._prepare([("alice", "今天吃什么")], chain)
+    assert key is None
+    assert prompt(mem) == "用户[alice]: 今天吃什么"
+
+def test_global_limit_refunds_user_and_channel_tokens(monkeypatch):
+    from misskey_plugin_huaer_bot.ratelimit import RateLimiter
+    monkeypatch.setattr(chat, "rate_limiter", RateLimiter())
+    bot = ChatHandler(ChatConfig(1, {"channels": {"user_burst": 1, "user_rate": 0.001, "cooldown": 1000.0, "channel_burst": 1}}))
+    monkeypatch.setattr(bot, "_get_conversation_chain", lambda note_id: [])
+    monkeypatch.setattr(bot, "_can_call", lambda: True)
+    monkeypatch.setattr(bot, "_guarded_call", lambda mem: chat.LIMITED) # 所选后端的API Key被全局限流
+
+    assert bot.handle_chat("alice", "你好", "n1") == bot._limited("alice")
+    assert bot._check_api_limit("alice") == (0.0, None) # 未被服务的请求不占用户与频道的额度
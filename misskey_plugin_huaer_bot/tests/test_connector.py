@@ -0,0 +1,81 @@
+import pytest
+from concurrent.futures import Future
+from types import SimpleNamespace
+from misskey_plugin_huaer_bot.connector import MisskeyNotificationListener
+
+class FakePoster:
+    '''submit_note返回未完成的Future，由用例决定何时发送完成'''
+    def __init__(self):
+        self.sent = []
+
+    def submit_note(self, text, replyId):
+        future = Future()
+        self.sent.append((replyId, future))
+        return future
+
+def mention(note_id: str, channel: str = "c1") -> dict:
+    note = {"id": note_id, "text": "@huaer 你好", "user": {"id": "u1", "username": "alice"}, "channel": {"id": channel}}
+    return {"type": "channel", "body": {"type": "mention", "body": note}}
+
+def listener(reply="好的喵"):
+    chat = SimpleNamespace(conf=SimpleNamespace(max_age=0), handle_chat=lambda user, content, note_id: reply)
+    poster = FakePoster()
+    return MisskeyNotificationListener("c1", chat, poster), poster
+
+def test_drain_waits_for_sent_reply():
+    connector, poster = listener()
+    connector.coalescer = None
+    connector._dispatch(mention("drain-1"))
+    assert not connector.drain(0.05) # 回复尚未发出
+    (_, future), = poster.sent
+    future.set_result("reply-1")
+    assert connector.drain(0.05)
+
+def test_failed_send_and_skipped_reply_do_not_block_drain():
+    connector, poster = listener()
+    connector.coalescer = None
+    connector._dispatch(mention("drain-2"))
+    poster.sent[0][1].set_result(None) # 发送失败：留给持久化队列重放
+    assert connector.drain(0)
+
+    connector, _ = listener(reply=None)
+    connector.coalescer = None
+    connector._dispatch(mention("drain-3"))
+    assert connector.drain(0)
+
+def failures(recorded_metrics) -> float:
+    return sum(item["value"] for item in recorded_metrics.snapshot()["counters"].get("failures_total", []))
+
+def note(note_id: str) -> dict:
+    return mention(note_id)["body"]["body"]
+
+def test_failures_are_counted_in_both_modes(recorded_metrics):
+    import asyncio
+    from misskey_plugin_huaer_bot.aio import AsyncMisskeyNotificationListener
+
+    class Broken(MisskeyNotificationListener):
+        def on_mention(self, note):
+            raise RuntimeError("boom")
+
+    class AsyncBroken(AsyncMisskeyNotificationListener):
+        async def on_mention(self, note):
+            raise RuntimeError("boom")
+
+    class AsyncPoster:
+        async def submit_note(self, text, replyId):
+            return None # 发送失败
+
+    chat = SimpleNamespace(conf=SimpleNamespace(max_age=0))
+    with pytest.raises(RuntimeError):
+        Broken("c1", chat, FakePoster())._process([note("fail-1")], 0.0)
+    assert failures(recorded_metrics) == 1
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await AsyncBroken("c1", chat, AsyncPoster())._process([note("fail-2")], 0.0)
+        async def handle_chat(user, content, note_id):
+            return "好的喵"
+        sender = AsyncMisskeyNotificationListener("c1", SimpleNamespace(conf=chat.conf, handle_chat=handle_chat), AsyncPoster())
+        await sender._process([note("fail-3")], 0.0)
+    asyncio.run(run())
+    assert failures(recorded_metrics) == 3
@@ -0,0 +1,70 @@
+import time
+import pytest
+from misskey_plugin_huaer_bot.durable import DurableQueue
+
+def note(note_id: str) -> dict:
+    return {"id": note_id, "text": f"@bot {note_id}", "user": {"id": "u1", "username": "alice"}}
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "durable.sqlite3"
+
+def crash(queue: DurableQueue):
+    """模拟进程崩溃：停止写入线程、不做最后一次提交，直接丢掉连接"""
+    queue._stopped.set()
+    queue._writer.join(timeout=5)
+    queue._db.close()
+
+def test_dedup_in_memory():
+    queue = DurableQueue(None, dedup_size=2)
+    assert queue.add("c", note("a"))
+    assert not queue.add("c", note("a"))
+    assert queue.add("c", note("b")) and queue.add("c", note("c"))
+    assert queue.add("c", note("a")) # 超出去重窗口的旧ID被淘汰
+    assert queue.duplicates == 1
+    assert queue.pending("c") == [] # 未启用持久化时不重放
+
+def test_replay_after_crash(path):
+    queue = DurableQueue(path, flush_interval=3600)
+    for note_id in ("n1", "n2", "n3"):
+        queue.add("c1", note(note_id))
+    queue.add("c2", note("m1"))
+    queue.done(["n2"])
+    queue.flush()
+    queue.done(["n3"]) # 最后一个提交周期内的完成标记随崩溃丢失
+    crash(queue)
+
+    restarted = DurableQueue(path, flush_interval=3600)
+    try:
+        assert [n["id"] for n in restarted.pending("c1")] == ["n1", "n3"]
+        assert [n["id"] for n in restarted.pending("c2")] == ["m1"]
+        assert not restarted.add("c1", note("n1")) # 重启后去重索引仍然有效
+        assert restarted.seen("n2")
+        restarted.done(["n1", "n3"])
+        assert restarted.pending("c1") == []
+    finally:
+        restarted.close()
+
+def test_unflushed_mentions_are_lost(path):
+    queue = DurableQueue(path, flush_interval=3600)
+    queue.add("c1", note("n1"))
+    queue.flush()
+    queue.add("c1", note("n2"))
+    crash(queue)
+    restarted = DurableQueue(path, flush_interval=3600)
+    try:
+        assert [n["id"] for n in restarted.pending("c1")] == ["n1"]
+    finally:
+        restarted.close()
+
+def test_stale_mentions_are_not_replayed(path):
+    queue = DurableQueue(path, flush_interval=3600)
+    queue.add("c1", note("old"))
+    queue.flush()
+    with queue._db_lock, queue._db:
+        queue._db.execute("UPDATE mentions SET received = ? WHERE note_id = 'old'", (time.time() - 3600,))
+    queue.add("c1", note("new"))
+    assert [n["id"] for n in queue.pending("c1", max_age=60)] == ["new"]
+    queue.flush()
+    assert [n["id"] for n in queue.pending("c1", max_age=0)] == ["new"] # 过期的提及已标记完成
+    queue.close()
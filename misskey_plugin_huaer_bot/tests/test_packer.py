@@ -0,0 +1,44 @@
+from misskey_plugin_huaer_bot import packer
+from misskey_plugin_huaer_bot.packer import ContextPacker, MESSAGE_OVERHEAD, estimate_tokens, message_tokens
+
+SYSTEM = "你是名叫华尔的猫娘。"
+PINNED = [{"role": "user", "content": "记忆模板"}, {"role": "assistant", "content": "好的喵"}]
+
+def turn(i: int, size: int = 40) -> dict:
+    return {"role": "user" if i % 2 == 0 else "assistant", "content": f"{i:03d}" + "字" * size}
+
+def fixed_cost() -> int:
+    return estimate_tokens(SYSTEM) + MESSAGE_OVERHEAD + sum(message_tokens(m) for m in PINNED)
+
+def test_estimator_by_default():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("你好") == 2
+    assert estimate_tokens("abcdefgh") == 2
+    assert packer._encoding is None # 未设置tokenizer = "tiktoken"时不加载分词器
+
+def test_keeps_pinned_and_newest_turns_under_budget():
+    turns = [turn(i) for i in range(10)]
+    per_turn = message_tokens(turns[0])
+    budget = fixed_cost() + per_turn * 3 + per_turn // 2
+    packed = ContextPacker(budget).pack(SYSTEM, PINNED, turns)
+    assert packed[:len(PINNED)] == PINNED
+    assert packed[len(PINNED):] == turns[-3:]
+    assert fixed_cost() + sum(message_tokens(m) for m in packed[len(PINNED):]) <= budget
+
+def test_latest_turn_kept_even_over_budget():
+    turns = [turn(0), turn(1, size=500)]
+    packed = ContextPacker(fixed_cost() + 10).pack(SYSTEM, PINNED, turns)
+    assert packed == PINNED + turns[-1:]
+
+def test_pinned_kept_when_budget_is_exhausted():
+    turns = [turn(i) for i in range(4)]
+    packed = ContextPacker(1).pack(SYSTEM, PINNED, turns)
+    assert packed == PINNED + turns[-1:]
+
+def test_max_turns():
+    turns = [turn(i, size=1) for i in range(10)]
+    assert ContextPacker(100000, max_turns=4).pack(SYSTEM, PINNED, turns) == PINNED + turns[-4:]
+    assert ContextPacker(100000).pack(SYSTEM, PINNED, turns) == PINNED + turns
+
+def test_no_turns():
+    assert ContextPacker(10).pack(SYSTEM, PINNED, []) == PINNED
@@ -0,0 +1,53 @@
+import pytest
+from misskey_plugin_huaer_bot import ratelimit
+from misskey_plugin_huaer_bot.ratelimit import RateLimiter
+
+@pytest.fixture
+def limiter(use_clock):
+    use_clock(ratelimit)
+    return RateLimiter()
+
+def test_burst_then_reject(limiter):
+    limits = [("user:a", 1.0, 3)]
+    assert [limiter.acquire(limits, 0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire(limits, 0.0) is None
+    assert limiter.limited == 1
+
+def test_refill_at_rate(limiter, clock):
+    limits = [("user:a", 2.0, 1)]
+    assert limiter.acquire(limits, 0.0) == 0.0
+    assert limiter.acquire(limits, 0.0) is None
+    clock.advance(0.5) # 2个/秒，0.5秒补充一个
+    assert limiter.acquire(limits, 0.0) == 0.0
+    clock.advance(10) # 补充不超过突发容量
+    assert limiter.acquire(limits, 0.0) == 0.0
+    assert limiter.acquire(limits, 0.0) is None
+
+def test_queue_reserves_future_tokens(limiter):
+    limits = [("channel:c", 1.0, 1)]
+    assert limiter.acquire(limits, None) == 0.0
+    assert limiter.acquire(limits, None) == pytest.approx(1.0)
+    assert limiter.acquire(limits, None) == pytest.approx(2.0)
+    assert limiter.acquire(limits, 1.5) is None # 超过可等待时间时不消耗令牌
+    assert limiter.acquire(limits, None) == pytest.approx(3.0)
+
+def test_all_buckets_must_pass(limiter):
+    user = ("user:a", 1.0, 5)
+    channel = ("channel:c", 1.0, 1)
+    assert limiter.acquire([user, channel], 0.0) == 0.0
+    assert limiter.acquire([user, channel], 0.0) is None
+    assert limiter.acquire([user], 0.0) == 0.0 # 被拒绝的申请没有消耗用户桶的令牌
+    assert limiter._buckets["user:a"].tokens == pytest.approx(3.0)
+
+def test_zero_rate_is_unlimited(limiter):
+    assert all(limiter.acquire([("global:k", 0, 1)], 0.0) == 0.0 for _ in range(100))
+
+def test_refund_returns_reserved_tokens(limiter):
+    limits = [("user:a", 1.0, 2), ("channel:c", 1.0, 1)]
+    assert limiter.acquire(limits, 0.0) == 0.0
+    assert limiter.acquire(limits, 0.0) is None
+    limiter.refund(limits)
+    assert limiter.acquire(limits, 0.0) == 0.0
+    limiter.refund(limits)
+    limiter.refund(limits) # 不超过突发容量
+    assert limiter._buckets["user:a"].tokens == 2
@@ -0,0 +1,53 @@
+import copy
+import pytest
+from misskey_plugin_huaer_bot import config
+from misskey_plugin_huaer_bot.config import ChatConfig
+from misskey_plugin_huaer_bot.reload import RESTART_SECTIONS, plan_reload, validate_config
+
+BASE = {
+    "api": {"url": "http://llm"},
+    "misskey": {"channel_id": ["c1", "c2"], "api_token": "t", "workers": 8},
+    "channels": {"rd": 6, "tokenizer": "estimate"},
+    "c2": {"rd": 3},
+}
+
+def plan(change):
+    new = copy.deepcopy(BASE)
+    change(new)
+    current = {cid: ChatConfig(cid, BASE) for cid in BASE["misskey"]["channel_id"]}
+    return plan_reload(BASE, new, current)
+
+@pytest.mark.parametrize("section", ["outbox", "drive", "durable", "shard", "long_memory", "record", "metrics", "cache", "http"])
+def test_process_sections_need_restart(section):
+    result = plan(lambda data: data.setdefault(section, {}).update(changed=1))
+    assert section in RESTART_SECTIONS
+    assert result.restart == [section]
+
+def test_channel_changes_apply_without_restart():
+    result = plan(lambda data: data["c2"].update(rd=4) or data["misskey"].update(channel_id=["c2", "c3"], cooldown=5.0))
+    assert result.added == ["c3"] and result.removed == ["c1"]
+    assert list(result.updated) == ["c2"] and result.updated["c2"].rd == 4
+    assert result.restart == []
+
+def test_reloadable_keys_inside_restart_sections():
+    assert plan(lambda data: data.setdefault("shard", {}).update(workers=4)).restart == [] # 由监督进程增减工作进程
+    assert plan(lambda data: data["misskey"].update(workers=16)).restart == ["misskey"]
+
+def test_startup_only_channel_keys_need_restart():
+    assert plan(lambda data: data["channels"].update(tokenizer="tiktoken")).restart == ["channels.tokenizer"]
+
+def test_validate_config():
+    assert validate_config(BASE) == []
+    assert validate_config({"api": {}, "misskey": {"channel_id": "c1"}, "channels": {}}) == ["[misskey] channel_id 应为字符串列表"]
+    bad = copy.deepcopy(BASE)
+    bad["c2"]["rd"] = -1
+    assert validate_config(bad) == ["[c2] rd 应为非负整数"]
+
+def test_broadcast_uses_reloaded_channel_list(monkeypatch):
+    from misskey_plugin_huaer_bot.poster import MisskeyPoster
+    sent = []
+    poster = MisskeyPoster("t")
+    monkeypatch.setattr(poster, "submit_note", lambda text, visibility, cw, priority, channelId: sent.append(channelId))
+    monkeypatch.setattr(config, "CHANNEL_ID", ["new1", "new2"]) # replace_config重新绑定的是config模块中的名字
+    poster.broadcast("公告")
+    assert sent == ["new1", "new2"]
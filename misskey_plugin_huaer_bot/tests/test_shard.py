@@ -0,0 +1,81 @@
+import time
+import threading
+from types import SimpleNamespace
+from misskey_plugin_huaer_bot.shard import Coordinator, HashRing, ShardWorker
+
+KEYS = [f"channel{i}" for i in range(2000)]
+
+def test_owner_is_deterministic():
+    a = HashRing(["w0", "w1", "w2"])
+    b = HashRing(["w2", "w0", "w1", "w0"])
+    assert [a.owner(key) for key in KEYS] == [b.owner(key) for key in KEYS]
+
+def test_empty_ring():
+    assert HashRing([]).owner("channel") is None
+    assert HashRing([]).assign(KEYS) == {}
+
+def test_adding_a_node_only_moves_keys_to_it():
+    before = HashRing(["w0", "w1", "w2"])
+    after = HashRing(["w0", "w1", "w2", "w3"])
+    moved = [key for key in KEYS if before.owner(key) != after.owner(key)]
+    assert all(after.owner(key) == "w3" for key in moved)
+    assert 0.15 < len(moved) / len(KEYS) < 0.35 # 约1/4的key改变归属
+
+def test_removing_a_node_only_moves_its_keys():
+    before = HashRing(["w0", "w1", "w2", "w3"])
+    after = HashRing(["w0", "w1", "w3"])
+    for key in KEYS:
+        if before.owner(key) != "w2":
+            assert after.owner(key) == before.owner(key)
+
+def test_assign_is_balanced():
+    assigned = HashRing(["w0", "w1", "w2", "w3"]).assign(KEYS)
+    assert sorted(sum(assigned.values(), [])) == sorted(KEYS)
+    assert all(350 < len(keys) < 650 for keys in assigned.values())
+
+class FakeConnector:
+    '''drain在done被设置前一直返回False'''
+    def __init__(self):
+        self.done = threading.Event()
+
+    def drain(self, timeout=None) -> bool:
+        return self.done.wait(timeout)
+
+class FakeBot:
+    def __init__(self, **connectors):
+        self.groups = {cid: SimpleNamespace(connector=connector) for cid, connector in connectors.items()}
+
+    def remove_channel(self, cid):
+        return self.groups.pop(cid, None)
+
+def test_lease_is_held_until_inflight_mentions_finish(tmp_path):
+    connector = FakeConnector()
+    worker = ShardWorker(0, directory=tmp_path, ttl=0.3)
+    worker.bot = FakeBot(c1=connector)
+    worker.channels = ["c1"]
+    assert worker.coordinator.acquire("c1")
+    worker.held["c1"] = time.time()
+    other = Coordinator(tmp_path, "other", ttl=0.3)
+
+    with worker._lock:
+        worker._drop("c1")
+    handoff = worker.handoffs["c1"]
+    time.sleep(0.5) # 超过ttl：移交期间仍在续约
+    assert worker.coordinator.holder("c1") == worker.id
+    assert not other.acquire("c1") # 新持有者此时不能接管并重放
+    worker.balance()
+    assert "c1" not in worker.held # 移交中的频道不会被自己重新取得
+
+    connector.done.set()
+    handoff.join(timeout=5)
+    assert worker.coordinator.holder("c1") is None
+    assert "c1" not in worker.handoffs
+    assert other.acquire("c1")
+
+def test_handoff_gives_up_after_timeout(tmp_path):
+    worker = ShardWorker(0, directory=tmp_path, ttl=0.3)
+    assert worker.coordinator.acquire("c1")
+    worker._handoff("c1", FakeConnector(), timeout=0.2)
+    assert worker.coordinator.holder("c1") == worker.id # 不释放，租约过期后由新持有者接管
+    time.sleep(0.4)
+    assert Coordinator(tmp_path, "other", ttl=0.3).acquire("c1")
@@ -0,0 +1,43 @@
+from misskey_plugin_huaer_bot.metrics import PREFIX
+from misskey_plugin_huaer_bot.supervisor import ReconnectSupervisor, CONNECTED, BACKOFF
+
+def families(text: str) -> dict:
+    """解析Prometheus文本：指标族名 -> 类型，同时检查每个样本都属于已声明类型的指标族"""
+    types = {}
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split()
+            assert name not in types, f"{name}重复声明类型"
+            types[name] = kind
+            continue
+        sample = line.split("{")[0].split()[0]
+        kind = types.get(sample)
+        if kind is None:
+            for suffix in ("_bucket", "_sum", "_count"):
+                if sample.endswith(suffix) and types.get(sample[:-len(suffix)]) == "histogram":
+                    kind = "histogram"
+        assert kind is not None, f"{sample}没有所属的TYPE声明"
+    return types
+
+def test_pong_metrics_are_valid_prometheus(recorded_metrics):
+    supervisor = ReconnectSupervisor(lambda: ["c1", "c2"])
+    supervisor.connected()
+    supervisor.pong(0.05)
+    supervisor.pong(0.2)
+    types = families(recorded_metrics.render_prometheus())
+    assert types[f"{PREFIX}stream_rtt_seconds"] == "gauge"
+    assert types[f"{PREFIX}stream_ping_rtt_seconds"] == "histogram"
+    assert types[f"{PREFIX}stream_connected"] == "gauge"
+
+def test_backoff_resets_after_stable_connection(use_clock):
+    from misskey_plugin_huaer_bot import supervisor as module
+    clock = use_clock(module)
+    supervisor = ReconnectSupervisor(lambda: ["c1"], base=1, cap=60, stable=30)
+    for _ in range(5):
+        supervisor.disconnected("boom")
+    assert supervisor.attempt == 5 and supervisor.state == BACKOFF
+    supervisor.connected()
+    assert supervisor.state == CONNECTED
+    clock.advance(30)
+    assert supervisor.disconnected("boom") <= 1 # 稳定运行后断开，退避从头开始
+    assert supervisor.attempt == 1